@@ -1,3 +1,47 @@
-from flask import Flask
-app = Flask(__name__, static_folder='../static', template_folder='../templates')
-app.config['SECRET_KEY']='dev'
+import os
+
+# application factory. Flask and the web-side modules are imported only when an app is
+# built, so headless entry points (python -m app.agent) stay light.
+#   app = create_app()               background threads running
+#   app = create_app(start=False)    call app.extensions['ctm'].start() / .stop() yourself
+def create_app(config=None, start=True):
+    from flask import Flask
+    from .main import bp, setup_logging
+    from .services import Services, WorkerServices
+    app = Flask(__name__, static_folder='../static', template_folder='../templates')
+    app.config['SECRET_KEY']='dev'
+    app.config['CTM_AGENT_TOKEN'] = os.environ.get('CTM_AGENT_TOKEN')
+    app.config['CTM_INTERVAL'] = 2
+    app.config['CTM_COLLECT'] = True
+    # False: serve heuristics until the background load finishes; True: load before returning
+    app.config['CTM_PRELOAD_MODELS'] = False
+    # alerts are also POSTed here as {"alerts": [...]} when set
+    app.config['CTM_ALERT_WEBHOOK'] = os.environ.get('CTM_ALERT_WEBHOOK')
+    # most /api/stream connections per process (each holds a thread); unset: no limit
+    app.config['CTM_STREAM_MAX'] = int(os.environ['CTM_STREAM_MAX']) if os.environ.get('CTM_STREAM_MAX') else None
+    # standalone: everything in this process. sampler / worker: one sampler process publishes to
+    # CTM_SHARED and any number of read-only workers serve from it (python -m app.sampler, gunicorn.conf.py)
+    app.config['CTM_ROLE'] = os.environ.get('CTM_ROLE', 'standalone')
+    # None: shared.SHM_PATH; app.shared is imported only by these two roles (it needs POSIX)
+    app.config['CTM_SHARED'] = os.environ.get('CTM_SHARED')
+    app.config.update(config or {})
+    setup_logging()
+    app.register_blueprint(bp)
+    role = app.config['CTM_ROLE']
+    if role == 'worker':
+        services = WorkerServices(shared=app.config['CTM_SHARED'])
+    elif role in ('standalone', 'sampler'):
+        services = Services(interval=app.config['CTM_INTERVAL'], collect=app.config['CTM_COLLECT'],
+                            preload_models=app.config['CTM_PRELOAD_MODELS'],
+                            alert_webhook=app.config['CTM_ALERT_WEBHOOK'],
+                            shared=_shared_path(app) if role == 'sampler' else None)
+    else:
+        raise ValueError('CTM_ROLE must be standalone, sampler or worker, not %r' % role)
+    app.extensions['ctm'] = services
+    if start:
+        services.start()
+    return app
+
+def _shared_path(app):
+    from .shared import SHM_PATH
+    return app.config['CTM_SHARED'] or SHM_PATH
@@ -0,0 +1,121 @@
+import os, sys, time, socket, threading, argparse
+from collections import deque
+from urllib import request as urlrequest, error as urlerror
+import psutil
+from .snapshot import ProcessScanner
+from .wire import encode_batch, CONTENT_TYPE
+
+# Headless sampling agent: scans processes, batches the snapshots and POSTs them in the
+# compact wire format to an aggregator (the web app's /api/agents/ingest). Imports only
+# psutil and the stdlib; no Flask, numpy, pandas or sklearn.
+#   python -m app.agent --server http://aggregator:5000 [--host-id web-1] [--interval 2] [--batch 5]
+#   python -m app.agent --server http://127.0.0.1:5000 --agents 4     four local agents for testing
+
+INGEST_PATH = '/api/agents/ingest'
+
+def rss_mb():
+    return round(psutil.Process().memory_info().rss / (1 << 20), 1)
+
+class Agent(threading.Thread):
+    def __init__(self, server, host_id=None, interval=2, batch=5, token=None, max_buffer=150, timeout=5,
+                 verbose=False):
+        super().__init__(daemon=True)
+        self.url = server.rstrip('/') + INGEST_PATH
+        self.host_id = host_id or socket.gethostname()
+        self.interval = interval
+        self.batch = batch
+        self.token = token
+        self.timeout = timeout
+        self.verbose = verbose
+        self.scanner = ProcessScanner(deadline=interval * 0.5)
+        # snapshots waiting to be sent; the oldest are dropped while the aggregator is unreachable
+        self.buffer = deque(maxlen=max_buffer)
+        self.running = False
+        self.stats = {'snapshots': 0, 'batches': 0, 'bytes': 0, 'failures': 0, 'dropped': 0, 'last_error': None}
+
+    def sample(self):
+        procs = self.scanner.scan()
+        if len(self.buffer) == self.buffer.maxlen:
+            self.stats['dropped'] += 1
+        self.buffer.append((time.time(), psutil.cpu_percent(interval=None),
+                            psutil.virtual_memory().percent, procs))
+        self.stats['snapshots'] += 1
+
+    def flush(self):
+        if not self.buffer:
+            return True
+        snaps = list(self.buffer)
+        payload = encode_batch(self.host_id, snaps)
+        req = urlrequest.Request(self.url, data=payload, method='POST',
+                                 headers={'Content-Type': CONTENT_TYPE})
+        if self.token:
+            req.add_header('X-CTM-Token', self.token)
+        try:
+            with urlrequest.urlopen(req, timeout=self.timeout) as resp:
+                resp.read()
+        except (urlerror.URLError, OSError) as e:
+            self.stats['failures'] += 1
+            self.stats['last_error'] = str(e)
+            print('[%s] Failed to send %d snapshots: %s' % (self.host_id, len(snaps), e))
+            return False
+        # only drop what was sent; samples taken meanwhile stay queued
+        for _ in snaps:
+            self.buffer.popleft()
+        self.stats['batches'] += 1
+        self.stats['bytes'] += len(payload)
+        self.stats['last_error'] = None
+        if self.verbose:
+            print('[%s] sent %d snapshots, %d rows, %.1f KB (rss %.1f MB)' % (
+                self.host_id, len(snaps), sum(len(s[3]) for s in snaps), len(payload) / 1024, rss_mb()))
+        return True
+
+    def run(self):
+        self.running = True
+        psutil.cpu_percent(interval=None)
+        pending = 0
+        while self.running:
+            started = time.time()
+            try:
+                self.sample()
+                pending += 1
+                if pending >= self.batch:
+                    # on failure the whole buffer is retried with the next batch
+                    self.flush()
+                    pending = 0
+            except Exception as e:
+                print('[%s] Agent tick failed: %s' % (self.host_id, e))
+            time.sleep(max(0, self.interval - (time.time() - started)))
+        self.flush()
+
+    def stop(self):
+        self.running = False
+        self.scanner.close()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Headless process sampling agent')
+    ap.add_argument('--server', required=True, help='aggregator base URL, e.g. http://127.0.0.1:5000')
+    ap.add_argument('--host-id', default=None, help='name shown in the fleet view (default: hostname)')
+    ap.add_argument('--interval', type=float, default=2)
+    ap.add_argument('--batch', type=int, default=5, help='snapshots per upload')
+    ap.add_argument('--token', default=os.environ.get('CTM_AGENT_TOKEN'))
+    ap.add_argument('--agents', type=int, default=1, help='run N agents in this process (<host-id>-1..N)')
+    ap.add_argument('--verbose', action='store_true')
+    args = ap.parse_args(argv)
+    host = args.host_id or socket.gethostname()
+    names = [host] if args.agents == 1 else ['%s-%d' % (host, i + 1) for i in range(args.agents)]
+    agents = [Agent(args.server, name, args.interval, args.batch, args.token, verbose=args.verbose) for name in names]
+    for a in agents:
+        a.start()
+    print('Sending to %s as %s (rss %.1f MB)' % (agents[0].url, ', '.join(names), rss_mb()))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for a in agents:
+            a.stop()
+        for a in agents:
+            a.join(timeout=args.interval + 5)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
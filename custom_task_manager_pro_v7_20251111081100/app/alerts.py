@@ -0,0 +1,91 @@
+import threading, time, json, queue, logging
+from collections import deque
+from urllib import request as urlrequest
+from .metrics import counter
+
+# Sinks for alert events (plain dicts). Each sink has put(events) and must not block the caller:
+# the detector emits from the snapshot engine thread.
+
+ALERTS_SENT = counter('ctm_alert_deliveries', 'Alert events handed to a sink', ['sink', 'result'])
+
+class AlertLog:
+    # bounded in-memory queue read by /api/alerts; every event gets a sequence number so
+    # pollers ask for "everything after seq N"
+    def __init__(self, maxlen=1000):
+        self._events = deque(maxlen=maxlen)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def put(self, events):
+        with self._lock:
+            for e in events:
+                self._seq += 1
+                self._events.append(dict(e, seq=self._seq))
+        ALERTS_SENT.inc(len(events), sink='queue', result='ok')
+
+    def since(self, seq=0, limit=100):
+        # oldest first; the returned cursor is the seq to pass next time
+        with self._lock:
+            out = [e for e in self._events if e['seq'] > seq][:limit]
+            cursor = out[-1]['seq'] if out else self._seq
+        return out, cursor
+
+    def recent(self, limit=100):
+        with self._lock:
+            return list(self._events)[-limit:]
+
+class LoggingSink:
+    def put(self, events):
+        for e in events:
+            logging.warning('ANOMALY pid=%s name=%s score=%.1f %s=%.1f (baseline %.1f)', e['pid'], e['name'],
+                            e['score'], e['feature'], e['value'], e['baseline'])
+
+class WebhookSink(threading.Thread):
+    # POSTs {"alerts": [...]} to url from its own thread; when the queue is full (endpoint down
+    # or slow) new events are dropped rather than stalling detection
+    def __init__(self, url, timeout=5, max_queue=1000, batch=50):
+        super().__init__(daemon=True)
+        self.url = url
+        self.timeout = timeout
+        self.batch = batch
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.running = False
+        self.sent = self.failed = self.dropped = 0
+
+    def put(self, events):
+        for e in events:
+            try:
+                self.queue.put_nowait(e)
+            except queue.Full:
+                self.dropped += 1
+                ALERTS_SENT.inc(sink='webhook', result='dropped')
+
+    def run(self):
+        self.running = True
+        while self.running:
+            try:
+                events = [self.queue.get(timeout=1)]
+            except queue.Empty:
+                continue
+            while len(events) < self.batch:
+                try:
+                    events.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.post(events)
+
+    def post(self, events):
+        body = json.dumps({'alerts': events}).encode('utf-8')
+        req = urlrequest.Request(self.url, data=body, method='POST', headers={'Content-Type': 'application/json'})
+        try:
+            with urlrequest.urlopen(req, timeout=self.timeout) as resp:
+                resp.read()
+            self.sent += len(events)
+            ALERTS_SENT.inc(len(events), sink='webhook', result='ok')
+        except Exception as e:
+            self.failed += len(events)
+            ALERTS_SENT.inc(len(events), sink='webhook', result='failed')
+            print('Failed to deliver %d alerts to %s: %s' % (len(events), self.url, e))
+
+    def stop(self):
+        self.running = False
@@ -1,48 +1,58 @@
-import os, joblib, numpy as np
-MODEL_PATH = os.path.join(os.path.dirname(__file__), '..', 'models', 'anomaly.joblib')
+import numpy as np
+from .snapshot import features_from_info
+from .model_store import load_artifact
+
+def fallback_many(X):
+    # linear score used when no model is trained, over whole columns
+    X = np.asarray(X, dtype=float)
+    cpu, mem, threads, io_r, io_w = X[:, 0], X[:, 1], X[:, 2], X[:, 3], X[:, 4]
+    val = (cpu/100.0)*0.45 + (mem/100.0)*0.3 + (threads/50.0)*0.1 + (io_r+io_w)/1e6*0.15
+    return np.clip(val*100, 0, 100).astype(int)
 
 class AnomalyDetector:
-    def __init__(self):
+    def __init__(self, load=True):
         self.model = None
         self.scaler = None
         self.mean = 0.0
         self.std = 0.08
-        if os.path.exists(MODEL_PATH):
-            try:
-                obj = joblib.load(MODEL_PATH)
-                if isinstance(obj, (list, tuple)) and len(obj) >= 2:
-                    self.model = obj[0]; self.scaler = obj[1]
-                    if len(obj) >= 4:
-                        try:
-                            self.mean = float(obj[2]); self.std = float(obj[3])
-                        except Exception:
-                            pass
-                else:
-                    self.model = obj
-            except Exception as e:
-                print('Failed to load anomaly model:', e)
+        if not load:
+            return
+        try:
+            obj = load_artifact('anomaly')
+            if obj is None:
+                pass
+            elif hasattr(obj, 'meta'):
+                # compiled forest carries its scaler and decision mean/std
+                self.model = obj; self.scaler = obj.scaler
+                self.mean = obj.meta.get('mean', self.mean); self.std = obj.meta.get('std', self.std)
+            elif isinstance(obj, (list, tuple)) and len(obj) >= 2:
+                self.model = obj[0]; self.scaler = obj[1]
+                if len(obj) >= 4:
+                    try:
+                        self.mean = float(obj[2]); self.std = float(obj[3])
+                    except Exception:
+                        pass
+            else:
+                self.model = obj
+        except Exception as e:
+            print('Failed to load anomaly model:', e)
 
     def score(self, info):
-        cpu = info.get('cpu',0); mem = info.get('memory',0); threads = info.get('threads',0)
-        io_r = info.get('io_read',0); io_w = info.get('io_write',0)
-        ctx_v = info.get('ctx_vol',0); ctx_i = info.get('ctx_invol',0)
+        return int(self.score_many(features_from_info(info))[0])
 
+    def score_many(self, X):
+        # X: (n, 8) matrix in snapshot.FEATURES order; the model uses the first 7 columns
+        X = np.asarray(X, dtype=float).reshape(-1, 8)
         if not self.model:
-            val = (cpu/100.0)*0.45 + (mem/100.0)*0.3 + (threads/50.0)*0.1 + (io_r+io_w)/1e6*0.15
-            return int(min(100, max(0, val*100)))
-
+            return fallback_many(X)
+        if len(X) == 0:
+            return np.zeros(0, dtype=int)
         try:
-            import numpy as _np
-            X = _np.array([[cpu, mem, threads, io_r, io_w, ctx_v, ctx_i]])
-            if self.scaler is not None:
-                Xs = self.scaler.transform(X)
-            else:
-                Xs = X
-            raw = float(self.model.decision_function(Xs)[0])
-            mean = self.mean if hasattr(self, 'mean') else 0.0
-            std = self.std if hasattr(self, 'std') else 0.08
-            z = (raw - mean) / (std if std>1e-6 else 1.0)
-            score = int(max(0, min(100, 50 - z * 25)))
-            return score
-        except Exception as e:
-            return 0
+            X7 = X[:, :7]
+            Xs = self.scaler.transform(X7) if self.scaler is not None else X7
+            raw = self.model.decision_function(Xs)
+            std = self.std if self.std > 1e-6 else 1.0
+            z = (raw - self.mean) / std
+            return np.clip(50 - z * 25, 0, 100).astype(int)
+        except Exception:
+            return np.zeros(len(X), dtype=int)
@@ -0,0 +1,160 @@
+import threading
+import numpy as np
+from .history import METRICS
+from .metrics import counter
+
+# Streaming per-process anomaly detection. Each process keeps an EWMA mean and variance of
+# cpu, memory and the io/context-switch *rates* (derived from consecutive snapshots), so a
+# long-lived process is judged against its own recent behaviour instead of a global model,
+# and old cumulative counters no longer look anomalous. One vectorized pass per snapshot.
+
+# snapshot.FEATURES columns in METRICS order; io and ctx columns are counters turned into rates
+_SOURCE = [0, 1, 3, 4, 5, 6]
+_COUNTERS = slice(2, 6)
+# smallest standard deviation per metric, so a flat baseline does not turn noise into huge z
+DEFAULT_FLOORS = {'cpu': 2.0, 'memory': 0.5, 'io_read': 256 << 10, 'io_write': 256 << 10,
+                  'ctx_vol': 200.0, 'ctx_invol': 50.0}
+
+ALERTS = counter('ctm_baseline_alerts', 'Debounced per-process anomaly alerts', ['feature'])
+
+class StreamingDetector:
+    # fixed slot arrays like HistoryStore: (pid, create_time) -> slot, exited processes freed each tick
+    def __init__(self, alpha=0.1, threshold=4.0, consecutive=3, warmup=10, cooldown=300.0,
+                 capacity=16384, floors=None, sinks=()):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.consecutive = consecutive
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.capacity = capacity
+        self.sinks = list(sinks)
+        f = dict(DEFAULT_FLOORS, **(floors or {}))
+        self._floor = np.array([f[m] for m in METRICS], dtype=np.float64)
+        n = len(METRICS)
+        self._mean = np.zeros((capacity, n))
+        self._var = np.zeros((capacity, n))
+        self._prev = np.zeros((capacity, 4))
+        self._n = np.zeros(capacity, dtype=np.int32)
+        self._hot = np.zeros(capacity, dtype=np.int32)
+        self._last_alert = np.zeros(capacity)
+        self._score = np.zeros(capacity)
+        self._top = np.zeros(capacity, dtype=np.int8)
+        self._slots = {}
+        self._free = list(range(capacity - 1, -1, -1))
+        self._last_ts = None
+        self.dropped = 0
+        self.alerts = 0
+        self._lock = threading.Lock()
+
+    def record(self, snap):
+        # snapshot listener: score every process against its baseline, then fold it in
+        procs = snap.procs
+        keys = [(p.pid, p.create_time) for p in procs]
+        X = snap.features()[:, _SOURCE] if procs else np.zeros((0, len(METRICS)))
+        now = snap.timestamp
+        with self._lock:
+            live = set(keys)
+            for k in [k for k in self._slots if k not in live]:
+                s = self._slots.pop(k)
+                self._n[s] = self._hot[s] = 0
+                self._last_alert[s] = self._score[s] = 0
+                self._free.append(s)
+            rows, slots = [], []
+            for i, k in enumerate(keys):
+                s = self._slots.get(k)
+                if s is None:
+                    if not self._free:
+                        self.dropped += 1
+                        continue
+                    s = self._slots[k] = self._free.pop()
+                    self._prev[s] = X[i, _COUNTERS]
+                    continue  # first sighting only primes the counters
+                rows.append(i); slots.append(s)
+            dt = now - self._last_ts if self._last_ts else 0
+            self._last_ts = now
+            if not slots or dt <= 0:
+                for i, k in enumerate(keys):
+                    if k in self._slots:
+                        self._prev[self._slots[k]] = X[i, _COUNTERS]
+                return []
+            slots = np.array(slots)
+            V = X[rows].astype(np.float64)
+            counters = V[:, _COUNTERS].copy()
+            V[:, _COUNTERS] = np.clip(counters - self._prev[slots], 0, None) / dt
+            self._prev[slots] = counters
+
+            mean, var, n = self._mean[slots], self._var[slots], self._n[slots]
+            std = np.maximum(np.sqrt(var), self._floor)
+            z = (V - mean) / std
+            # only upward deviations count; new baselines are not scored until warmed up
+            score = np.where(n >= self.warmup, np.clip(z.max(axis=1), 0, None), 0.0)
+            top = z.argmax(axis=1)
+            # EWMA mean/variance (West); the first rate sample seeds the baseline. Warm samples are
+            # clipped to threshold * std first, so one spike cannot inflate the variance enough to
+            # hide itself on the next tick, while a lasting shift is still learned gradually.
+            first = n == 0
+            band = np.where((n >= self.warmup)[:, None], self.threshold * std, np.inf)
+            diff = np.clip(V - mean, -band, band)
+            incr = self.alpha * diff
+            self._mean[slots] = np.where(first[:, None], V, mean + incr)
+            self._var[slots] = np.where(first[:, None], 0.0, (1 - self.alpha) * (var + diff * incr))
+            self._n[slots] = n + 1
+            self._score[slots] = score
+            self._top[slots] = top
+
+            # debounce: fire once when a process has stayed over the threshold for `consecutive` ticks
+            hot = np.where(score > self.threshold, self._hot[slots] + 1, 0)
+            self._hot[slots] = hot
+            fire = (hot == self.consecutive) & (now - self._last_alert[slots] >= self.cooldown)
+            fired = np.flatnonzero(fire)
+            self._last_alert[slots[fired]] = now
+            events = []
+            for j in fired:
+                p, f = procs[rows[j]], int(top[j])
+                events.append({'timestamp': now, 'pid': p.pid, 'name': p.name, 'user': p.user,
+                               'create_time': p.create_time, 'score': round(float(score[j]), 2),
+                               'feature': METRICS[f], 'value': round(float(V[j, f]), 2),
+                               'baseline': round(float(mean[j, f]), 2)})
+            self.alerts += len(events)
+        if events:
+            for e in events:
+                ALERTS.inc(feature=e['feature'])
+            for sink in self.sinks:
+                try:
+                    sink.put(events)
+                except Exception as e:
+                    print('Alert sink failed:', e)
+        return events
+
+    def score_of(self, key):
+        # latest baseline score for one process, or None while it is not tracked
+        with self._lock:
+            s = self._slots.get(key)
+            if s is None:
+                return None
+            n = int(self._n[s])
+            return {'score': round(float(self._score[s]), 2), 'feature': METRICS[int(self._top[s])],
+                    'samples': n, 'warm': n >= self.warmup, 'hot': int(self._hot[s]),
+                    'mean': dict(zip(METRICS, np.round(self._mean[s], 2).tolist())),
+                    'std': dict(zip(METRICS, np.round(np.sqrt(self._var[s]), 2).tolist()))}
+
+    def columns(self, keys):
+        # score_of() for many processes at once, as arrays keyed like shared.ROW;
+        # baseline_samples is -1 and baseline_feature -1 for untracked processes
+        with self._lock:
+            slots = np.array([self._slots.get(k, -1) for k in keys], dtype=np.int64)
+            ok = slots >= 0
+            s = np.where(ok, slots, 0)
+            n = np.where(ok, self._n[s], -1)
+            return {'baseline': np.where(ok, self._score[s], 0.0), 'baseline_feature': np.where(ok, self._top[s], -1),
+                    'baseline_warm': n >= self.warmup, 'baseline_samples': n,
+                    'baseline_hot': np.where(ok, self._hot[s], 0),
+                    'baseline_mean': np.where(ok[:, None], self._mean[s], 0.0),
+                    'baseline_std': np.where(ok[:, None], np.sqrt(self._var[s]), 0.0)}
+
+    def stats(self):
+        nbytes = sum(a.nbytes for a in (self._mean, self._var, self._prev, self._n, self._hot,
+                                        self._last_alert, self._score, self._top))
+        return {'tracked': len(self._slots), 'capacity': self.capacity, 'bytes': nbytes,
+                'dropped': self.dropped, 'alerts': self.alerts, 'threshold': self.threshold,
+                'alpha': self.alpha, 'consecutive': self.consecutive, 'warmup': self.warmup}
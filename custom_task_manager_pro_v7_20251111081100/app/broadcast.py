@@ -0,0 +1,147 @@
+import threading, time, json
+from collections import deque
+
+def diff_tables(prev, rows):
+    # prev: {pid: row}; returns (added rows, removed pids, changed partial rows)
+    added, changed = [], []
+    seen = set()
+    for r in rows:
+        pid = r['pid']; seen.add(pid)
+        old = prev.get(pid)
+        if old is None:
+            added.append(r)
+        elif old != r:
+            d = {k: v for k, v in r.items() if old.get(k) != v}
+            d['pid'] = pid
+            changed.append(d)
+    removed = [pid for pid in prev if pid not in seen]
+    return added, removed, changed
+
+def _event(kind, payload):
+    return ('event: %s\ndata: %s\n\n' % (kind, json.dumps(payload, separators=(',',':')))).encode('utf-8')
+
+class SnapshotHub(threading.Thread):
+    # turns each engine snapshot into one encoded delta message shared by every
+    # subscriber, so per-tick work does not grow with the number of open dashboards
+    def __init__(self, engine, table_fn, backlog=30, keepalive=15):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.table_fn = table_fn
+        self.keepalive = keepalive
+        self.running = False
+        self.version = 0
+        self._rows = {}
+        self._full = None
+        self._messages = deque(maxlen=backlog)  # (base version, encoded delta)
+        self._subscribers = 0
+        self._cond = threading.Condition()
+
+    def publish(self, snap):
+        rows = self.table_fn(snap)
+        added, removed, changed = diff_tables(self._rows, rows)
+        msg = _event('delta', {'version': snap.version, 'base': self.version,
+                               'added': added, 'removed': removed, 'changed': changed})
+        with self._cond:
+            self._messages.append((self.version, msg))
+            self._rows = {r['pid']: r for r in rows}
+            self._full = None
+            self.version = snap.version
+            self._cond.notify_all()
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    def _full_message(self):
+        # encoded lazily, only when a subscriber joins or falls behind
+        if self._full is None:
+            self._full = _event('full', {'version': self.version, 'rows': list(self._rows.values())})
+        return self._full
+
+    def run(self):
+        self.running = True
+        last = 0
+        while self.running:
+            with self._cond:
+                self._cond.wait_for(lambda: self._subscribers > 0 or not self.running)
+            snap = self.engine.wait(last, timeout=self.keepalive)
+            if snap.version == last:
+                continue
+            last = snap.version
+            try:
+                self.publish(snap)
+            except Exception as e:
+                print('Snapshot broadcast failed:', e)
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+
+    def _reset(self):
+        # run() stops publishing while nobody listens, so the table and delta chain kept from
+        # then (including a tick published just after the last subscriber left) are out of date;
+        # the first subscriber afterwards waits for a full table of the current snapshot instead
+        self.version = 0
+        self._rows = {}
+        self._full = None
+        self._messages.clear()
+
+    def subscribe(self, limit=None):
+        # registers the subscriber right away, so concurrent requests count it, and returns an
+        # iterator of SSE bytes (one full table, then deltas); None when `limit` are connected
+        with self._cond:
+            if limit is not None and self._subscribers >= limit:
+                return None
+            if not self._subscribers:
+                self._reset()
+            self._subscribers += 1
+            self._cond.notify_all()
+        return _Subscription(self)
+
+    def _leave(self):
+        with self._cond:
+            self._subscribers -= 1
+            if not self._subscribers:
+                self._reset()
+
+    def _events(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > 0, self.keepalive)
+            sent = self.version
+            first = self._full_message() if sent else b': waiting\n\n'
+        yield first
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.version > sent, self.keepalive)
+                if self.version == sent:
+                    out = [b': keepalive\n\n']
+                else:
+                    # replay the delta chain starting at our version, or resync if it aged out
+                    bases = [b for b, _ in self._messages]
+                    out = [m for _, m in list(self._messages)[bases.index(sent):]] if sent in bases else None
+                if out is None:
+                    out = [self._full_message()]
+                sent = self.version
+            for m in out:
+                yield m
+
+class _Subscription:
+    # the WSGI server calls close() when the client goes away, even if iteration never started,
+    # so the subscriber is always released (a generator's finally would not run in that case)
+    def __init__(self, hub):
+        self.hub = hub
+        self._events = hub._events()
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._events)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._events.close()
+            self.hub._leave()
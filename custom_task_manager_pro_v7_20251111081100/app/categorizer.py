@@ -1,43 +1,57 @@
-import os, joblib
-MODEL_PATH = os.path.join(os.path.dirname(__file__), '..', 'models', 'categorizer.joblib')
+import numpy as np
+from .snapshot import features_from_info
+from .model_store import load_artifact
+
+# first matching rule wins
+RULES = [
+    (('chrome','firefox'), 'browser'),
+    (('python','node'), 'script'),
+    (('svchost','system'), 'system'),
+    (('vlc','spotify'), 'media'),
+    (('mysql','mongod'), 'database'),
+    (('code','pycharm'), 'ide'),
+    (('onedrive','backup'), 'utility'),
+    (('steam','valorant'), 'game'),
+    (('defender','kaspersky'), 'security'),
+]
 
 def heuristic(name):
     n = (name or '').lower()
-    if 'chrome' in n or 'firefox' in n: return 'browser'
-    if 'python' in n or 'node' in n: return 'script'
-    if 'svchost' in n or 'system' in n: return 'system'
-    if 'vlc' in n or 'spotify' in n: return 'media'
-    if 'mysql' in n or 'mongod' in n: return 'database'
-    if 'code' in n or 'pycharm' in n: return 'ide'
-    if 'onedrive' in n or 'backup' in n: return 'utility'
-    if 'steam' in n or 'valorant' in n: return 'game'
-    if 'defender' in n or 'kaspersky' in n: return 'security'
+    for keys, cat in RULES:
+        if any(k in n for k in keys): return cat
     return 'other'
 
+def heuristic_many(names):
+    # column version of heuristic(); apply rules last-to-first so the first match wins
+    n = np.char.lower(np.array([x or '' for x in names], dtype=str))
+    out = np.full(len(n), 'other', dtype=object)
+    for keys, cat in reversed(RULES):
+        hit = np.zeros(len(n), dtype=bool)
+        for k in keys:
+            hit |= np.char.find(n, k) >= 0
+        out[hit] = cat
+    return out
+
 class Categorizer:
-    def __init__(self):
+    def __init__(self, load=True):
         self.model = None
-        if os.path.exists(MODEL_PATH):
-            try:
-                self.model = joblib.load(MODEL_PATH)
-            except Exception as e:
-                print('Failed to load categorizer model:', e)
+        if not load:
+            return
+        try:
+            self.model = load_artifact('categorizer')
+        except Exception as e:
+            print('Failed to load categorizer model:', e)
 
     def predict(self, info):
-        if not info or (not self.model):
-            return heuristic(info.get('name','') if info else '')
+        if not info:
+            return heuristic('')
+        return self.predict_many(features_from_info(info), [info.get('name','')])[0]
+
+    def predict_many(self, X, names):
+        # X: (n, 8) matrix in snapshot.FEATURES order
+        if not self.model or len(names) == 0:
+            return heuristic_many(names)
         try:
-            X = [[
-                info.get('cpu',0),
-                info.get('memory',0),
-                info.get('threads',0),
-                info.get('io_read',0),
-                info.get('io_write',0),
-                info.get('ctx_vol',0),
-                info.get('ctx_invol',0),
-                info.get('uptime',0)
-            ]]
-            pred = self.model.predict(X)[0]
-            return pred
+            return self.model.predict(np.asarray(X, dtype=float)).astype(object)
         except Exception:
-            return heuristic(info.get('name',''))
+            return heuristic_many(names)
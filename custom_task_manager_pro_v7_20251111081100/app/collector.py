@@ -1,64 +1,50 @@
-import threading, time, csv, os
-import psutil
-from datetime import datetime
-LOG_PATH = os.path.join(os.path.dirname(__file__), '..', 'logs', 'system_data_behavioral.csv')
-
-HEADER = [
-    'timestamp','pid','name','user','cpu','memory','threads',
-    'io_read_bytes','io_write_bytes','ctx_vol','ctx_invol','create_time'
-]
+import threading, time
+from .snapshot import scan_processes
+from .logstore import LOG_PATH, HEADER, get_backend
+from .metrics import LOG_WRITE_SECONDS, LOG_ROWS, INDEX_WRITE_SECONDS
 
 class Collector(threading.Thread):
-    def __init__(self, interval=3):
+    def __init__(self, interval=3, engine=None, backend=None, index=None):
         super().__init__(daemon=True)
         self.interval = interval
+        self.engine = engine
+        self.backend = backend or get_backend()
+        # optional procindex.ProcessIndex fed the same rows for per-process history queries
+        self.index = index
+        self._last_version = 0
         self.running = False
-        os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
-        if not os.path.exists(LOG_PATH):
-            with open(LOG_PATH,'w',newline='',encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow(HEADER)
 
     def gather(self):
-        rows = []
-        for p in psutil.process_iter(['pid','name','username','cpu_percent','memory_percent','num_threads','create_time']):
-            try:
-                info = p.info
-                io = None
-                ctx = None
-                try:
-                    io = p.io_counters()
-                except Exception:
-                    io = None
-                try:
-                    ctx = p.num_ctx_switches()
-                except Exception:
-                    ctx = None
-                rows.append([
-                    datetime.utcnow().isoformat(),
-                    info.get('pid'),
-                    info.get('name'),
-                    info.get('username'),
-                    info.get('cpu_percent') or 0,
-                    round(info.get('memory_percent') or 0,2),
-                    info.get('num_threads') or 0,
-                    getattr(io, 'read_bytes', 0) if io else 0,
-                    getattr(io, 'write_bytes', 0) if io else 0,
-                    getattr(ctx, 'voluntary', 0) if ctx else 0,
-                    getattr(ctx, 'involuntary', 0) if ctx else 0,
-                    info.get('create_time') or 0
-                ])
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
-        return rows
+        # rows in HEADER order with an epoch timestamp; the backend decides the on-disk format
+        # read the engine's current snapshot instead of walking /proc again
+        if self.engine is not None:
+            snap = self.engine.wait(self._last_version, timeout=self.interval)
+            if snap.version == self._last_version:
+                return []
+            self._last_version = snap.version
+            procs, ts = snap.procs, snap.timestamp
+        else:
+            procs, ts = scan_processes(), time.time()
+        return [[ts, p.pid, p.name, p.user, p.cpu, p.memory, p.threads,
+                 p.io_read, p.io_write, p.ctx_vol, p.ctx_invol, p.create_time] for p in procs]
 
     def run(self):
         self.running = True
         while self.running:
             rows = self.gather()
-            with open(LOG_PATH,'a',newline='',encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerows(rows)
+            if rows:
+                try:
+                    with LOG_WRITE_SECONDS.time():
+                        self.backend.write_rows(rows)
+                    LOG_ROWS.inc(len(rows))
+                except Exception as e:
+                    print('Failed to write behavioral log:', e)
+                if self.index is not None:
+                    try:
+                        with INDEX_WRITE_SECONDS.time():
+                            self.index.write_rows(rows)
+                    except Exception as e:
+                        print('Failed to update process index:', e)
             time.sleep(self.interval)
 
     def stop(self):
@@ -0,0 +1,21 @@
+import zlib
+from .logstore import HEADER, iter_log
+
+def stream_csv(backend, start=None, end=None, pid=None, name=None, columns=None, chunksize=50000):
+    # yields CSV text one bounded chunk at a time; memory stays flat regardless of log size.
+    # Legacy CSV rows not migrated into the columnar store yet come first
+    columns = columns or HEADER
+    header = True
+    for df in iter_log(backend, start, end, chunksize=chunksize, pid=pid, name=name):
+        yield df.to_csv(columns=columns, header=header, index=False, date_format='%Y-%m-%dT%H:%M:%S.%f')
+        header = False
+    if header:
+        yield ','.join(columns) + '\n'
+
+def gzip_stream(chunks, level=6):
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk.encode('utf-8'))
+        if out:
+            yield out
+    yield z.flush()
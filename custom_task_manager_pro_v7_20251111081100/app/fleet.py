@@ -0,0 +1,170 @@
+import threading, time
+import numpy as np
+from .snapshot import Snapshot
+from .score_cache import ScoreCache
+from .wire import decode_batch
+from .metrics import FLEET_BATCHES, FLEET_BYTES, FLEET_SCORE_SECONDS
+
+# anomaly score counted as "anomalous" in the fleet summary (the UI's high band)
+ANOMALY_HIGH = 85
+
+class _Batch:
+    # the ScoreCache view of several hosts' snapshots scored in one pass
+    __slots__ = ('procs','_X')
+
+    def __init__(self, procs, X):
+        self.procs = procs; self._X = X
+
+    def __len__(self):
+        return len(self.procs)
+
+    def features(self):
+        return self._X
+
+class HostState:
+    __slots__ = ('host','remote','snapshot','cpu','mem','last_seen','batches','bytes','snapshots',
+                 'rows','scored_version','top','anomalous')
+
+    def __init__(self, host):
+        self.host = host
+        self.remote = None
+        self.snapshot = Snapshot(0, 0.0, ())
+        self.cpu = self.mem = 0.0
+        self.last_seen = 0.0
+        self.batches = self.bytes = self.snapshots = 0
+        self.rows = []
+        self.scored_version = 0
+        self.top = None
+        self.anomalous = 0
+
+class FleetAggregator(threading.Thread):
+    # keeps the latest snapshot per agent and scores every host that sent something new in
+    # one batched model pass per interval; hosts share a ScoreCache keyed by (host, pid, create_time)
+    def __init__(self, registry, interval=2, stale_after=30, forget_after=3600, max_hosts=1000):
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.interval = interval
+        self.stale_after = stale_after
+        self.forget_after = forget_after
+        self.max_hosts = max_hosts
+        self.cache = ScoreCache(max_size=65536, max_age=30.0)
+        self.hosts = {}
+        self.running = False
+        self._dirty = set()
+        self._model_version = None
+        self._cond = threading.Condition()
+
+    def ingest(self, data, remote=None):
+        # decode one agent batch; returns the number of snapshots accepted (ValueError if malformed)
+        host, snaps = decode_batch(data)
+        if not host:
+            raise ValueError('missing host id')
+        with self._cond:
+            st = self.hosts.get(host)
+            if st is None:
+                if len(self.hosts) >= self.max_hosts:
+                    raise ValueError('host limit reached (%d)' % self.max_hosts)
+                st = self.hosts[host] = HostState(host)
+            st.remote = remote
+            st.last_seen = time.time()
+            st.batches += 1
+            st.bytes += len(data)
+            accepted = 0
+            # only the newest snapshot is scored; late or duplicate ones are just counted
+            for ts, cpu, mem, procs in sorted(snaps, key=lambda s: s[0]):
+                if ts <= st.snapshot.timestamp:
+                    continue
+                st.snapshot = Snapshot(st.snapshot.version + 1, ts, procs)
+                st.cpu, st.mem = cpu, mem
+                accepted += 1
+            st.snapshots += accepted
+            if accepted:
+                self._dirty.add(host)
+                self._cond.notify_all()
+        FLEET_BATCHES.inc()
+        FLEET_BYTES.inc(len(data))
+        return accepted
+
+    def score_pending(self):
+        with self._cond:
+            pending = [self.hosts[h] for h in self._dirty if h in self.hosts]
+            self._dirty.clear()
+        if not pending:
+            return 0
+        work = [(st, st.snapshot) for st in pending]
+        procs = [p for _, snap in work for p in snap.procs]
+        if not procs:
+            with self._cond:
+                for st, snap in work:
+                    st.rows, st.top, st.anomalous, st.scored_version = [], None, 0, snap.version
+            return 0
+        keys = [(st.host, p.pid, p.create_time) for st, snap in work for p in snap.procs]
+        X = np.vstack([snap.features() for _, snap in work if len(snap)])
+        m = self.registry.current
+        if m.version != self._model_version:
+            self.cache.clear()
+            self._model_version = m.version
+        with FLEET_SCORE_SECONDS.time():
+            cats, scores, _ = self.cache.score(_Batch(procs, X), m.categorizer, m.anomaly, keys=keys)
+        i, results = 0, []
+        for st, snap in work:
+            rows = []
+            for p in snap.procs:
+                rows.append({'host': st.host, 'pid': p.pid, 'name': p.name, 'user': p.user, 'cpu': p.cpu,
+                             'memory': p.memory, 'threads': p.threads, 'category': cats[i],
+                             'anomaly': scores[i], 'stale': p.stale})
+                i += 1
+            top = max(rows, key=lambda r: r['anomaly']) if rows else None
+            results.append((st, rows, top, sum(1 for r in rows if r['anomaly'] > ANOMALY_HIGH), snap.version))
+        # published together under the lock, so summary() never sees one host half updated
+        with self._cond:
+            for st, rows, top, anomalous, version in results:
+                st.rows, st.top, st.anomalous, st.scored_version = rows, top, anomalous, version
+        return len(procs)
+
+    def prune(self):
+        cutoff = time.time() - self.forget_after
+        with self._cond:
+            for h in [h for h, st in self.hosts.items() if st.last_seen < cutoff]:
+                del self.hosts[h]
+                self._dirty.discard(h)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            with self._cond:
+                self._cond.wait_for(lambda: self._dirty or not self.running, self.interval)
+            try:
+                self.score_pending()
+                self.prune()
+            except Exception as e:
+                print('Fleet scoring failed:', e)
+            # coalesce agents that report within the same interval into one scoring pass
+            time.sleep(self.interval)
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+
+    def summary(self):
+        # built under the lock: ingest() and prune() change the host table from other threads
+        now = time.time()
+        out = []
+        with self._cond:
+            hosts = sorted(self.hosts.values(), key=lambda s: s.host)
+            for st in hosts:
+                top = st.top
+                out.append({'host': st.host, 'remote': st.remote, 'last_seen': st.last_seen,
+                            'age': round(now - st.last_seen, 1), 'online': now - st.last_seen <= self.stale_after,
+                            'timestamp': st.snapshot.timestamp, 'cpu': st.cpu, 'mem': st.mem,
+                            'procs': len(st.snapshot), 'anomalous': st.anomalous,
+                            'top_anomaly': {k: top[k] for k in ('pid', 'name', 'anomaly')} if top else None,
+                            'batches': st.batches, 'snapshots': st.snapshots, 'bytes': st.bytes,
+                            'scored': st.scored_version == st.snapshot.version})
+        return out
+
+    def host_rows(self, host):
+        with self._cond:
+            st = self.hosts.get(host)
+            return None if st is None else st.rows
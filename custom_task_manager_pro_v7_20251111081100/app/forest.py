@@ -0,0 +1,173 @@
+import os, json
+import numpy as np
+
+# Compact inference format for the trained forests: every tree is flattened into shared
+# node arrays saved as .npy files in <name>.forest/. They are memory-mapped on load, so
+# loading takes milliseconds and several workers share one copy of the pages.
+# Leaves point at themselves, so a finished path simply stops moving.
+
+EULER = 0.5772156649015329
+
+def _avg_path_length(n):
+    # expected path length of an unsuccessful BST search (IsolationForest normalisation)
+    n = np.asarray(n, dtype=np.float64)
+    out = np.zeros_like(n)
+    out[n == 2] = 1.0
+    big = n > 2
+    out[big] = 2.0 * (np.log(n[big] - 1.0) + EULER) - 2.0 * (n[big] - 1.0) / n[big]
+    return out
+
+def _depths(tree):
+    depth = np.zeros(tree.node_count, dtype=np.float64)
+    stack = [0]
+    while stack:
+        i = stack.pop()
+        for c in (tree.children_left[i], tree.children_right[i]):
+            if c >= 0:
+                depth[c] = depth[i] + 1
+                stack.append(c)
+    return depth
+
+def _flatten(estimators, leaf_value, features=None):
+    feats, thrs, lefts, rights, values, roots = [], [], [], [], [], []
+    offset, max_depth = 0, 0
+    for k, est in enumerate(estimators):
+        t = est.tree_
+        n = t.node_count
+        leaf = t.children_left < 0
+        own = np.arange(n) + offset
+        f = np.where(leaf, 0, t.feature)
+        if features is not None:
+            f = np.asarray(features[k])[f]
+        feats.append(f.astype(np.int32))
+        thrs.append(np.where(leaf, np.inf, t.threshold))
+        lefts.append(np.where(leaf, own, t.children_left + offset).astype(np.int32))
+        rights.append(np.where(leaf, own, t.children_right + offset).astype(np.int32))
+        values.append(leaf_value(t))
+        roots.append(offset)
+        max_depth = max(max_depth, t.max_depth)
+        offset += n
+    return {'feature': np.concatenate(feats), 'threshold': np.concatenate(thrs),
+            'left': np.concatenate(lefts), 'right': np.concatenate(rights),
+            'value': np.concatenate(values), 'roots': np.array(roots, dtype=np.int32)}, max_depth
+
+def compile_model(obj):
+    # sklearn estimator (or the anomaly (iso, scaler, mean, std) tuple) -> (arrays, meta)
+    from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor, IsolationForest
+    meta = {}
+    model = obj
+    if isinstance(obj, (list, tuple)):
+        model = obj[0]
+        scaler = obj[1] if len(obj) > 1 else None
+        if scaler is not None:
+            meta['scaler_mean'] = np.asarray(scaler.mean_, dtype=float).tolist() if scaler.mean_ is not None else None
+            meta['scaler_scale'] = np.asarray(scaler.scale_, dtype=float).tolist() if scaler.scale_ is not None else None
+        if len(obj) >= 4:
+            meta['mean'] = float(obj[2]); meta['std'] = float(obj[3])
+    if isinstance(model, RandomForestClassifier):
+        def leaf_value(t):
+            v = t.value[:, 0, :].astype(np.float64)
+            return v / np.maximum(v.sum(axis=1, keepdims=True), 1e-12)
+        arrays, depth = _flatten(model.estimators_, leaf_value)
+        meta.update(kind='classifier', classes=[c.item() if hasattr(c, 'item') else c for c in model.classes_])
+    elif isinstance(model, RandomForestRegressor):
+        arrays, depth = _flatten(model.estimators_, lambda t: t.value[:, 0, 0].astype(np.float64))
+        meta.update(kind='regressor')
+    elif isinstance(model, IsolationForest):
+        # trees only see a feature subset when max_features < n_features (same rule as sklearn)
+        subset = getattr(model, '_max_features', model.n_features_in_) != model.n_features_in_
+        leaf_value = lambda t: _depths(t) + _avg_path_length(t.n_node_samples)
+        arrays, depth = _flatten(model.estimators_, leaf_value, model.estimators_features_ if subset else None)
+        max_samples = getattr(model, '_max_samples', getattr(model, 'max_samples_', None))
+        meta.update(kind='isolation', offset=float(model.offset_),
+                    norm=float(_avg_path_length([max_samples])[0]))
+    else:
+        raise TypeError('Cannot compile %s' % type(model).__name__)
+    meta.update(depth=int(depth), n_features=int(model.n_features_in_), trees=len(arrays['roots']))
+    return arrays, meta
+
+def save(path, arrays, meta):
+    os.makedirs(path, exist_ok=True)
+    for k, v in arrays.items():
+        np.save(os.path.join(path, k + '.npy'), v)
+    # meta last: its presence marks a complete artifact
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+class _Scaler:
+    def __init__(self, mean, scale):
+        self.mean = None if mean is None else np.array(mean)
+        self.scale = None if scale is None else np.array(scale)
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.mean is not None: X = X - self.mean
+        if self.scale is not None: X = X / self.scale
+        return X
+
+class CompiledForest:
+    # drop-in for the sklearn objects the model classes use: predict / decision_function
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        load = lambda k: np.load(os.path.join(path, k + '.npy'), mmap_mode='r')
+        self.feature, self.threshold = load('feature'), load('threshold')
+        self.left, self.right, self.value = load('left'), load('right'), load('value')
+        self.roots = np.asarray(load('roots'))
+        self.is_leaf = self.left == np.arange(len(self.left))
+        self.kind = self.meta['kind']
+        self.classes_ = np.array(self.meta['classes'], dtype=object) if self.kind == 'classifier' else None
+        self.scaler = _Scaler(self.meta['scaler_mean'], self.meta.get('scaler_scale')) if 'scaler_mean' in self.meta else None
+
+    def _leaves(self, X):
+        # (n_samples, n_trees) leaf ids; sklearn compares float32 inputs against float64 thresholds.
+        # Only (sample, tree) pairs still inside the tree are advanced at each step
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        n, T = X.shape[0], len(self.roots)
+        Xf = X.ravel()
+        base = np.repeat(np.arange(n) * X.shape[1], T)
+        node = np.tile(self.roots, n)
+        active = np.flatnonzero(~self.is_leaf[node])
+        while active.size:
+            cur = node[active]
+            go_left = Xf[base[active] + self.feature[cur]] <= self.threshold[cur]
+            nxt = np.where(go_left, self.left[cur], self.right[cur])
+            node[active] = nxt
+            active = active[~self.is_leaf[nxt]]
+        return node.reshape(n, T)
+
+    def predict_proba(self, X):
+        return self.value[self._leaves(X)].mean(axis=1)
+
+    def predict(self, X):
+        if self.kind == 'classifier':
+            return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+        return self.value[self._leaves(X)].mean(axis=1)
+
+    def score_samples(self, X):
+        depth = self.value[self._leaves(X)].mean(axis=1)
+        return -(2.0 ** (-depth / self.meta['norm']))
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.meta['offset']
+
+def compile_file(joblib_path, out_path=None):
+    import joblib
+    arrays, meta = compile_model(joblib.load(joblib_path))
+    out_path = out_path or os.path.splitext(joblib_path)[0] + '.forest'
+    save(out_path, arrays, meta)
+    return out_path, meta
+
+if __name__ == '__main__':
+    import argparse, time
+    from .model_store import MODEL_DIR, MODEL_NAMES
+    ap = argparse.ArgumentParser(description='Compile trained forests into memory-mappable arrays')
+    ap.add_argument('--dir', default=MODEL_DIR)
+    args = ap.parse_args()
+    for name in MODEL_NAMES:
+        src = os.path.join(args.dir, name + '.joblib')
+        if not os.path.exists(src):
+            continue
+        started = time.time()
+        out, meta = compile_file(src)
+        print('Compiled %s: %d trees, depth %d -> %s (%.2fs)' % (name, meta['trees'], meta['depth'], out, time.time() - started))
@@ -0,0 +1,94 @@
+import threading
+import numpy as np
+
+# ring columns; io/ctx are stored as per-second rates derived from consecutive counters
+METRICS = ('cpu','memory','io_read','io_write','ctx_vol','ctx_invol')
+# source columns in snapshot.FEATURES order
+_SOURCE = [0, 1, 3, 4, 5, 6]
+_COUNTERS = slice(2, 6)
+
+class HistoryStore:
+    # one preallocated float32 block of shape (slots, metrics, length). Every live process
+    # gets a sample per tick, so all rings share one write position (tick % length)
+    __slots__ = ('length','capacity','tick','dropped','_data','_prev','_start','_times',
+                 '_slots','_free','_last_ts','_lock')
+
+    # allocate(shape, dtype) places the rings read by series_at(), e.g. in shared.Arena memory
+    def __init__(self, length=60, max_bytes=16 << 20, allocate=np.zeros):
+        self.length = length
+        per_slot = len(METRICS) * length * 4 + 4 * 8 + 8
+        self.capacity = max(1, max_bytes // per_slot)
+        self.tick = 0
+        self.dropped = 0
+        self._data = allocate((self.capacity, len(METRICS), length), dtype=np.float32)
+        self._prev = np.zeros((self.capacity, 4), dtype=np.float64)
+        self._start = allocate(self.capacity, dtype=np.int64)
+        self._times = allocate(length, dtype=np.float64)
+        self._slots = {}
+        self._free = list(range(self.capacity - 1, -1, -1))
+        self._last_ts = None
+        self._lock = threading.Lock()
+
+    def record(self, snap):
+        # called once per snapshot; evicts exited processes and appends one sample for the rest
+        keys = [(p.pid, p.create_time) for p in snap.procs]
+        X = snap.features()[:, _SOURCE] if len(keys) else np.zeros((0, len(METRICS)))
+        with self._lock:
+            self.tick += 1
+            pos = self.tick % self.length
+            self._times[pos] = snap.timestamp
+            live = set(keys)
+            for k in [k for k in self._slots if k not in live]:
+                self._free.append(self._slots.pop(k))
+            rows, slots, fresh = [], [], []
+            for i, k in enumerate(keys):
+                s = self._slots.get(k)
+                if s is None:
+                    if not self._free:
+                        self.dropped += 1
+                        continue
+                    s = self._slots[k] = self._free.pop()
+                    self._start[s] = self.tick
+                    fresh.append(len(slots))
+                rows.append(i); slots.append(s)
+            if not slots:
+                self._last_ts = snap.timestamp
+                return
+            slots = np.array(slots); V = X[rows].astype(np.float64)
+            counters = V[:, _COUNTERS].copy()
+            dt = snap.timestamp - self._last_ts if self._last_ts else 0
+            rates = np.clip(counters - self._prev[slots], 0, None) / dt if dt > 0 else np.zeros_like(counters)
+            rates[fresh] = 0
+            V[:, _COUNTERS] = rates
+            self._data[slots, :, pos] = V
+            self._prev[slots] = counters
+            self._last_ts = snap.timestamp
+
+    def series(self, key):
+        # {'timestamps': [...], metric: [...]} oldest first, or None if the process is not tracked
+        with self._lock:
+            s = self._slots.get(key)
+            if s is None:
+                return None
+            return self.series_at(s, self.tick)
+
+    def series_at(self, s, tick):
+        # ring of one slot as of `tick`; workers pass the slot and tick published with the snapshot
+        n = min(tick - int(self._start[s]) + 1, self.length)
+        idx = np.arange(tick - n + 1, tick + 1) % self.length
+        out = {m: np.round(self._data[s, j, idx].astype(np.float64), 2).tolist() for j, m in enumerate(METRICS)}
+        out['timestamps'] = self._times[idx].tolist()
+        return out
+
+    def slots(self, keys):
+        # history slot per (pid, create_time), -1 for untracked processes
+        with self._lock:
+            return np.array([self._slots.get(k, -1) for k in keys], dtype=np.int32)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def stats(self):
+        nbytes = self._data.nbytes + self._prev.nbytes + self._start.nbytes + self._times.nbytes
+        return {'tracked': len(self._slots), 'capacity': self.capacity, 'length': self.length,
+                'bytes': nbytes, 'dropped': self.dropped}
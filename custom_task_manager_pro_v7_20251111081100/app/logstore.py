@@ -0,0 +1,291 @@
+import os, csv, json, time, calendar, threading
+try:
+    import fcntl
+except ImportError:  # Windows: name tables are only serialized within one process
+    fcntl = None
+from datetime import datetime
+import numpy as np
+
+LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'logs')
+LOG_PATH = os.path.join(LOG_DIR, 'system_data_behavioral.csv')
+SEGMENT_DIR = os.path.join(LOG_DIR, 'behavioral')
+
+HEADER = [
+    'timestamp','pid','name','user','cpu','memory','threads',
+    'io_read_bytes','io_write_bytes','ctx_vol','ctx_invol','create_time'
+]
+
+# fixed-width record; name/user are codes into the segment's string table
+RECORD = np.dtype([
+    ('timestamp','<f8'), ('pid','<i4'), ('name','<i4'), ('user','<i4'),
+    ('cpu','<f4'), ('memory','<f4'), ('threads','<i4'),
+    ('io_read_bytes','<i8'), ('io_write_bytes','<i8'), ('ctx_vol','<i8'), ('ctx_invol','<i8'),
+    ('create_time','<f8')
+])
+
+PARTITION = 3600
+PARTITION_FMT = '%Y%m%dT%H'
+
+def _epoch(value):
+    # accepts epoch seconds, ISO strings or datetimes (naive = UTC)
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        return value.timestamp()
+    return calendar.timegm(value.timetuple()) + value.microsecond / 1e6
+
+def _parse_names(text):
+    # one entry per '\n'; a trailing '\r' is the line ending of a table written in text mode on Windows
+    return [n[:-1] if n.endswith('\r') else n for n in text.split('\n')[:-1]]
+
+class CsvBackend:
+    # the original append-only text log
+    kind = 'csv'
+
+    def __init__(self, path=LOG_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not os.path.exists(path):
+            with open(path,'w',newline='',encoding='utf-8') as f:
+                csv.writer(f).writerow(HEADER)
+
+    def write_rows(self, rows):
+        with open(self.path,'a',newline='',encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerows([datetime.utcfromtimestamp(r[0]).isoformat()] + list(r[1:]) for r in rows)
+
+    def iter_chunks(self, start=None, end=None, chunksize=100000, pid=None, name=None):
+        # text log has no index: every query is a full (streamed) scan
+        import pandas as pd
+        start, end = _epoch(start), _epoch(end)
+        if not os.path.exists(self.path):
+            return
+        for df in pd.read_csv(self.path, chunksize=chunksize):
+            df['timestamp'] = pd.to_datetime(df['timestamp'], format='mixed', errors='coerce')
+            if start is not None:
+                df = df[df['timestamp'] >= pd.Timestamp(start, unit='s')]
+            if end is not None:
+                df = df[df['timestamp'] < pd.Timestamp(end, unit='s')]
+            if pid is not None:
+                df = df[df['pid'] == pid]
+            if name is not None:
+                df = df[df['name'] == name]
+            if len(df):
+                yield df
+
+    def read_frame(self, start=None, end=None):
+        return _concat(self.iter_chunks(start, end))
+
+class ColumnarBackend:
+    # hourly segments of fixed-width records (<key>.rec) plus a string table (<key>.names);
+    # segments are memory-mapped on read and pruned by their time key
+    kind = 'columnar'
+
+    def __init__(self, root=SEGMENT_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._codes = {}
+        self._lock = threading.Lock()
+
+    def _key(self, ts):
+        return time.strftime(PARTITION_FMT, time.gmtime(ts))
+
+    def segments(self, start=None, end=None):
+        start, end = _epoch(start), _epoch(end)
+        keys = sorted(f[:-4] for f in os.listdir(self.root) if f.endswith('.rec'))
+        for key in keys:
+            t0 = calendar.timegm(time.strptime(key, PARTITION_FMT))
+            if start is not None and t0 + PARTITION <= start:
+                continue
+            if end is not None and t0 >= end:
+                continue
+            yield key
+
+    def _names(self, key):
+        path = os.path.join(self.root, key + '.names')
+        if not os.path.exists(path):
+            return []
+        # newline='' so only '\n' ends an entry (universal newlines would also split on '\r')
+        with open(path, encoding='utf-8', newline='') as f:
+            return _parse_names(f.read())
+
+    def _encode(self, key, values):
+        # map strings to codes in the segment table, appending unseen ones. Another writer
+        # (migrate_csv next to the collector, or a second process) may append to the same table,
+        # so it is updated under an exclusive flock and re-read whenever it grew behind our cache
+        path = os.path.join(self.root, key + '.names')
+        with open(path, 'a+', encoding='utf-8', newline='') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            size = os.fstat(f.fileno()).st_size
+            codes, cached = self._codes.get(key, (None, -1))
+            if cached != size:
+                f.seek(0)
+                codes = {n: i for i, n in enumerate(_parse_names(f.read()))}
+            new = []
+            out = np.empty(len(values), dtype='<i4')
+            for i, v in enumerate(values):
+                v = '' if v is None else str(v).replace('\n', ' ').replace('\r', ' ')
+                c = codes.get(v)
+                if c is None:
+                    c = codes[v] = len(codes); new.append(v)
+                out[i] = c
+            if new:
+                f.write(''.join(n + '\n' for n in new))
+                f.flush()
+            self._codes = {key: (codes, os.fstat(f.fileno()).st_size)}
+        return out  # the lock goes with the file
+
+    def write_columns(self, cols):
+        ts = np.asarray(cols['timestamp'], dtype=float)
+        if not len(ts):
+            return
+        with self._lock:
+            keys = np.array([self._key(t) for t in ts // PARTITION * PARTITION])
+            for key in np.unique(keys):
+                sel = np.flatnonzero(keys == key)
+                rec = np.zeros(len(sel), dtype=RECORD)
+                for f in HEADER:
+                    col = [cols[f][i] for i in sel] if f in ('name','user') else np.asarray(cols[f])[sel]
+                    rec[f] = self._encode(key, col) if f in ('name','user') else col
+                with open(os.path.join(self.root, key + '.rec'), 'ab') as fh:
+                    rec.tofile(fh)
+
+    def write_rows(self, rows):
+        if rows:
+            self.write_columns(dict(zip(HEADER, zip(*rows))))
+
+    def read_segment(self, key):
+        # zero-copy view of one segment; returns (records, names)
+        path = os.path.join(self.root, key + '.rec')
+        n = os.path.getsize(path) // RECORD.itemsize
+        if n == 0:
+            return np.zeros(0, dtype=RECORD), []
+        return np.memmap(path, dtype=RECORD, mode='r', shape=(n,)), self._names(key)
+
+    def iter_chunks(self, start=None, end=None, chunksize=100000, pid=None, name=None):
+        # segments outside [start, end) are never opened; filters run on the raw
+        # records (name via its code) so only matching rows are decoded
+        import pandas as pd
+        start, end = _epoch(start), _epoch(end)
+        for key in self.segments(start, end):
+            rec, names = self.read_segment(key)
+            if not len(rec):
+                continue
+            mask = np.ones(len(rec), dtype=bool)
+            if start is not None: mask &= rec['timestamp'] >= start
+            if end is not None: mask &= rec['timestamp'] < end
+            if pid is not None: mask &= rec['pid'] == pid
+            if name is not None:
+                codes = [i for i, n in enumerate(names) if n == name]
+                mask &= np.isin(rec['name'], codes)
+            rows = np.flatnonzero(mask)
+            table = np.array(names, dtype=object)
+            for i in range(0, len(rows), chunksize):
+                part = rec[rows[i:i + chunksize]]
+                df = pd.DataFrame({f: part[f] for f in HEADER})
+                df['timestamp'] = pd.to_datetime(part['timestamp'], unit='s')
+                df['name'] = table[part['name']]
+                df['user'] = table[part['user']]
+                yield df
+
+    def read_frame(self, start=None, end=None):
+        return _concat(self.iter_chunks(start, end))
+
+def _concat(chunks):
+    import pandas as pd
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame(columns=HEADER)
+    return pd.concat(chunks, ignore_index=True)
+
+BACKENDS = {'csv': CsvBackend, 'columnar': ColumnarBackend}
+
+def get_backend(kind=None):
+    kind = kind or os.environ.get('CTM_LOG_BACKEND', 'columnar')
+    if kind not in BACKENDS:
+        raise ValueError('Unknown log backend: %s' % kind)
+    return BACKENDS[kind]()
+
+def _migration_path(backend):
+    return os.path.join(backend.root, 'migrated.json')
+
+def migration_state(path=LOG_PATH, backend=None):
+    # (CSV rows already copied into the columnar store, whether the whole file was copied)
+    backend = backend or ColumnarBackend()
+    try:
+        with open(_migration_path(backend), encoding='utf-8') as f:
+            state = json.load(f).get(os.path.abspath(path))
+    except (OSError, ValueError):
+        state = None
+    if not state:
+        return 0, False
+    return state['rows'], state['done']
+
+def _save_migration(backend, path, rows, done):
+    marker = _migration_path(backend)
+    try:
+        with open(marker, encoding='utf-8') as f:
+            states = json.load(f)
+    except (OSError, ValueError):
+        states = {}
+    states[os.path.abspath(path)] = {'rows': rows, 'done': done}
+    with open(marker + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(states, f)
+    os.replace(marker + '.tmp', marker)
+
+def migrate_csv(path=LOG_PATH, backend=None, chunksize=100000):
+    # copy an existing CSV log into the columnar store; returns the number of rows moved.
+    # Progress is recorded per chunk in <root>/migrated.json, so running it again (or after an
+    # interrupted run) only copies CSV rows that were not copied before
+    import pandas as pd
+    backend = backend or ColumnarBackend()
+    done, _ = migration_state(path, backend)
+    total = 0
+    for df in pd.read_csv(path, chunksize=chunksize, skiprows=range(1, done + 1)):
+        read = len(df)
+        ts = pd.to_datetime(df['timestamp'], format='mixed', errors='coerce')
+        df = df[ts.notna()]
+        cols = {f: df[f].fillna(0).to_numpy() for f in HEADER if f not in ('timestamp','name','user')}
+        cols['timestamp'] = (ts[ts.notna()] - pd.Timestamp(0)).dt.total_seconds().to_numpy()
+        cols['name'] = df['name'].tolist(); cols['user'] = df['user'].tolist()
+        backend.write_columns(cols)
+        total += len(df)
+        done += read
+        _save_migration(backend, path, done, False)
+    _save_migration(backend, path, done, True)
+    return total
+
+def iter_log(backend, start=None, end=None, chunksize=100000, pid=None, name=None, csv_path=LOG_PATH):
+    # backend.iter_chunks() preceded by the rows of a legacy CSV log that have not been migrated
+    # into the columnar store yet, so exports and training see them until migrate_csv has run
+    if isinstance(backend, ColumnarBackend) and os.path.exists(csv_path):
+        copied, done = migration_state(csv_path, backend)
+        if not done:
+            # CSV chunks keep their row numbers as index, so rows an interrupted migration copied are skipped
+            for chunk in CsvBackend(csv_path).iter_chunks(start, end, chunksize=chunksize, pid=pid, name=name):
+                chunk = chunk[chunk.index >= copied]
+                if len(chunk):
+                    yield chunk
+    yield from backend.iter_chunks(start, end, chunksize=chunksize, pid=pid, name=name)
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Behavioral log storage tools')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    m = sub.add_parser('migrate', help='copy the CSV log into columnar segments')
+    m.add_argument('--csv', default=LOG_PATH)
+    m.add_argument('--remove', action='store_true', help='delete the CSV after a successful migration')
+    args = ap.parse_args()
+    if args.cmd == 'migrate':
+        n = migrate_csv(args.csv)
+        print('Migrated %d rows to %s' % (n, os.path.abspath(SEGMENT_DIR)))
+        if args.remove:
+            os.remove(args.csv)
@@ -1,126 +1,185 @@
-import os, time, psutil, threading, csv, subprocess
-from flask import render_template, jsonify, request, send_file, Response, make_response
-from . import app
-from .collector import Collector
-from .monitor import SystemMonitor
+import os, time, psutil, itertools, logging, ipaddress
 from pathlib import Path
-import logging, pandas as pd, io, joblib, json
-from collections import defaultdict, deque
+from flask import Blueprint, current_app, render_template, jsonify, request, Response, stream_with_context, g
+from .logstore import HEADER
+from .export import stream_csv, gzip_stream
+from . import proc_query
+from . import metrics
+from .timeseries import parse_duration
 
-LOG_DIR = Path(__file__).parent.parent / 'logs'
-LOG_DIR.mkdir(parents=True, exist_ok=True)
-logging.basicConfig(filename=LOG_DIR/'actions.log', level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+# routes for the web app; create_app() in app/__init__ registers this blueprint and
+# attaches a Services instance (app/services.py) that owns every background thread
+bp = Blueprint('ctm', __name__)
 
-# start collector (writes behavioral logs)
-collector = Collector(interval=3)
-collector.start()
+LOG_DIR = Path(__file__).parent.parent / 'logs'
+MAX_BATCH_BYTES = 32 << 20
+# a process table older than this means the scanner (or the sampler behind a worker) stopped
+STALE_AFTER = 15
 
-# start system monitor for system charts
-monitor = SystemMonitor(interval=2)
-monitor.start()
-app.config['monitor'] = monitor
+def setup_logging():
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(filename=LOG_DIR/'actions.log', level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
-# per-process recent history (in-memory) for sparkline
-process_history = defaultdict(lambda: deque(maxlen=60))
+def _services():
+    return current_app.extensions['ctm']
 
-# ML helpers
-from .categorizer import Categorizer
-from .predictor import LifetimePredictor
-from .anomaly_detector import AnomalyDetector
+@bp.before_app_request
+def _start_timer():
+    g.started = time.perf_counter()
 
-categorizer = Categorizer()
-predictor = LifetimePredictor()
-anomaly = AnomalyDetector()
+@bp.after_app_request
+def _record_latency(resp):
+    started = g.pop('started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, route=route,
+                                        method=request.method, status=resp.status_code)
+    return resp
 
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/api/overview')
+def _snapshot_age():
+    # seconds since the current process table was taken; None before the first one
+    ts = _services().engine.snapshot.timestamp
+    return round(time.time() - ts, 1) if ts else None
+
+@bp.route('/api/overview')
 def overview():
-    mon = app.config.get('monitor')
-    if not mon:
-        return jsonify({'cpu':0,'mem':0,'disk':0,'net_recv':0,'net_sent':0,'procs':0})
-    return jsonify(mon.overview())
+    mon = _services().monitor
+    d = mon.overview() if mon else {'cpu':0,'mem':0,'disk':0,'net_recv':0,'net_sent':0,'procs':0}
+    age = _snapshot_age()
+    return jsonify(dict(d, age=age, stale=age is None or age > STALE_AFTER))
+
+@bp.route('/api/ready')
+def ready():
+    # readiness probe: 503 until there is a process table and whenever it stops being refreshed
+    age = _snapshot_age()
+    if age is None or age > STALE_AFTER:
+        return jsonify({'status':'stale','age':age}), 503
+    return jsonify({'status':'ok','age':age})
+
+@bp.route('/api/overview/history')
+def overview_history():
+    # ?range=1h (s/m/h/d/w, default 1h) &step=5m (optional; at most ~500 points are returned)
+    # {'timestamps': [...], 'cpu': {'min':[...],'avg':[...],'max':[...]}, ...}; net_* in bytes/s
+    try:
+        range_s = parse_duration(request.args.get('range'), 3600)
+        step = parse_duration(request.args.get('step'))
+    except ValueError as e:
+        return jsonify({'error':str(e)}), 400
+    return jsonify(_services().monitor.history(range_s, step))
 
-@app.route('/api/processes')
+@bp.route('/api/processes')
 def processes():
-    procs = []
-    for p in psutil.process_iter(['pid','name','username','cpu_percent','memory_percent','num_threads','create_time']):
-        try:
-            info = p.info
-            pid = info.get('pid')
-            uptime = 0
-            try:
-                uptime = int(time.time() - info.get('create_time', time.time()))
-            except:
-                uptime = 0
-            cpu = info.get('cpu_percent') or 0
-            mem = round(info.get('memory_percent') or 0,2)
-            threads = info.get('num_threads') or 0
-            # append to in-memory history for sparkline
-            try:
-                process_history[pid].append(float(cpu))
-            except Exception:
-                pass
-            # minimal io/ctx retrieval (best-effort)
-            io_read = io_write = ctx_vol = ctx_invol = 0
-            try:
-                io = p.io_counters(); io_read = getattr(io,'read_bytes',0); io_write = getattr(io,'write_bytes',0)
-            except Exception: pass
-            try:
-                ctx = p.num_ctx_switches(); ctx_vol = getattr(ctx,'voluntary',0); ctx_invol = getattr(ctx,'involuntary',0)
-            except Exception: pass
-            info_dict = {'name': info.get('name'), 'cpu': cpu, 'memory': mem, 'threads': threads,
-                         'io_read': io_read, 'io_write': io_write, 'ctx_vol': ctx_vol, 'ctx_invol': ctx_invol, 'uptime': uptime}
-            cat = categorizer.predict(info_dict)
-            a_score = anomaly.score(info_dict)
-            # lifetime will be hidden in main table; included in detail endpoint
-            procs.append({'pid': pid, 'name': info.get('name'), 'user': info.get('username'),
-                          'cpu': cpu, 'memory': mem, 'threads': threads, 'category': cat, 'anomaly': a_score})
-        except (psutil.NoSuchProcess, psutil.AccessDenied):
-            continue
-        except Exception as e:
-            logging.exception('Process iterate error: %s', e)
-            continue
-    procs = sorted(procs, key=lambda x: x['cpu'], reverse=True)
-    return jsonify(procs)
-
-@app.route('/api/process/<int:pid>')
-def process_detail(pid):
-    # find process and build detailed info including lifetime and history
+    # ?sort=<column>&order=asc|desc&limit=&offset=&user=&category=&name=<prefix>&min_anomaly=
+    s = _services()
+    if not request.args:
+        procs = sorted(s.process_table(s.engine.snapshot), key=lambda x: x['cpu'], reverse=True)
+        return jsonify(procs)
     try:
-        p = psutil.Process(pid)
-        info = p.as_dict(attrs=['pid','name','username','cpu_percent','memory_percent','num_threads','create_time'], ad_value=None)
-        uptime = 0
-        try:
-            uptime = int(time.time() - info.get('create_time', time.time()))
-        except:
-            uptime = 0
-        cpu = info.get('cpu_percent') or 0
-        mem = round(info.get('memory_percent') or 0,2)
-        threads = info.get('num_threads') or 0
-        io_read = io_write = ctx_vol = ctx_invol = 0
-        try:
-            io = p.io_counters(); io_read = getattr(io,'read_bytes',0); io_write = getattr(io,'write_bytes',0)
-        except Exception: pass
-        try:
-            ctx = p.num_ctx_switches(); ctx_vol = getattr(ctx,'voluntary',0); ctx_invol = getattr(ctx,'involuntary',0)
-        except Exception: pass
-        info_dict = {'name': info.get('name'), 'cpu': cpu, 'memory': mem, 'threads': threads,
-                     'io_read': io_read, 'io_write': io_write, 'ctx_vol': ctx_vol, 'ctx_invol': ctx_invol, 'uptime': uptime}
-        cat = categorizer.predict(info_dict)
-        life = predictor.predict(info_dict)
-        a_score = anomaly.score(info_dict)
-        history = list(process_history.get(pid, []))
-        return jsonify({'pid':pid,'name':info.get('name'),'user':info.get('username'),'cpu':cpu,'memory':mem,'threads':threads,'uptime':uptime,'category':cat,'lifetime_pred':life,'anomaly':a_score,'history':history})
-    except psutil.NoSuchProcess:
+        q = proc_query.parse(request.args)
+    except ValueError as e:
+        return jsonify({'error':str(e)}), 400
+    snap = s.engine.snapshot
+    idx = proc_query.prefilter(snap, q)
+    if proc_query.needs_scores_first(q):
+        rows = [r for r in s.scored_rows(snap, idx)
+                if (q['category'] is None or r['category'] == q['category'])
+                and (q['min_anomaly'] is None or r['anomaly'] >= q['min_anomaly'])]
+        total = len(rows)
+        procs = proc_query.page(rows, q)
+    else:
+        # page on the raw column first, then score only the rows being returned
+        total = len(idx)
+        procs = s.scored_rows(snap, proc_query.page(idx, q, key=proc_query.raw_key(snap, q['sort'])))
+    resp = jsonify(procs)
+    resp.headers['X-Total-Count'] = str(total)
+    return resp
+
+@bp.route('/api/stream')
+def stream():
+    # server-sent events: one 'full' table, then 'delta' events (added/removed/changed rows).
+    # Each open stream holds a server thread, so CTM_STREAM_MAX caps them per process and
+    # leaves the remaining threads for plain requests; refused dashboards poll /api/processes
+    events = _services().hub.subscribe(limit=current_app.config.get('CTM_STREAM_MAX'))
+    if events is None:
+        return jsonify({'error':'too many live streams; poll /api/processes'}), 503, {'Retry-After': '30'}
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control':'no-cache', 'X-Accel-Buffering':'no'})
+
+@bp.route('/api/process/<int:pid>')
+def process_detail(pid):
+    # served from the latest snapshot; detail and table always agree
+    s = _services()
+    snap = s.engine.snapshot
+    i = snap.index(pid)
+    if i is None:
         return jsonify({'error':'no such process'}), 404
+    try:
+        p = snap.procs[i]
+        d = s.detail(snap, i)
+        return jsonify({'pid':pid,'name':p.name,'user':p.user,'cpu':p.cpu,'memory':p.memory,'threads':p.threads,'stale':p.stale,'uptime':snap.uptime(p),'category':d['category'],'lifetime_pred':d['lifetime_pred'],'anomaly':d['anomaly'],'history':d['series'].get('cpu', []),'series':d['series'],'baseline':d['baseline']})
     except Exception as e:
         logging.exception('Detail error: %s', e)
         return jsonify({'error':str(e)}), 500
 
-@app.route('/api/kill', methods=['POST'])
+@bp.route('/api/process/<int:pid>/history')
+def process_history(pid):
+    # ?range=6h &step=5m &create_time= ; defaults to the live process with this pid, if any
+    # {'timestamps', 'cpu': {'avg','max'}, 'memory': {...}, 'threads', 'io_read'/'io_write' (bytes/s), 'names'}
+    s = _services()
+    try:
+        range_s = parse_duration(request.args.get('range'), 3600)
+        step = parse_duration(request.args.get('step'))
+    except ValueError as e:
+        return jsonify({'error':str(e)}), 400
+    try:
+        ctime = float(request.args['create_time']) if 'create_time' in request.args else None
+    except ValueError:
+        return jsonify({'error':'create_time must be a number'}), 400
+    if ctime is None:
+        snap = s.engine.snapshot
+        i = snap.index(pid)
+        ctime = snap.procs[i].create_time if i is not None else None
+    return jsonify(s.index.pid_history(pid, ctime, range_s, step))
+
+@bp.route('/api/name/<path:name>/history')
+def name_history(name):
+    # ?range=6h &step=5m ; totals over every process with this name, plus the pids seen
+    try:
+        range_s = parse_duration(request.args.get('range'), 3600)
+        step = parse_duration(request.args.get('step'))
+    except ValueError as e:
+        return jsonify({'error':str(e)}), 400
+    return jsonify(_services().index.name_history(name, range_s, step))
+
+@bp.route('/api/index')
+def index_stats():
+    return jsonify(_services().index.stats())
+
+@bp.route('/api/score_cache')
+def score_cache_stats():
+    return jsonify(_services().score_cache.stats())
+
+@bp.route('/api/history_store')
+def history_stats():
+    return jsonify(_services().history.stats())
+
+@bp.route('/api/alerts')
+def alerts_feed():
+    # ?since=<cursor from the previous call> &limit= ; oldest first
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', 100, type=int)
+    events, cursor = _services().alerts.since(since, max(1, min(limit, 1000)))
+    return jsonify({'alerts': events, 'cursor': cursor})
+
+@bp.route('/api/baseline')
+def baseline_stats():
+    return jsonify(_services().detector.stats())
+
+@bp.route('/api/kill', methods=['POST'])
 def kill_proc():
     data = request.get_json() or {}
     pid = int(data.get('pid', -1))
@@ -140,29 +199,133 @@ def kill_proc():
     except Exception as e:
         return jsonify({'status':'error','msg':str(e)}), 500
 
-@app.route('/api/export')
+@bp.route('/api/export')
 def export_csv():
-    behavioral = os.path.join(Path(__file__).parent.parent, 'logs', 'system_data_behavioral.csv')
-    if os.path.exists(behavioral):
-        with open(behavioral,'r',encoding='utf-8') as f:
-            return Response(f.read(), mimetype='text/csv', headers={"Content-Disposition":"attachment; filename=system_data_behavioral.csv"})
-    else:
-        si = io.StringIO()
-        cw = csv.writer(si)
-        cw.writerow(['timestamp','pid','name','user','cpu','memory','threads','io_read_bytes','io_write_bytes','ctx_vol','ctx_invol','create_time'])
-        return make_response(si.getvalue())
+    # ?start=&end= (epoch or ISO, UTC) &pid= &name= &columns=a,b &gzip=1
+    s = _services()
+    args = request.args
+    columns = [c for c in args.get('columns','').split(',') if c] or None
+    bad = [c for c in columns or [] if c not in HEADER]
+    if bad:
+        return jsonify({'error':'unknown columns: ' + ','.join(bad)}), 400
+    try:
+        start, end = args.get('start'), args.get('end')
+        pid = args.get('pid', type=int) if 'pid' in args else None
+        if 'pid' in args and pid is None:
+            raise ValueError('pid must be an integer')
+        rows = stream_csv(s.backend, start, end, pid=pid, name=args.get('name'), columns=columns)
+        first = next(rows)
+    except ValueError as e:
+        return jsonify({'error':str(e)}), 400
+    body = itertools.chain([first], rows)
+    if args.get('gzip') in ('1','true','yes'):
+        return Response(stream_with_context(gzip_stream(body)), mimetype='application/gzip',
+                        headers={"Content-Disposition":"attachment; filename=system_data_behavioral.csv.gz"})
+    return Response(stream_with_context(body), mimetype='text/csv', headers={"Content-Disposition":"attachment; filename=system_data_behavioral.csv"})
 
 # optional train/reload endpoints (kept server-side but not exposed in UI)
-@app.route('/api/reload_models', methods=['POST'])
+@bp.route('/api/reload_models', methods=['POST'])
 def reload_models():
-    global categorizer, predictor, anomaly
+    # returns immediately; requests keep using the current models until the new set is ready
+    s = _services()
+    started = s.models.reload()
+    logging.info('Model reload requested via /api/reload_models')
+    return jsonify({'status':'ok','msg':'Reload started' if started else 'Reload already running; queued'}), 202
+
+@bp.route('/api/models')
+def models_status():
+    return jsonify(_services().models.status())
+
+@bp.route('/api/agents/ingest', methods=['POST'])
+def agent_ingest():
+    # body: wire.encode_batch() payload; X-CTM-Token required when CTM_AGENT_TOKEN is set,
+    # and without a token only agents on this machine may report
+    s = _services()
+    if s.fleet is None:
+        return _on_sampler()
+    token = current_app.config.get('CTM_AGENT_TOKEN')
+    if token and request.headers.get('X-CTM-Token') != token:
+        return jsonify({'error':'bad token'}), 403
+    if not token and not _is_loopback(request.remote_addr):
+        return jsonify({'error':'remote agents require CTM_AGENT_TOKEN'}), 403
+    if (request.content_length or 0) > MAX_BATCH_BYTES:
+        return jsonify({'error':'batch too large'}), 413
+    # a chunked body has no Content-Length, so the cap is enforced on what is actually read
+    data = request.stream.read(MAX_BATCH_BYTES + 1)
+    if len(data) > MAX_BATCH_BYTES:
+        return jsonify({'error':'batch too large'}), 413
     try:
-        categorizer = Categorizer(); predictor = LifetimePredictor(); anomaly = AnomalyDetector()
-        logging.info('Models reloaded via /api/reload_models')
-        return jsonify({'status':'ok','msg':'Models reloaded'})
-    except Exception as e:
-        logging.exception('Failed to reload models: %s', e)
-        return jsonify({'status':'error','msg':str(e)}), 500
+        accepted = s.fleet.ingest(data, request.remote_addr)
+    except ValueError as e:
+        return jsonify({'error':str(e)}), 400
+    return jsonify({'status':'ok','accepted':accepted})
+
+def _is_loopback(addr):
+    try:
+        return ipaddress.ip_address(addr or '').is_loopback
+    except ValueError:
+        return False
+
+def _on_sampler():
+    # read-only workers have no fleet state; agents report to the sampler's own port
+    return jsonify({'error':'fleet endpoints are served by the sampler (python -m app.sampler --port)'}), 503
+
+@bp.route('/api/fleet')
+def fleet_view():
+    s = _services()
+    if s.fleet is None:
+        return _on_sampler()
+    return jsonify({'hosts': s.fleet.summary()})
+
+@bp.route('/api/fleet/<host>/processes')
+def fleet_processes(host):
+    # ?sort=cpu|memory|anomaly|threads &limit=
+    s = _services()
+    if s.fleet is None:
+        return _on_sampler()
+    rows = s.fleet.host_rows(host)
+    if rows is None:
+        return jsonify({'error':'unknown host'}), 404
+    key = request.args.get('sort', 'anomaly')
+    if key not in ('cpu', 'memory', 'anomaly', 'threads'):
+        return jsonify({'error':'sort must be cpu, memory, anomaly or threads'}), 400
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify(sorted(rows, key=lambda r: r[key] or 0, reverse=True)[:max(limit, 0)])
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    return Response(_services().metrics_text(), content_type=metrics.CONTENT_TYPE)
+
+@bp.route('/api/profiler', methods=['GET', 'POST'])
+def profiler_control():
+    # POST {"action":"start","interval":0.01,"duration":60} | {"action":"stop"}
+    # GET ?format=folded (flamegraph input) | json (top frames, default) &limit=
+    s = _services()
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        action = data.get('action')
+        try:
+            if action == 'start':
+                interval = float(data.get('interval', 0.01))
+                duration = float(data['duration']) if data.get('duration') else None
+                if interval <= 0 or (duration is not None and duration <= 0):
+                    raise ValueError('interval and duration must be positive')
+                ok = s.profiler.start(interval=interval, duration=duration)
+            elif action == 'stop':
+                ok = s.profiler.stop()
+            else:
+                raise ValueError('action must be start or stop')
+        except (TypeError, ValueError) as e:
+            return jsonify({'error':str(e)}), 400
+        logging.info('Profiler %s requested (%s)', action, 'ok' if ok else 'no change')
+        return jsonify(dict(s.profiler.status(), changed=ok))
+    p = s.profiler.profiler
+    limit = request.args.get('limit', type=int)
+    if request.args.get('format') == 'folded':
+        return Response(p.folded(limit) if p else '', mimetype='text/plain')
+    return jsonify(dict(s.profiler.status(), top=p.top(limit or 20) if p else []))
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    from . import create_app
+    # no reloader: it would run a second copy of every sampler thread
+    create_app().run(debug=True, port=5000, use_reloader=False)
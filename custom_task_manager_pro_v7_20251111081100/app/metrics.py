@@ -0,0 +1,184 @@
+import threading, time, math
+
+# Minimal Prometheus text-format registry (exposition format 0.0.4), so /metrics needs no
+# extra dependency. Metrics are module-level objects the hot paths update directly; values
+# that already live elsewhere (snapshot size, store stats) are read by callbacks at scrape time.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds; covers sub-millisecond model calls up to multi-second stuck scans
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _fmt(v):
+    if v == math.inf: return '+Inf'
+    if v == -math.inf: return '-Inf'
+    if isinstance(v, float) and v.is_integer() and abs(v) < 1e15: return str(int(v))
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def _escape(v):
+    return str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, _escape(v)) for k, v in pairs) + '}'
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('%s expects labels %s' % (self.name, self.labelnames))
+        return tuple(str(labels[k]) for k in self.labelnames)
+
+    def header(self, name=None):
+        name = name or self.name
+        return ['# HELP %s %s' % (name, self.help.replace('\n', ' ')), '# TYPE %s %s' % (name, self.kind)]
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        # HELP, TYPE and samples all use the exposed <name>_total, so parsers attach them to one family
+        name = self.name + '_total'
+        return self.header(name) + ['%s%s %s' % (name, _labels(self.labelnames, k), _fmt(v)) for k, v in items]
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        # fn() -> number, or {label values tuple: number} for labelled gauges; read at scrape time
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        if self.fn is not None:
+            try:
+                v = self.fn()
+            except Exception as e:
+                print('Metric callback %s failed: %s' % (self.name, e))
+                return []
+            items = sorted(v.items()) if isinstance(v, dict) else [((), v)]
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return self.header() + ['%s%s %s' % (self.name, _labels(self.labelnames, k), _fmt(v)) for k, v in items]
+
+class _Timer:
+    __slots__ = ('hist','labels','started')
+
+    def __init__(self, hist, labels):
+        self.hist = hist; self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.started, **self.labels)
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        # with HIST.time(model='categorizer'): ...
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._values.items())
+        out = self.header()
+        for key, (counts, total, n) in items:
+            acc = 0
+            for b, c in zip(self.buckets, counts):
+                acc += c
+                out.append('%s_bucket%s %d' % (self.name, _labels(self.labelnames, key, [('le', _fmt(b))]), acc))
+            out.append('%s_sum%s %s' % (self.name, _labels(self.labelnames, key), _fmt(total)))
+            out.append('%s_count%s %d' % (self.name, _labels(self.labelnames, key), n))
+        return out
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        # re-registering a name replaces it, so callbacks can be rebound to a new engine/store
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+def gauge(name, help, labelnames=(), fn=None):
+    return REGISTRY.register(Gauge(name, help, labelnames, fn))
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+# hot-path metrics, updated by the modules that own the work
+SCAN_SECONDS = histogram('ctm_scan_duration_seconds', 'Time to read every process for one snapshot tick')
+SCAN_PROBLEMS = counter('ctm_scan_problems', 'Process reads per tick that were stale, AccessDenied or already gone', ['kind'])
+LISTENER_SECONDS = histogram('ctm_snapshot_listener_seconds', 'Time spent in per-snapshot listeners', ['listener'])
+LOG_WRITE_SECONDS = histogram('ctm_log_write_seconds', 'Time to persist one tick of behavioral rows')
+LOG_ROWS = counter('ctm_log_rows', 'Behavioral rows written to the log backend')
+INDEX_WRITE_SECONDS = histogram('ctm_index_write_seconds', 'Time to insert one tick of rows into the process index')
+MODEL_SECONDS = histogram('ctm_model_inference_seconds', 'Batched inference time per model call', ['model'])
+MODEL_ROWS = counter('ctm_model_rows', 'Rows scored per model', ['model'])
+REQUEST_SECONDS = histogram('ctm_http_request_duration_seconds',
+                            'Request latency per route (time to first byte for streamed responses)',
+                            ['route', 'method', 'status'])
+FLEET_BATCHES = counter('ctm_fleet_batches', 'Agent batches ingested')
+FLEET_BYTES = counter('ctm_fleet_bytes', 'Agent batch bytes ingested')
+FLEET_SCORE_SECONDS = histogram('ctm_fleet_score_seconds', 'Time to score all updated hosts in one pass')
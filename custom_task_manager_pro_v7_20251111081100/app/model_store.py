@@ -0,0 +1,124 @@
+import os, threading, time
+
+# CTM_MODEL_DIR points the app at another directory (an empty one gives the heuristic-only path)
+MODEL_DIR = os.environ.get('CTM_MODEL_DIR') or os.path.join(os.path.dirname(__file__), 'models')
+MODEL_NAMES = ('categorizer', 'lifetime', 'anomaly')
+
+def artifact_paths(name):
+    return os.path.join(MODEL_DIR, name + '.joblib'), os.path.join(MODEL_DIR, name + '.forest')
+
+def load_artifact(name):
+    # compiled forest when it is at least as new as the joblib file, else the joblib object;
+    # None when the model has not been trained
+    src, compiled = artifact_paths(name)
+    meta = os.path.join(compiled, 'meta.json')
+    if os.path.exists(meta) and (not os.path.exists(src) or os.path.getmtime(meta) >= os.path.getmtime(src)):
+        from .forest import CompiledForest
+        return CompiledForest(compiled)
+    if os.path.exists(src):
+        import joblib
+        return joblib.load(src)
+    return None
+
+class ModelSet:
+    # the three model objects that are swapped in and out together
+    __slots__ = ('categorizer','predictor','anomaly','version','loaded_at','load_seconds')
+
+    def __init__(self, version, load=True):
+        # load=False builds the heuristic-only set without touching app/models/
+        from .categorizer import Categorizer
+        from .predictor import LifetimePredictor
+        from .anomaly_detector import AnomalyDetector
+        started = time.time()
+        self.categorizer = Categorizer(load)
+        self.predictor = LifetimePredictor(load)
+        self.anomaly = AnomalyDetector(load)
+        self.version = version
+        self.loaded_at = time.time()
+        self.load_seconds = round(self.loaded_at - started, 4)
+
+    def sources(self):
+        def kind(m):
+            if m is None: return 'heuristic'
+            return 'compiled' if type(m).__name__ == 'CompiledForest' else 'sklearn'
+        return {'categorizer': kind(self.categorizer.model), 'lifetime': kind(self.predictor.model),
+                'anomaly': kind(self.anomaly.model)}
+
+class ModelRegistry:
+    # requests read registry.current; reloads build a new ModelSet on a background thread
+    # and publish it with a single reference swap, so no request waits on joblib.load.
+    # preload=False starts on heuristics (version 0) and leaves the first load to reload()
+    def __init__(self, on_swap=None, preload=True):
+        self.on_swap = on_swap
+        self.current = ModelSet(1) if preload else ModelSet(0, load=False)
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._loading = False
+        self._pending = False
+
+    def reload(self):
+        # returns False when a load is already running (it is re-run once that finishes)
+        with self._lock:
+            if self._loading:
+                self._pending = True
+                return False
+            self._loading = True
+        threading.Thread(target=self._load, daemon=True, name='model-reload').start()
+        return True
+
+    def _load(self):
+        while True:
+            try:
+                models = ModelSet(self.current.version + 1)
+                self.current = models
+                self.last_error = None
+                if self.on_swap:
+                    self.on_swap(models)
+            except Exception as e:
+                self.last_error = str(e)
+                print('Failed to reload models:', e)
+            with self._lock:
+                if not self._pending:
+                    self._loading = False
+                    return
+                self._pending = False
+
+    def status(self):
+        m = self.current
+        return {'version': m.version, 'loaded_at': m.loaded_at, 'load_seconds': m.load_seconds,
+                'sources': m.sources(), 'loading': self._loading, 'last_error': self.last_error}
+
+class ModelWatcher(threading.Thread):
+    # polls app/models/ and reloads once a change has stopped moving for one poll,
+    # so half-written files from a training run are never picked up
+    def __init__(self, registry, interval=5):
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.interval = interval
+        self.running = False
+
+    def signature(self):
+        sig = []
+        for name in MODEL_NAMES:
+            for path in artifact_paths(name):
+                path = os.path.join(path, 'meta.json') if path.endswith('.forest') else path
+                try:
+                    st = os.stat(path)
+                    sig.append((path, st.st_size, st.st_mtime))
+                except OSError:
+                    pass
+        return tuple(sig)
+
+    def run(self):
+        self.running = True
+        loaded = seen = self.signature()
+        while self.running:
+            time.sleep(self.interval)
+            sig = self.signature()
+            if sig != loaded and sig == seen:
+                loaded = sig
+                self.registry.reload()
+            seen = sig
+
+    def stop(self):
+        self.running = False
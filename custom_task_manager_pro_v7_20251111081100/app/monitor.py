@@ -1,17 +1,28 @@
 import threading, time, psutil
-from collections import deque
+import numpy as np
+from .timeseries import TieredSeries
+
+# network columns are stored as bytes/s so rollups stay comparable across bucket sizes
+METRICS = ('cpu', 'mem', 'disk', 'net_sent', 'net_recv')
 
 class SystemMonitor(threading.Thread):
-    def __init__(self, interval=2, maxlen=300):
+    def __init__(self, interval=2, path=None, save_every=60, allocate=np.zeros):
         super().__init__(daemon=True)
         self.interval = interval
-        self.cpu = deque(maxlen=maxlen)
-        self.mem = deque(maxlen=maxlen)
-        self.net_sent = deque(maxlen=maxlen)
-        self.net_recv = deque(maxlen=maxlen)
-        self.disk = deque(maxlen=maxlen)
-        self.timestamps = deque(maxlen=maxlen)
+        self.path = path
+        self.save_every = save_every
+        # raw samples for 1h, 1-minute min/avg/max for a day, 10-minute for 30 days
+        self.tiers = ((interval, int(3600 // interval)), (60, 1440), (600, 4320))
+        self.series = TieredSeries(METRICS, tiers=self.tiers, allocate=allocate)
+        self.latest = None
         self._last_net = psutil.net_io_counters()
+        self._last_t = time.time()
+        self.running = False
+        if path:
+            try:
+                self.series.load(path)
+            except Exception as e:
+                print('Failed to load overview history:', e)
 
     def sample(self):
         t = time.time()
@@ -24,17 +35,41 @@ class SystemMonitor(threading.Thread):
             disk = 0
         sent = max(0, net.bytes_sent - self._last_net.bytes_sent)
         recv = max(0, net.bytes_recv - self._last_net.bytes_recv)
+        dt = max(t - self._last_t, 1e-3)
         self._last_net = net
-        self.cpu.append(cpu); self.mem.append(mem); self.net_sent.append(sent); self.net_recv.append(recv); self.disk.append(disk); self.timestamps.append(t)
+        self._last_t = t
+        self.series.add(t, (cpu, mem, disk, sent / dt, recv / dt))
+        self.latest = {'cpu': cpu, 'mem': mem, 'disk': disk, 'net_sent': sent, 'net_recv': recv}
+
+    def save(self):
+        if self.path:
+            try:
+                self.series.save(self.path)
+            except Exception as e:
+                print('Failed to save overview history:', e)
 
     def run(self):
-        while True:
-            self.sample(); time.sleep(self.interval)
+        self.running = True
+        last_save = time.time()
+        while self.running:
+            self.sample()
+            if time.time() - last_save >= self.save_every:
+                self.save()
+                last_save = time.time()
+            time.sleep(self.interval)
+        self.save()
+
+    def stop(self):
+        self.running = False
 
     def overview(self):
-        return {'cpu': round(self.cpu[-1],2) if self.cpu else 0,
-                'mem': round(self.mem[-1],2) if self.mem else 0,
-                'disk': round(self.disk[-1],2) if self.disk else 0,
-                'net_recv': int(self.net_recv[-1]) if self.net_recv else 0,
-                'net_sent': int(self.net_sent[-1]) if self.net_sent else 0,
+        d = self.latest or {}
+        return {'cpu': round(d.get('cpu', 0), 2),
+                'mem': round(d.get('mem', 0), 2),
+                'disk': round(d.get('disk', 0), 2),
+                'net_recv': int(d.get('net_recv', 0)),
+                'net_sent': int(d.get('net_sent', 0)),
                 'procs': len(psutil.pids())}
+
+    def history(self, range_s, step=None):
+        return self.series.query(range_s, step, now=time.time())
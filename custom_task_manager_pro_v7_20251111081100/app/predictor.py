@@ -1,27 +1,35 @@
-import os, joblib
-MODEL_PATH = os.path.join(os.path.dirname(__file__), '..', 'models', 'lifetime.joblib')
+import numpy as np
+from .snapshot import features_from_info
+from .model_store import load_artifact
+
+# model columns: uptime, cpu, memory, threads, io_read, io_write (indices into snapshot.FEATURES)
+COLUMNS = [7, 0, 1, 2, 3, 4]
+
+def fallback_many(X):
+    X = np.asarray(X, dtype=float)
+    uptime, cpu, mem = X[:, 7], X[:, 0], X[:, 1]
+    return np.clip((uptime * 0.05) + (100 - cpu) * 8 - mem * 2, 60, 86400).astype(int)
 
 class LifetimePredictor:
-    def __init__(self):
+    def __init__(self, load=True):
         self.model = None
-        if os.path.exists(MODEL_PATH):
-            try:
-                self.model = joblib.load(MODEL_PATH)
-            except Exception as e:
-                print('Failed to load lifetime model:', e)
+        if not load:
+            return
+        try:
+            self.model = load_artifact('lifetime')
+        except Exception as e:
+            print('Failed to load lifetime model:', e)
 
     def predict(self, info):
-        if not self.model:
-            uptime = info.get('uptime',0)
-            cpu = info.get('cpu',0)
-            mem = info.get('memory',0)
-            return int(max(60, min(86400, (uptime * 0.05) + (100 - cpu) * 8 - mem * 2)))
+        return int(self.predict_many(features_from_info(info))[0])
+
+    def predict_many(self, X):
+        # X: (n, 8) matrix in snapshot.FEATURES order
+        X = np.asarray(X, dtype=float).reshape(-1, 8)
+        if not self.model or len(X) == 0:
+            return fallback_many(X)
         try:
-            X = [[
-                info.get('uptime',0), info.get('cpu',0), info.get('memory',0), info.get('threads',0),
-                info.get('io_read',0), info.get('io_write',0)
-            ]]
-            pred = self.model.predict(X)[0]
-            return int(max(1, pred))
+            pred = self.model.predict(X[:, COLUMNS])
+            return np.maximum(1, pred).astype(int)
         except Exception:
-            return int(max(60, min(86400, (info.get('uptime',0) * 0.05) + (100 - info.get('cpu',0)) * 8 - info.get('memory',0) * 2)))
+            return fallback_many(X)
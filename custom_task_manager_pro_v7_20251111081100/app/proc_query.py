@@ -0,0 +1,58 @@
+import heapq
+
+# columns available straight from the snapshot, vs. ones that need model output
+RAW_COLUMNS = ('pid','name','user','cpu','memory','threads')
+SCORED_COLUMNS = ('category','anomaly')
+COLUMNS = RAW_COLUMNS + SCORED_COLUMNS
+
+def parse(args):
+    # request.args -> query dict; raises ValueError on bad input
+    q = {'sort': args.get('sort', 'cpu'), 'order': args.get('order', 'desc'),
+         'user': args.get('user') or None, 'category': args.get('category') or None,
+         'name': (args.get('name') or '').lower() or None}
+    if q['sort'] not in COLUMNS:
+        raise ValueError('sort must be one of: ' + ','.join(COLUMNS))
+    if q['order'] not in ('asc','desc'):
+        raise ValueError('order must be asc or desc')
+    for k in ('limit','offset'):
+        v = args.get(k)
+        q[k] = int(v) if v not in (None, '') else None
+        if q[k] is not None and q[k] < 0:
+            raise ValueError('%s must be >= 0' % k)
+    v = args.get('min_anomaly')
+    q['min_anomaly'] = float(v) if v not in (None, '') else None
+    return q
+
+def prefilter(snap, q):
+    # indices of processes passing the filters that need no model output
+    user, name = q['user'], q['name']
+    if user is None and name is None:
+        return list(range(len(snap)))
+    return [i for i, p in enumerate(snap.procs)
+            if (user is None or p.user == user) and (name is None or (p.name or '').lower().startswith(name))]
+
+def _nonnull(v):
+    # None sorts below every value; strings and numbers never mix within one column
+    return (v is not None, v if v is not None else 0)
+
+def row_key(col):
+    return lambda r: _nonnull(r[col])
+
+def raw_key(snap, col):
+    # orders snapshot indices by a raw column without building rows
+    return lambda i: _nonnull(getattr(snap.procs[i], col))
+
+def page(items, q, key=None):
+    # heap-based partial sort: only offset+limit items are ordered
+    key = key or row_key(q['sort'])
+    offset = q['offset'] or 0
+    if q['limit'] is None:
+        ordered = sorted(items, key=key, reverse=q['order'] == 'desc')
+        return ordered[offset:]
+    n = offset + q['limit']
+    pick = heapq.nlargest if q['order'] == 'desc' else heapq.nsmallest
+    return pick(n, items, key=key)[offset:]
+
+def needs_scores_first(q):
+    # model output must exist before paging when it filters or orders the table
+    return q['sort'] in SCORED_COLUMNS or q['category'] is not None or q['min_anomaly'] is not None
@@ -0,0 +1,267 @@
+import os, time, math, calendar, sqlite3, threading
+import numpy as np
+from .logstore import LOG_DIR, PARTITION_FMT
+
+INDEX_PATH = os.path.join(LOG_DIR, 'process_index.db')
+MAX_POINTS = 500
+
+# SQLite index over the behavioral log for per-process and per-name history. Rows are written to
+# hourly raw_<hour> tables; once an hour is complete it is rolled up into per-minute min_<day>
+# tables, and expired partitions are dropped whole, so retention is a DROP TABLE instead of a
+# large DELETE and the file stays bounded (dropped pages are reused by later partitions).
+#   raw:  every collector sample, kept raw_retention (6h)
+#   min:  one row per process per minute (count, sums and maxima), kept rollup_retention (7d)
+
+_RAW_COLS = 'ts REAL, pid INTEGER, ctime REAL, name INTEGER, cpu REAL, mem REAL, threads INTEGER, ' \
+            'io_r INTEGER, io_w INTEGER, ctx_v INTEGER, ctx_i INTEGER'
+_MIN_COLS = 'ts REAL, pid INTEGER, ctime REAL, name INTEGER, n INTEGER, cpu REAL, cpu_max REAL, ' \
+            'mem REAL, mem_max REAL, threads INTEGER, io_r INTEGER, io_w INTEGER, ctx_v INTEGER, ctx_i INTEGER'
+# both partition kinds read with the same columns, so one query can span raw hours and rollups
+_SELECT = {'raw': 'ts, pid, ctime, name, 1 AS n, cpu AS cpu_sum, cpu AS cpu_max, mem AS mem_sum, mem AS mem_max, '
+                  'threads, io_r, io_w',
+           'min': 'ts, pid, ctime, name, n, cpu AS cpu_sum, cpu_max, mem AS mem_sum, mem_max, threads, io_r, io_w'}
+_DAY_FMT = '%Y%m%d'
+
+def _hour_key(ts):
+    return time.strftime(PARTITION_FMT, time.gmtime(ts))
+
+def _key_start(key):
+    fmt = PARTITION_FMT if 'T' in key else _DAY_FMT
+    return float(calendar.timegm(time.strptime(key, fmt)))
+
+class IndexCompactor(threading.Thread):
+    # rolls up finished hours and drops expired partitions off the collector thread; the
+    # collector's inserts only wait for SQLite's write lock while a rollup commits
+    def __init__(self, index, interval=60):
+        super().__init__(daemon=True)
+        self.index = index
+        self.interval = interval
+        self.running = False
+
+    def run(self):
+        self.running = True
+        last_hour = None
+        while self.running:
+            hour = _hour_key(time.time())
+            if hour != last_hour:
+                try:
+                    self.index.compact()
+                    last_hour = hour
+                except Exception as e:
+                    print('Failed to compact process index:', e)
+            for _ in range(int(self.interval)):
+                if not self.running:
+                    break
+                time.sleep(1)
+
+    def stop(self):
+        self.running = False
+
+class ProcessIndex:
+    def __init__(self, path=INDEX_PATH, raw_retention=6 * 3600, rollup_retention=7 * 86400):
+        self.path = path
+        self.raw_retention = raw_retention
+        self.rollup_retention = rollup_retention
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._names = {}
+        db = self._db()
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT UNIQUE)')
+        db.execute('CREATE TABLE IF NOT EXISTS rolled (hour TEXT PRIMARY KEY)')
+        db.commit()
+
+    def _db(self):
+        # one connection per thread; WAL lets readers run while the collector writes
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=10)
+            db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def partitions(self, kind):
+        rows = self._db().execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+        return sorted(r[0][len(kind) + 1:] for r in rows if r[0].startswith(kind + '_'))
+
+    def _create(self, db, kind, key):
+        table = '%s_%s' % (kind, key)
+        # clustered on (pid, ts) so a pid lookup is one range read; names get a secondary index
+        db.execute('CREATE TABLE IF NOT EXISTS %s (%s, PRIMARY KEY (pid, ts, ctime)) WITHOUT ROWID'
+                   % (table, _RAW_COLS if kind == 'raw' else _MIN_COLS))
+        db.execute('CREATE INDEX IF NOT EXISTS %s_name ON %s (name, ts)' % (table, table))
+        return table
+
+    def _name_ids(self, db, names):
+        ids = []
+        for n in names:
+            n = n or ''
+            i = self._names.get(n)
+            if i is None:
+                db.execute('INSERT OR IGNORE INTO names (name) VALUES (?)', (n,))
+                i = self._names[n] = db.execute('SELECT id FROM names WHERE name=?', (n,)).fetchone()[0]
+            ids.append(i)
+        return ids
+
+    def write_rows(self, rows):
+        # rows in logstore.HEADER order; one transaction per hour partition touched
+        if not rows:
+            return
+        with self._lock:
+            db = self._db()
+            by_hour = {}
+            for r in rows:
+                by_hour.setdefault(_hour_key(r[0]), []).append(r)
+            with db:
+                names = list({r[2] or '' for r in rows})
+                ids = dict(zip(names, self._name_ids(db, names)))
+                for key, part in by_hour.items():
+                    table = self._create(db, 'raw', key)
+                    db.executemany('INSERT OR REPLACE INTO %s VALUES (?,?,?,?,?,?,?,?,?,?,?)' % table,
+                                   [(r[0], r[1], r[11] or 0, ids[r[2] or ''], r[4], r[5], r[6],
+                                     r[7], r[8], r[9], r[10]) for r in part])
+
+    def compact(self, now=None):
+        # roll up every complete raw hour not rolled up yet, then drop partitions past retention
+        now = time.time() if now is None else now
+        db = self._db()
+        current = _hour_key(now)
+        rolled = {r[0] for r in db.execute('SELECT hour FROM rolled')}
+        for key in self.partitions('raw'):
+            if key < current and key not in rolled:
+                # one row per (pid, ctime, minute): a process that execs keeps its pid and ctime but
+                # changes name, so the minute keeps one of its names instead of splitting the key
+                try:
+                    with db:
+                        day = self._create(db, 'min', key[:8])
+                        db.execute('INSERT OR REPLACE INTO %s SELECT CAST(ts / 60 AS INTEGER) * 60, pid, ctime, '
+                                   'max(name), count(*), sum(cpu), max(cpu), sum(mem), max(mem), max(threads), '
+                                   'max(io_r), max(io_w), max(ctx_v), max(ctx_i) FROM raw_%s GROUP BY 1, pid, ctime'
+                                   % (day, key))
+                        db.execute('INSERT INTO rolled VALUES (?)', (key,))
+                    rolled.add(key)
+                except sqlite3.Error as e:
+                    # later hours still get rolled up; this one keeps its raw rows until retention
+                    print('Failed to roll up process index hour %s: %s' % (key, e))
+        dropped = 0
+        for kind, span, keep in (('raw', 3600, self.raw_retention), ('min', 86400, self.rollup_retention)):
+            for key in self.partitions(kind):
+                if _key_start(key) + span <= now - keep:
+                    if kind == 'raw' and key not in rolled:
+                        print('Dropping process index hour %s without a rollup' % key)
+                    with db:
+                        db.execute('DROP TABLE %s_%s' % (kind, key))
+                        if kind == 'raw':
+                            db.execute('DELETE FROM rolled WHERE hour=?', (key,))
+                    dropped += 1
+        if dropped:
+            db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return dropped
+
+    def _sources(self, start, end):
+        # (kind, key) partitions for [start, end): per-minute rollups for complete hours older than
+        # the raw window, raw rows for the rest, so every instant is read from exactly one tier
+        raw = self.partitions('raw')
+        raw_from = _key_start(raw[0]) if raw else end
+        out = [('raw', k) for k in raw if _key_start(k) < end and _key_start(k) + 3600 > start]
+        if start < raw_from:
+            out += [('min', k) for k in self.partitions('min')
+                    if _key_start(k) < min(end, raw_from) and _key_start(k) + 86400 > start]
+        return out, raw_from
+
+    def _union(self, sources, where, params, raw_from):
+        parts, args = [], []
+        for kind, key in sources:
+            clause = where + (' AND ts < ?' if kind == 'min' else '')
+            parts.append('SELECT %s FROM %s_%s WHERE %s' % (_SELECT[kind], kind, key, clause))
+            args += params + ([raw_from] if kind == 'min' else [])
+        return ' UNION ALL '.join(parts), args
+
+    def _window(self, range_s, step, now):
+        now = time.time() if now is None else now
+        range_s = min(range_s, self.rollup_retention)
+        step = max(step or 0, range_s / MAX_POINTS, 1)
+        if range_s > self.raw_retention:
+            step = max(step, 60)  # older data only exists per minute
+        step = math.ceil(step)
+        return now - range_s, now, range_s, step
+
+    def _lookup_name(self, name):
+        r = self._db().execute('SELECT id FROM names WHERE name=?', (name,)).fetchone()
+        return r[0] if r else None
+
+    def pid_history(self, pid, create_time=None, range_s=3600, step=None, now=None):
+        # one process over time; create_time narrows it to one incarnation of a reused pid.
+        # -> {'step','range','timestamps', 'cpu':{'avg','max'}, 'memory':{...}, 'threads':[...],
+        #     'io_read'/'io_write': bytes/s, 'names': [...]}
+        start, end, range_s, step = self._window(range_s, step, now)
+        sources, raw_from = self._sources(start, end)
+        out = {'pid': pid, 'create_time': create_time, 'step': step, 'range': range_s, 'start': start, 'end': end}
+        where, params = 'pid = ? AND ts >= ? AND ts < ?', [pid, start, end]
+        if create_time is not None:
+            where += ' AND ctime = ?'; params.append(create_time)
+        rows = []
+        if sources:
+            sql, args = self._union(sources, where, params, raw_from)
+            rows = self._db().execute(
+                'SELECT CAST(ts / ? AS INTEGER) * ? AS b, sum(cpu_sum) / sum(n), max(cpu_max), sum(mem_sum) / sum(n), '
+                'max(mem_max), max(threads), max(io_r), max(io_w), max(ts), group_concat(DISTINCT name) '
+                'FROM (%s) GROUP BY b ORDER BY b' % sql, [step, step] + args).fetchall()
+        return self._series(out, rows)
+
+    def _series(self, out, rows):
+        a = np.array([r[:9] for r in rows], dtype=np.float64).reshape(-1, 9)
+        out['timestamps'] = a[:, 0].tolist()
+        out['cpu'] = {'avg': np.round(a[:, 1], 2).tolist(), 'max': np.round(a[:, 2], 2).tolist()}
+        out['memory'] = {'avg': np.round(a[:, 3], 2).tolist(), 'max': np.round(a[:, 4], 2).tolist()}
+        out['threads'] = a[:, 5].astype(int).tolist()
+        # counters -> rates between the last samples of consecutive buckets; a counter reset gives 0
+        dt = np.maximum(np.diff(a[:, 8], prepend=a[:1, 8]), 1e-9)
+        for j, f in ((6, 'io_read'), (7, 'io_write')):
+            d = np.diff(a[:, j], prepend=a[:1, j]) / dt
+            out[f] = np.round(np.clip(d, 0, None), 1).tolist()
+        ids = {int(i) for r in rows if r[9] for i in str(r[9]).split(',')}
+        out['names'] = self._names_of(ids)
+        return out
+
+    def _names_of(self, ids):
+        if not ids:
+            return []
+        q = 'SELECT name FROM names WHERE id IN (%s)' % ','.join('?' * len(ids))
+        return sorted(r[0] for r in self._db().execute(q, list(ids)))
+
+    def name_history(self, name, range_s=3600, step=None, now=None, max_pids=100):
+        # every process with this name, summed per sample (or per minute for rollups) and then
+        # bucketed: cpu/memory are the name's total, instances the number of live pids
+        start, end, range_s, step = self._window(range_s, step, now)
+        out = {'name': name, 'step': step, 'range': range_s, 'start': start, 'end': end,
+               'timestamps': [], 'cpu': {'avg': [], 'max': []}, 'memory': {'avg': [], 'max': []},
+               'instances': {'avg': [], 'max': []}, 'pids': []}
+        name_id = self._lookup_name(name)
+        sources, raw_from = self._sources(start, end)
+        if name_id is None or not sources:
+            return out
+        sql, args = self._union(sources, 'name = ? AND ts >= ? AND ts < ?', [name_id, start, end], raw_from)
+        db = self._db()
+        rows = db.execute(
+            'SELECT CAST(ts / ? AS INTEGER) * ? AS b, avg(cpu), max(cpu), avg(mem), max(mem), avg(k), max(k) '
+            'FROM (SELECT ts, sum(cpu_sum / n) AS cpu, sum(mem_sum / n) AS mem, count(DISTINCT pid) AS k '
+            'FROM (%s) GROUP BY ts) GROUP BY b ORDER BY b' % sql, [step, step] + args).fetchall()
+        a = np.array(rows, dtype=np.float64).reshape(-1, 7)
+        out['timestamps'] = a[:, 0].tolist()
+        for j, f in ((1, 'cpu'), (3, 'memory'), (5, 'instances')):
+            out[f] = {'avg': np.round(a[:, j], 2).tolist(), 'max': np.round(a[:, j + 1], 2).tolist()}
+        pids = db.execute('SELECT pid, ctime, min(ts), max(ts), max(cpu_max) FROM (%s) GROUP BY pid, ctime '
+                          'ORDER BY max(ts) DESC LIMIT ?' % sql, args + [max_pids]).fetchall()
+        out['pids'] = [{'pid': p, 'create_time': c, 'first_seen': f, 'last_seen': l, 'cpu_max': round(m or 0, 2)}
+                       for p, c, f, l, m in pids]
+        return out
+
+    def stats(self):
+        db = self._db()
+        raw, mins = self.partitions('raw'), self.partitions('min')
+        size = sum(os.path.getsize(self.path + ext) for ext in ('', '-wal') if os.path.exists(self.path + ext))
+        return {'path': os.path.abspath(self.path), 'bytes': size, 'raw_partitions': len(raw), 'rollup_partitions': len(mins),
+                'oldest': _key_start(mins[0] if mins else raw[0]) if raw or mins else None,
+                'names': db.execute('SELECT count(*) FROM names').fetchone()[0],
+                'raw_retention': self.raw_retention, 'rollup_retention': self.rollup_retention}
@@ -0,0 +1,115 @@
+import sys, threading, time, os
+from collections import Counter
+
+# Opt-in sampling profiler for a live process: a daemon thread snapshots every other thread's
+# stack with sys._current_frames() at a fixed interval and counts collapsed stacks
+# ("thread;outer;...;inner count", the input format of flamegraph.pl / speedscope).
+# Costs nothing while stopped.
+
+def _frame_name(f):
+    code = f.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), f.f_lineno)
+
+class SamplingProfiler(threading.Thread):
+    def __init__(self, interval=0.01, duration=None, max_depth=64):
+        super().__init__(daemon=True, name='sampling-profiler')
+        self.interval = interval
+        self.duration = duration
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self.running = False
+        self._lock = threading.Lock()
+
+    def sample(self):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        frames = sys._current_frames()
+        batch = []
+        for ident, f in frames.items():
+            if ident == me:
+                continue
+            stack = []
+            while f is not None and len(stack) < self.max_depth:
+                stack.append(_frame_name(f))
+                f = f.f_back
+            stack.append(names.get(ident, 'thread-%d' % ident))
+            batch.append(';'.join(reversed(stack)))
+        with self._lock:
+            self.stacks.update(batch)
+            self.samples += 1
+
+    def start(self):
+        # flagged before the thread runs so a racing second start() sees it as busy
+        self.running = True
+        super().start()
+
+    def run(self):
+        self.started_at = time.time()
+        while self.running:
+            self.sample()
+            if self.duration and time.time() - self.started_at >= self.duration:
+                break
+            time.sleep(self.interval)
+        self.running = False
+        self.stopped_at = time.time()
+
+    def stop(self):
+        self.running = False
+
+    def folded(self, limit=None):
+        with self._lock:
+            items = self.stacks.most_common(limit)
+        return ''.join('%s %d\n' % (stack, n) for stack, n in items)
+
+    def top(self, limit=20):
+        # functions ranked by how often they were on top of a stack (self time) and anywhere in it;
+        # percentages are of all thread samples, idle threads included
+        own, total = Counter(), Counter()
+        with self._lock:
+            items = list(self.stacks.items())
+        for stack, n in items:
+            frames = stack.split(';')[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += n
+            for name in set(frames):
+                total[name] += n
+        samples = max(sum(n for _, n in items), 1)
+        return [{'frame': name, 'self': n, 'self_pct': round(100.0 * n / samples, 2),
+                 'total': total[name], 'total_pct': round(100.0 * total[name] / samples, 2)}
+                for name, n in own.most_common(limit)]
+
+    def status(self):
+        end = self.stopped_at or time.time()
+        return {'running': self.running, 'interval': self.interval, 'duration': self.duration,
+                'samples': self.samples, 'stacks': len(self.stacks), 'started_at': self.started_at,
+                'seconds': round(end - self.started_at, 2) if self.started_at else 0}
+
+class ProfilerControl:
+    # holds the current/last profiler so it can be started and stopped from an endpoint;
+    # a stopped thread cannot be restarted, so every start creates a fresh profiler
+    def __init__(self):
+        self.profiler = None
+        self._lock = threading.Lock()
+
+    def start(self, interval=0.01, duration=None):
+        with self._lock:
+            if self.profiler is not None and self.profiler.running:
+                return False
+            self.profiler = SamplingProfiler(interval=interval, duration=duration)
+            self.profiler.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            if self.profiler is None or not self.profiler.running:
+                return False
+            self.profiler.stop()
+            return True
+
+    def status(self):
+        p = self.profiler
+        return p.status() if p is not None else {'running': False, 'samples': 0}
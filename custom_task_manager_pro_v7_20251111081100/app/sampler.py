@@ -0,0 +1,38 @@
+import os, sys, time, signal, argparse
+from .shared import SHM_PATH
+
+# the single sampling process of a multi-worker deployment: scans, scores, collects and
+# alerts, and publishes every tick to shared memory for the read-only web workers.
+#   python -m app.sampler                      publish only (gunicorn.conf.py starts it like this)
+#   python -m app.sampler --port 5001          also serve the full app, e.g. for agents (/api/agents/ingest)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Shared-memory sampler for multi-worker deployments')
+    ap.add_argument('--shared', default=os.environ.get('CTM_SHARED') or SHM_PATH, help='shared memory file')
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=0, help='also serve HTTP here (0: none)')
+    args = ap.parse_args(argv)
+    from . import create_app
+    app = create_app({'CTM_ROLE': 'sampler', 'CTM_SHARED': args.shared})
+    services = app.extensions['ctm']
+    stopping = []
+    def stop(signum, frame):
+        if not stopping:  # a second SIGTERM must not interrupt the shutdown itself
+            stopping.append(signum)
+            raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    print('Sampler publishing to %s (pid %d)' % (args.shared, os.getpid()))
+    try:
+        if args.port:
+            app.run(host=args.host, port=args.port, threaded=True, use_reloader=False)
+        else:
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        services.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
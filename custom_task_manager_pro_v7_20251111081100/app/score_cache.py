@@ -0,0 +1,83 @@
+import threading, time
+from collections import OrderedDict
+import numpy as np
+from .snapshot import FEATURES
+from .metrics import MODEL_SECONDS, MODEL_ROWS
+
+# re-infer once any feature drifts this far from the values last scored (snapshot.FEATURES order)
+DEFAULT_DELTAS = {'cpu': 2.0, 'memory': 0.5, 'threads': 1, 'io_read': 1 << 20, 'io_write': 1 << 20,
+                  'ctx_vol': 1000, 'ctx_invol': 200, 'uptime': 3600}
+
+class _Entry:
+    __slots__ = ('x','t','cat','anomaly','life')
+
+    def __init__(self, x, t, cat, anomaly):
+        self.x = x; self.t = t; self.cat = cat; self.anomaly = anomaly; self.life = None
+
+class ScoreCache:
+    # memoizes model outputs per (pid, create_time); pid reuse gets a new create_time and a new entry
+    def __init__(self, max_size=8192, max_age=30.0, deltas=None):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.deltas = dict(DEFAULT_DELTAS, **(deltas or {}))
+        self._delta_vec = np.array([self.deltas[f] for f in FEATURES], dtype=float)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def score(self, snap, categorizer, anomaly, predictor=None, idx=None, keys=None):
+        # returns (categories, anomaly scores, lifetimes or None) for snap.procs[idx];
+        # keys (one per snap.procs row) replace (pid, create_time) when pids are not unique
+        idx = np.arange(len(snap)) if idx is None else np.asarray(idx, dtype=int)
+        X = snap.features()[idx]
+        procs = [snap.procs[i] for i in idx]
+        keys = [(p.pid, p.create_time) for p in procs] if keys is None else [keys[i] for i in idx]
+        now = time.time()
+        with self._lock:
+            entries = [self._entries.get(k) for k in keys]
+            stale = np.ones(len(idx), dtype=bool)
+            known = [i for i, e in enumerate(entries) if e is not None and now - e.t <= self.max_age]
+            if known:
+                prev = np.array([entries[i].x for i in known])
+                moved = (np.abs(X[known] - prev) > self._delta_vec).any(axis=1)
+                stale[known] = moved
+        miss = np.flatnonzero(stale)
+        if len(miss):
+            Xm = X[miss]
+            with MODEL_SECONDS.time(model='categorizer'):
+                cats = categorizer.predict_many(Xm, [procs[i].name for i in miss])
+            with MODEL_SECONDS.time(model='anomaly'):
+                scores = anomaly.score_many(Xm)
+            MODEL_ROWS.inc(len(miss), model='categorizer')
+            MODEL_ROWS.inc(len(miss), model='anomaly')
+        need_life = [i for i in range(len(idx)) if stale[i] or entries[i].life is None] if predictor else []
+        if need_life:
+            with MODEL_SECONDS.time(model='lifetime'):
+                lifes = predictor.predict_many(X[need_life])
+            MODEL_ROWS.inc(len(need_life), model='lifetime')
+        with self._lock:
+            for j, i in enumerate(miss):
+                entries[i] = _Entry(X[i].copy(), now, cats[j], int(scores[j]))
+            for j, i in enumerate(need_life):
+                entries[i].life = int(lifes[j])
+            for key, e in zip(keys, entries):
+                self._entries[key] = e
+                self._entries.move_to_end(key)
+            # processes that exited stop being touched and age out from the LRU end
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self.hits += len(idx) - len(miss)
+            self.misses += len(miss)
+        return ([e.cat for e in entries], [e.anomaly for e in entries],
+                [e.life for e in entries] if predictor else None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'size': len(self._entries), 'max_size': self.max_size, 'max_age': self.max_age,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0, 'deltas': self.deltas}
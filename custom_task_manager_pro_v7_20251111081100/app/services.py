@@ -0,0 +1,249 @@
+import os, time, logging
+import numpy as np
+from .snapshot import SnapshotEngine
+from .history import HistoryStore, METRICS
+from .collector import Collector
+from .procindex import ProcessIndex, IndexCompactor
+from .logstore import get_backend, LOG_DIR
+from .monitor import SystemMonitor
+from .score_cache import ScoreCache
+from .model_store import ModelRegistry, ModelWatcher
+from .broadcast import SnapshotHub
+from .fleet import FleetAggregator
+from .profiler import ProfilerControl
+from .baseline import StreamingDetector
+from .alerts import AlertLog, LoggingSink, WebhookSink
+from . import metrics
+
+class Services:
+    # every background component behind the web app. Building one starts nothing;
+    # start() launches the threads and stop() ends them (threads cannot be restarted).
+    # shared=<path> makes this the sampler of a multi-worker deployment: the overview and
+    # sparkline rings live in shared memory and every tick is published for WorkerServices
+    role = 'standalone'
+
+    def __init__(self, interval=2, collect=True, preload_models=False, alert_webhook=None, shared=None):
+        self.arena = None
+        if shared:
+            # imported here so the standalone app never loads the POSIX-only shared-memory module
+            from .shared import Arena
+            self.arena = Arena(shared)
+        allocate = self.arena.allocator if self.arena else (lambda prefix: np.zeros)
+        if shared:
+            self.role = 'sampler'
+        # single /proc scanner shared by the endpoints and the collector
+        self.engine = SnapshotEngine(interval=interval)
+        # per-process ring buffers for sparklines, filled on every scan
+        self.history = HistoryStore(length=60, max_bytes=16 << 20, allocate=allocate('history'))
+        self.engine.add_listener(self.history.record)
+        # per-process EWMA baselines; debounced alerts go to /api/alerts, the log and an optional webhook
+        self.alerts = AlertLog(maxlen=1000)
+        self.webhook = WebhookSink(alert_webhook) if alert_webhook else None
+        self.detector = StreamingDetector(sinks=[s for s in (self.alerts, LoggingSink(), self.webhook) if s])
+        self.engine.add_listener(self.detector.record)
+        # SQLite index behind /api/process/<pid>/history and /api/name/<name>/history; fed by the collector
+        self.index = ProcessIndex()
+        # writes behavioral logs; collect=False keeps a process from writing them twice
+        self.collector = Collector(interval=3, engine=self.engine, index=self.index) if collect else None
+        self.compactor = IndexCompactor(self.index) if collect else None
+        self.backend = self.collector.backend if self.collector else get_backend()
+        # overview series, persisted so long-range charts survive restarts
+        self.monitor = SystemMonitor(interval=2, path=os.path.join(LOG_DIR, 'overview_history.npz'),
+                                     allocate=allocate('monitor'))
+        # skips re-inference for processes whose features barely moved since the last poll
+        self.score_cache = ScoreCache(max_size=8192, max_age=30.0)
+        # models load in the background and are swapped atomically on reload or when app/models/ changes
+        self.models = ModelRegistry(on_swap=self._models_swapped, preload=preload_models)
+        self.model_watcher = ModelWatcher(self.models, interval=5)
+        # pushes per-tick table deltas to /api/stream subscribers; idle while nobody listens
+        self.hub = SnapshotHub(self.engine, self.process_table)
+        # aggregator for headless agents (python -m app.agent); idle until an agent reports
+        self.fleet = FleetAggregator(self.models, interval=2)
+        # sampling profiler, off unless CTM_PROFILE=1 or started through /api/profiler
+        self.profiler = ProfilerControl()
+        self.started = False
+        self._table_cache = (None, [])
+        self.publisher = None
+        if self.arena:
+            # last listener, so the published tick already includes history and baselines
+            from .shared import SnapshotPublisher
+            self.publisher = SnapshotPublisher(self.arena)
+            self._reloads_seen = self.publisher.reload_requests()
+            self.arena.meta = {'history': {'length': self.history.length, 'max_bytes': 16 << 20},
+                               'monitor': {'metrics': self.monitor.series.metrics, 'tiers': self.monitor.tiers}}
+            self.arena.finish()
+            self.engine.add_listener(self.publish)
+        self._register_metrics()
+
+    def _threads(self):
+        return [t for t in (self.engine, self.collector, self.compactor, self.monitor, self.model_watcher, self.hub,
+                                self.fleet, self.webhook)
+                if t is not None]
+
+    def start(self):
+        if self.started:
+            return self
+        self.started = True
+        for t in self._threads():
+            t.start()
+        if self.models.current.version == 0:
+            self.models.reload()
+        if os.environ.get('CTM_PROFILE') == '1':
+            self.profiler.start(interval=float(os.environ.get('CTM_PROFILE_INTERVAL', '0.01')))
+        return self
+
+    def stop(self, timeout=5):
+        threads = self._threads()
+        for t in threads:
+            t.stop()
+        self.profiler.stop()
+        deadline = time.time() + timeout
+        for t in threads:
+            if t.is_alive():
+                t.join(max(0, deadline - time.time()))
+
+    def publish(self, snap):
+        # score every row once (with lifetimes, for the detail view) and hand the tick to the workers
+        m = self.models.current
+        cats, scores, lifes = self.score_cache.score(snap, m.categorizer, m.anomaly, m.predictor)
+        keys = [(p.pid, p.create_time) for p in snap.procs]
+        columns = {'category': cats, 'anomaly': scores, 'lifetime': [-1 if x is None else x for x in lifes],
+                   'history_slot': self.history.slots(keys)}
+        columns.update(self.detector.columns(keys))
+        blob = {'overview': self.monitor.overview(), 'alerts': self.alerts.recent(200),
+                'stats': {'score_cache': self.score_cache.stats(), 'history_store': self.history.stats(),
+                          'baseline': self.detector.stats(), 'models': self.models.status()},
+                'metrics': metrics.REGISTRY.render()}
+        self.publisher.publish(snap, columns, blob, history_tick=self.history.tick)
+        n = self.publisher.reload_requests()
+        if n != self._reloads_seen:
+            self._reloads_seen = n
+            logging.info('Model reload requested by a worker')
+            self.models.reload()
+
+    def detail(self, snap, i):
+        # model outputs, sparkline series and baseline for row i of snap
+        p = snap.procs[i]
+        m = self.models.current
+        cats, scores, lifes = self.score_cache.score(snap, m.categorizer, m.anomaly, m.predictor, idx=[i])
+        return {'category': cats[0], 'anomaly': scores[0], 'lifetime_pred': lifes[0],
+                'series': self.history.series((p.pid, p.create_time)) or {},
+                'baseline': self.detector.score_of((p.pid, p.create_time))}
+
+    def metrics_text(self):
+        return metrics.REGISTRY.render()
+
+    def _models_swapped(self, m):
+        self.score_cache.clear()
+        logging.info('Models v%d loaded: %s', m.version, m.sources())
+
+    def scored_rows(self, snap, idx=None):
+        # score the selected rows in one batched pass per model, only for cache misses
+        m = self.models.current
+        cats, scores, _ = self.score_cache.score(snap, m.categorizer, m.anomaly, idx=idx)
+        procs = snap.procs if idx is None else [snap.procs[i] for i in idx]
+        # lifetime will be hidden in main table; included in detail endpoint
+        return [{'pid': p.pid, 'name': p.name, 'user': p.user,
+                 'cpu': p.cpu, 'memory': p.memory, 'threads': p.threads, 'category': cat, 'anomaly': a_score,
+                 'stale': p.stale}
+                for p, cat, a_score in zip(procs, cats, scores)]
+
+    def process_table(self, snap):
+        # scored rows for one snapshot, memoized by version so the poll endpoint and the
+        # push hub share a single scoring pass per tick
+        key = (snap.version, self.models.current.version)
+        cached, rows = self._table_cache
+        if cached == key:
+            return rows
+        rows = self.scored_rows(snap)
+        self._table_cache = (key, rows)
+        return rows
+
+    def _register_metrics(self):
+        # /metrics gauges read live state at scrape time; registering again rebinds them to this instance
+        metrics.gauge('ctm_processes', 'Processes in the latest snapshot', fn=lambda: len(self.engine.snapshot))
+        metrics.gauge('ctm_snapshot_version', 'Version of the latest snapshot', fn=lambda: self.engine.snapshot.version)
+        metrics.gauge('ctm_scan_last', 'Counts from the latest scan', ['kind'],
+                      fn=lambda: {(k,): self.engine.scanner.stats[k] for k in ('stale', 'denied', 'gone')})
+        metrics.gauge('ctm_history_bytes', 'Memory held by the per-process history store', fn=lambda: self.history.stats()['bytes'])
+        metrics.gauge('ctm_history_tracked', 'Processes tracked by the history store', fn=lambda: len(self.history))
+        metrics.gauge('ctm_history_dropped', 'Processes not tracked because the history store was full',
+                      fn=lambda: self.history.dropped)
+        metrics.gauge('ctm_score_cache', 'Score cache counters', ['kind'],
+                      fn=lambda: {(k,): v for k, v in self.score_cache.stats().items() if k in ('size', 'hits', 'misses', 'evictions')})
+        metrics.gauge('ctm_baseline_tracked', 'Processes with a streaming baseline', fn=lambda: self.detector.stats()['tracked'])
+        metrics.gauge('ctm_baseline_bytes', 'Memory held by the streaming baselines', fn=lambda: self.detector.stats()['bytes'])
+        metrics.gauge('ctm_index_bytes', 'Size of the process index database', fn=lambda: self.index.stats()['bytes'])
+        metrics.gauge('ctm_overview_series_bytes', 'Memory held by the tiered overview series',
+                      fn=lambda: self.monitor.series.nbytes())
+        metrics.gauge('ctm_models_version', 'Version of the loaded model set', fn=lambda: self.models.current.version)
+        metrics.gauge('ctm_fleet_hosts', 'Agents known to the aggregator', fn=lambda: len(self.fleet.hosts))
+        metrics.gauge('ctm_stream_subscribers', 'Connected /api/stream clients', fn=lambda: self.hub.subscribers)
+
+class WorkerServices:
+    # read-only web worker of a multi-worker deployment (see gunicorn.conf.py). It scans
+    # nothing and loads no models: snapshots, scores, overview and sparklines come from the
+    # sampler's shared memory, history queries from the sampler's SQLite index and log files
+    role = 'worker'
+
+    def __init__(self, shared=None):
+        from .shared import SharedReader, SharedEngine, SharedMonitor, SharedModels, SharedAlerts, SharedHistory, \
+            SharedStats, SHM_PATH
+        self.reader = SharedReader(shared or SHM_PATH)
+        self.engine = SharedEngine(self.reader)
+        self.monitor = SharedMonitor(self.reader)
+        self.models = SharedModels(self.reader)
+        self.alerts = SharedAlerts(self.reader)
+        self.score_cache = SharedStats(self.reader, 'score_cache')
+        self.history = SharedHistory(self.reader)
+        self.detector = SharedStats(self.reader, 'baseline')
+        self.index = ProcessIndex()
+        self.backend = get_backend()
+        self.collector = None
+        self.fleet = None  # agents report to the sampler
+        self.hub = SnapshotHub(self.engine, self.process_table)
+        self.profiler = ProfilerControl()
+        self.started = False
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            self.hub.start()
+            if os.environ.get('CTM_PROFILE') == '1':
+                self.profiler.start(interval=float(os.environ.get('CTM_PROFILE_INTERVAL', '0.01')))
+        return self
+
+    def stop(self, timeout=5):
+        self.hub.stop()
+        self.profiler.stop()
+        if self.hub.is_alive():
+            self.hub.join(timeout)
+
+    def scored_rows(self, snap, idx=None):
+        rows = self.engine.view_of(snap).rows()
+        return rows if idx is None else [rows[i] for i in idx]
+
+    def process_table(self, snap):
+        return self.engine.view_of(snap).rows()
+
+    def detail(self, snap, i):
+        view = self.engine.view_of(snap)
+        c = view.columns
+        slot = c['history_slot'][i]
+        n = c['baseline_samples'][i]
+        # same shape as Services.detail: StreamingDetector.score_of() rebuilt from the published columns
+        baseline = None if n < 0 else {
+            'score': round(c['baseline'][i], 2), 'feature': METRICS[c['baseline_feature'][i]], 'samples': n,
+            'warm': bool(c['baseline_warm'][i]), 'hot': c['baseline_hot'][i],
+            'mean': dict(zip(METRICS, np.round(c['baseline_mean'][i], 2).tolist())),
+            'std': dict(zip(METRICS, np.round(c['baseline_std'][i], 2).tolist()))}
+        return {'category': view.strings[c['category'][i]], 'anomaly': c['anomaly'][i],
+                'lifetime_pred': None if c['lifetime'][i] < 0 else c['lifetime'][i],
+                'series': self.history.series_at(slot, view.history_tick) if slot >= 0 else {},
+                'baseline': baseline}
+
+    def metrics_text(self):
+        # the sampler's metrics plus this worker's own request latencies
+        own = [l for l in metrics.REGISTRY.render().splitlines() if 'ctm_http_' in l]
+        sampler = [l for l in self.engine.view().blob.get('metrics', '').splitlines() if 'ctm_http_' not in l]
+        return '\n'.join(sampler + own) + '\n'
@@ -0,0 +1,412 @@
+import os, json, mmap, time, threading
+try:
+    import fcntl
+except ImportError:  # Windows: no multi-worker deployment, create_app() only imports this for sampler/worker
+    fcntl = None
+import numpy as np
+from .snapshot import Snapshot, ProcInfo, EMPTY
+
+# Shared-memory state for multi-worker deployments. One sampler process (python -m app.sampler)
+# owns scanning, models, the collector and alerting; read-only web workers attach to the same
+# file and serve from it, so extra workers add neither scans nor model copies.
+#
+# The file is an arena of named numpy arrays described by a JSON layout in the header:
+#   - overview tiers and per-process sparkline rings are allocated here directly (allocate=),
+#     so workers query the sampler's own arrays with no copy at all
+#   - every tick the scored process table is written to the inactive one of two slots, each
+#     guarded by a sequence number that is odd while the slot is written (seqlock); readers
+#     retry if it moved, and copy a slot out only once per snapshot version
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else os.path.join(os.path.dirname(__file__), '..', 'logs')
+SHM_PATH = os.path.join(SHM_DIR, 'ctm-%s.shm' % (os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')))
+ARENA_BYTES = 256 << 20  # sparse: only pages that are written take memory
+ALIGN = 64
+HEADER_BYTES = 64 << 10
+# header words: magic, layout id (0 while the sampler is still laying out), layout length,
+# active slot, model reload requests from workers
+_MAGIC, _LAYOUT_ID, _LAYOUT_LEN, _ACTIVE, _RELOAD = range(5)
+MAGIC = 0x31534d5443  # 'CTMS1'
+
+ROW = np.dtype([
+    ('pid','<i4'), ('name','<i4'), ('user','<i4'), ('cpu','<f8'), ('memory','<f8'), ('threads','<i4'),
+    ('io_read','<i8'), ('io_write','<i8'), ('ctx_vol','<i8'), ('ctx_invol','<i8'), ('create_time','<f8'),
+    ('stale','u1'), ('category','<i4'), ('anomaly','<i4'), ('lifetime','<i8'),
+    ('baseline','<f8'), ('baseline_feature','i1'), ('baseline_warm','u1'), ('baseline_samples','<i4'),
+    ('baseline_hot','<i4'), ('baseline_mean','<f8', (6,)), ('baseline_std','<f8', (6,)), ('history_slot','<i4'),
+])
+# ints like the standalone API returns them; lifetime -1 and baseline_samples -1 stand for None
+META = np.dtype([('seq','<u8'), ('version','<u8'), ('timestamp','<f8'), ('rows','<u8'),
+                 ('strings','<u8'), ('blob','<u8'), ('history_tick','<u8')])
+
+class Arena:
+    # writer: allocate() hands out zeroed views in a fixed-size file; finish() publishes the layout.
+    # reader (readonly=True): allocate() returns the view the writer laid out under the same name
+    def __init__(self, path=SHM_PATH, size=ARENA_BYTES, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        if readonly:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                self.size = os.fstat(fd).st_size
+                self._mm = mmap.mmap(fd, self.size, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+        else:
+            if fcntl is None:
+                raise OSError('the shared-memory sampler needs a POSIX system')
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                # one sampler per file; the lock is held for the life of the process
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                raise OSError('another sampler is publishing to %s' % path)
+            self._lock_fd = fd
+            # reuse the inode so workers mapped to an earlier sampler see the new one
+            os.ftruncate(fd, size)
+            self.size = size
+            self._mm = mmap.mmap(fd, size)
+        self.header = np.ndarray(8, dtype='<u8', buffer=self._mm)
+        self.layout = {}
+        self.meta = {}
+        self._offset = HEADER_BYTES
+        self._counters = {}
+        if readonly:
+            self._load_layout()
+        else:
+            self.header[_LAYOUT_ID] = 0
+
+    def _load_layout(self):
+        if self.header[_MAGIC] != MAGIC or not self.header[_LAYOUT_ID]:
+            raise OSError('shared state at %s is not ready' % self.path)
+        self.layout_id = int(self.header[_LAYOUT_ID])
+        d = json.loads(bytes(self._mm[64:64 + int(self.header[_LAYOUT_LEN])]))
+        self.layout, self.meta = d['arrays'], d['meta']
+
+    def allocate(self, name, shape, dtype):
+        dtype = np.dtype(dtype)
+        shape = (shape,) if np.isscalar(shape) else tuple(shape)
+        if self.readonly:
+            spec = self.layout.get(name)
+            if spec is None or tuple(spec['shape']) != shape or spec['dtype'] != dtype.str:
+                raise ValueError('shared array %s does not match the sampler layout' % name)
+            return np.ndarray(shape, dtype=dtype, buffer=self._mm, offset=spec['offset'])
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        offset = -(-self._offset // ALIGN) * ALIGN
+        if offset + nbytes > self.size:
+            raise MemoryError('shared arena %s is full' % self.path)
+        self._offset = offset + nbytes
+        a = np.ndarray(shape, dtype=dtype, buffer=self._mm, offset=offset)
+        a[...] = 0  # the file may hold a previous sampler's data
+        self.layout[name] = {'offset': offset, 'shape': list(shape), 'dtype': dtype.str}
+        return a
+
+    def allocator(self, prefix):
+        # allocate(shape, dtype) for classes that take one; arrays are named in call order,
+        # so writer and reader must build the same object with the same parameters
+        def allocate(shape, dtype=np.float64):
+            n = self._counters[prefix] = self._counters.get(prefix, -1) + 1
+            return self.allocate('%s.%d' % (prefix, n), shape, dtype)
+        return allocate
+
+    def finish(self):
+        layout = json.dumps({'arrays': self.layout, 'meta': self.meta}).encode('utf-8')
+        if 64 + len(layout) > HEADER_BYTES:
+            raise MemoryError('shared layout too large')
+        self._mm[64:64 + len(layout)] = layout
+        self.header[_LAYOUT_LEN] = len(layout)
+        self.header[_MAGIC] = MAGIC
+        self.header[_LAYOUT_ID] = int.from_bytes(os.urandom(7), 'little') | 1
+
+    def close(self):
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # views still alive; the mapping goes with the process
+
+class SnapshotPublisher:
+    # sampler side. publish() is a snapshot listener: it scores the table once for everyone and
+    # writes it with the blob (overview, alerts, stats) into the inactive slot
+    def __init__(self, arena, max_rows=32768, string_bytes=4 << 20, blob_bytes=8 << 20):
+        self.arena = arena
+        self.slots = [{'meta': arena.allocate('slot%d.meta' % k, 1, META),
+                       'rows': arena.allocate('slot%d.rows' % k, max_rows, ROW),
+                       'strings': arena.allocate('slot%d.strings' % k, string_bytes, np.uint8),
+                       'blob': arena.allocate('slot%d.blob' % k, blob_bytes, np.uint8)} for k in (0, 1)]
+        self.max_rows = max_rows
+        self.published = 0
+
+    def publish(self, snap, columns, blob, history_tick=0):
+        # columns: per-row arrays/lists keyed like ROW (category as strings); blob: JSON-able dict
+        n = len(snap.procs)
+        if n > self.max_rows:
+            raise ValueError('%d processes exceed the shared table (%d rows)' % (n, self.max_rows))
+        table, codes = [], {}
+        def encode(values):
+            out = np.empty(len(values), dtype='<i4')
+            for i, v in enumerate(values):
+                v = '' if v is None else str(v)
+                c = codes.get(v)
+                if c is None:
+                    c = codes[v] = len(table); table.append(v)
+                out[i] = c
+            return out
+        procs = snap.procs
+        k = 1 - int(self.arena.header[_ACTIVE])
+        slot = self.slots[k]
+        rows = slot['rows'][:n]
+        meta = slot['meta'][0]
+        name, user = encode([p.name for p in procs]), encode([p.user for p in procs])
+        category = encode(columns.pop('category'))
+        strings = '\0'.join(table).encode('utf-8', 'replace')
+        body = json.dumps(blob, separators=(',', ':'), default=str).encode('utf-8')
+        if len(strings) > len(slot['strings']) or len(body) > len(slot['blob']):
+            raise ValueError('shared snapshot does not fit its slot')
+        meta['seq'] += 1  # odd: being written
+        if n:
+            X = snap.features()
+            rows['pid'] = [p.pid for p in procs]
+            rows['name'], rows['user'], rows['category'] = name, user, category
+            for j, f in enumerate(('cpu', 'memory', 'threads', 'io_read', 'io_write', 'ctx_vol', 'ctx_invol')):
+                rows[f] = X[:, j]
+            rows['create_time'] = [p.create_time or 0 for p in procs]
+            rows['stale'] = [bool(p.stale) for p in procs]
+            for f, v in columns.items():
+                rows[f] = v
+        slot['strings'][:len(strings)] = np.frombuffer(strings, dtype=np.uint8)
+        slot['blob'][:len(body)] = np.frombuffer(body, dtype=np.uint8)
+        meta['version'], meta['timestamp'], meta['rows'] = snap.version, snap.timestamp, n
+        meta['strings'], meta['blob'] = len(strings), len(body)
+        meta['history_tick'] = history_tick
+        meta['seq'] += 1  # even: complete
+        self.arena.header[_ACTIVE] = k
+        self.published += 1
+
+    def reload_requests(self):
+        return int(self.arena.header[_RELOAD])
+
+class SharedView:
+    # one published snapshot copied out of shared memory: a regular Snapshot plus the
+    # sampler's per-row results (rows dicts, columns) and the JSON blob
+    __slots__ = ('snapshot', 'columns', 'strings', 'blob', 'history_tick', '_rows')
+
+    def __init__(self, snapshot, columns, strings, blob, history_tick):
+        self.snapshot = snapshot
+        self.columns = columns
+        self.strings = strings
+        self.blob = blob
+        self.history_tick = history_tick
+        self._rows = None
+
+    def rows(self):
+        # the same dicts Services.scored_rows() builds, created once per version
+        if self._rows is None:
+            c, table = self.columns, self.strings
+            self._rows = [{'pid': p.pid, 'name': p.name, 'user': p.user, 'cpu': p.cpu, 'memory': p.memory,
+                           'threads': p.threads, 'category': table[cat], 'anomaly': a, 'stale': p.stale}
+                          for p, cat, a in zip(self.snapshot.procs, c['category'], c['anomaly'])]
+        return self._rows
+
+EMPTY_VIEW = SharedView(EMPTY, {f: [] for f in ROW.names}, [], {}, 0)
+
+class SharedReader:
+    # worker side; attaches lazily (the sampler may start later) and re-attaches when a new
+    # sampler lays out the file again
+    def __init__(self, path=SHM_PATH, retry=1.0):
+        self.path = path
+        self.retry = retry
+        self.arena = None
+        self._slots = None
+        self._view = EMPTY_VIEW
+        self._next_try = 0
+        self._lock = threading.Lock()
+        self.on_attach = []
+
+    def _attach(self):
+        if self.arena is not None and int(self.arena.header[_LAYOUT_ID]) == self.arena.layout_id:
+            return True
+        if time.time() < self._next_try:
+            return False
+        self._next_try = time.time() + self.retry
+        try:
+            arena = Arena(self.path, readonly=True)
+            slots = [{f: arena.allocate('slot%d.%s' % (k, f), arena.layout['slot%d.%s' % (k, f)]['shape'], dtype)
+                      for f, dtype in (('meta', META), ('rows', ROW), ('strings', np.uint8), ('blob', np.uint8))}
+                     for k in (0, 1)]
+        except (OSError, ValueError, KeyError) as e:
+            if self.arena is None:
+                print('Waiting for the sampler at %s: %s' % (self.path, e))
+            return False
+        self.arena, self._slots, self._view = arena, slots, EMPTY_VIEW
+        for fn in self.on_attach:
+            fn(arena)
+        return True
+
+    @property
+    def attached(self):
+        return self.arena is not None
+
+    def view(self):
+        # latest SharedView; the slot is copied only when its version changed
+        with self._lock:
+            if not self._attach():
+                return self._view
+            for _ in range(50):
+                k = int(self.arena.header[_ACTIVE])
+                slot = self._slots[k]
+                meta = slot['meta'][:1].copy()[0]
+                seq = int(meta['seq'])
+                if seq & 1:
+                    time.sleep(0.001)
+                    continue
+                if int(meta['version']) == self._view.snapshot.version:
+                    return self._view
+                # copy the raw slot, then decode only if the writer did not touch it meanwhile:
+                # a torn copy can hold any bytes, so nothing is parsed before the seq check
+                raw = self._copy(slot, meta)
+                if int(slot['meta'][0]['seq']) != seq:
+                    continue
+                try:
+                    view = self._decode(meta, *raw)
+                except (ValueError, IndexError) as e:
+                    print('Skipping unreadable shared snapshot %d: %s' % (int(meta['version']), e))
+                    time.sleep(0.001)
+                    continue
+                self._view = view
+                return view
+            return self._view
+
+    def _copy(self, slot, meta):
+        rows = slot['rows'][:int(meta['rows'])].copy()
+        strings = bytes(slot['strings'][:int(meta['strings'])])
+        blob = bytes(slot['blob'][:int(meta['blob'])])
+        return rows, strings, blob
+
+    def _decode(self, meta, rows, strings, blob):
+        n = len(rows)
+        strings = strings.decode('utf-8').split('\0')
+        table = np.array(strings, dtype=object)
+        cols = {f: rows[f].tolist() for f in ROW.names if f not in ('name', 'user')}
+        names, users = table[rows['name']].tolist() if n else [], table[rows['user']].tolist() if n else []
+        procs = [ProcInfo(*t) for t in zip(cols['pid'], names, users, cols['cpu'], cols['memory'], cols['threads'],
+                                           cols['io_read'], cols['io_write'], cols['ctx_vol'], cols['ctx_invol'],
+                                           cols['create_time'], [bool(s) for s in cols['stale']])]
+        blob = json.loads(blob or b'{}')
+        snap = Snapshot(int(meta['version']), float(meta['timestamp']), procs)
+        return SharedView(snap, cols, strings, blob, int(meta['history_tick']))
+
+    def request_reload(self):
+        # models are loaded by the sampler only; this only bumps a counter it checks every tick.
+        # The mapping is read-only, so the word is written through the file.
+        if not self._attach():
+            return False
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            n = int(self.arena.header[_RELOAD]) + 1
+            os.pwrite(fd, n.to_bytes(8, 'little'), _RELOAD * 8)
+        finally:
+            os.close(fd)
+        return True
+
+# worker-side stand-ins for the sampler's components, shaped like the attributes routes use
+
+class SharedEngine:
+    # .snapshot / .wait() like SnapshotEngine; keeps the last few views so a row index taken
+    # from one snapshot is resolved against that same snapshot
+    def __init__(self, reader, poll=0.1, keep=4):
+        self.reader = reader
+        self.poll = poll
+        self.keep = keep
+        self._views = {}
+
+    def view(self):
+        v = self.reader.view()
+        if v.snapshot.version not in self._views:
+            self._views[v.snapshot.version] = v
+            for old in sorted(self._views)[:-self.keep]:
+                del self._views[old]
+        return v
+
+    def view_of(self, snap):
+        return self._views.get(snap.version) or self.view()
+
+    @property
+    def snapshot(self):
+        return self.view().snapshot
+
+    def wait(self, after_version=0, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            snap = self.snapshot
+            if snap.version > after_version or (deadline is not None and time.time() >= deadline):
+                return snap
+            time.sleep(self.poll)
+
+class SharedMonitor:
+    # overview from the published tick; history queries read the sampler's tiers in place
+    def __init__(self, reader):
+        from .monitor import METRICS
+        from .timeseries import TieredSeries
+        self.reader = reader
+        self.series = TieredSeries(METRICS, tiers=((2, 1),))
+        reader.on_attach.append(self._attach)
+
+    def _attach(self, arena):
+        from .timeseries import TieredSeries
+        m = arena.meta['monitor']
+        self.series = TieredSeries(m['metrics'], tiers=[tuple(t) for t in m['tiers']], allocate=arena.allocator('monitor'))
+
+    def overview(self):
+        return self.reader.view().blob.get('overview') or {'cpu':0,'mem':0,'disk':0,'net_recv':0,'net_sent':0,'procs':0}
+
+    def history(self, range_s, step=None):
+        self.reader.view()
+        return self.series.query(range_s, step, now=time.time())
+
+class SharedHistory:
+    # sparkline rings read in place; slot and tick come with each published row
+    def __init__(self, reader):
+        self.reader = reader
+        self.store = None
+        reader.on_attach.append(self._attach)
+
+    def _attach(self, arena):
+        from .history import HistoryStore
+        m = arena.meta['history']
+        self.store = HistoryStore(m['length'], m['max_bytes'], allocate=arena.allocator('history'))
+
+    def series_at(self, slot, tick):
+        return self.store.series_at(slot, tick) if self.store is not None else {}
+
+    def stats(self):
+        return self.reader.view().blob.get('stats', {}).get('history_store', {})
+
+class SharedStats:
+    # stats() of a sampler component, as of the last published tick
+    def __init__(self, reader, key):
+        self.reader = reader
+        self.key = key
+
+    def stats(self):
+        return self.reader.view().blob.get('stats', {}).get(self.key, {})
+
+class SharedModels(SharedStats):
+    def __init__(self, reader):
+        super().__init__(reader, 'models')
+
+    def status(self):
+        return self.stats()
+
+    def reload(self):
+        return self.reader.request_reload()
+
+class SharedAlerts:
+    # AlertLog.since() over the recent alerts published with each tick
+    def __init__(self, reader):
+        self.reader = reader
+
+    def since(self, seq=0, limit=100):
+        events = self.reader.view().blob.get('alerts', [])
+        out = [e for e in events if e['seq'] > seq][:limit]
+        return out, (out[-1]['seq'] if out else max([seq] + [e['seq'] for e in events]))
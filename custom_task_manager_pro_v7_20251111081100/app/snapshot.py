@@ -0,0 +1,216 @@
+import threading, time
+from concurrent.futures import ThreadPoolExecutor, wait
+from collections import namedtuple
+import psutil
+from .metrics import SCAN_SECONDS, SCAN_PROBLEMS, LISTENER_SECONDS
+
+# one row per process, shared read-only by every consumer of a snapshot
+ProcInfo = namedtuple('ProcInfo', [
+    'pid','name','user','cpu','memory','threads',
+    'io_read','io_write','ctx_vol','ctx_invol','create_time','stale'
+], defaults=(False,))
+
+# model feature layout shared by the batch scoring APIs
+FEATURES = ['cpu','memory','threads','io_read','io_write','ctx_vol','ctx_invol','uptime']
+
+def _attr(fn, default, denied):
+    # AccessDenied on one attribute keeps the rest of the row (like process_iter's ad_value)
+    try:
+        return fn()
+    except psutil.AccessDenied:
+        denied.append(1)
+        return default
+
+class ProcessScanner:
+    # reads every process inside Process.oneshot() on a bounded thread pool. Reads that miss
+    # the per-tick deadline (or are still stuck from an earlier tick) reuse the last known
+    # row marked stale, so a scan never takes much longer than `deadline` seconds
+    def __init__(self, workers=8, deadline=1.0):
+        self.workers = workers
+        self.deadline = deadline
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan')
+        self._procs = {}  # shared with the pool threads, guarded by _lock
+        self._lock = threading.Lock()
+        self._last = {}
+        self._inflight = {}
+        self.stats = {'procs': 0, 'stale': 0, 'denied': 0, 'gone': 0, 'duration': 0.0}
+
+    def _read(self, pid):
+        with self._lock:
+            p = self._procs.get(pid)
+        if p is None or not p.is_running():
+            p = psutil.Process(pid)
+            with self._lock:
+                self._procs[pid] = p
+        denied = []
+        with p.oneshot():
+            name = _attr(p.name, None, denied)
+            user = _attr(p.username, None, denied)
+            cpu = _attr(p.cpu_percent, 0, denied) or 0
+            mem = _attr(p.memory_percent, 0, denied) or 0
+            threads = _attr(p.num_threads, 0, denied) or 0
+            io = _attr(p.io_counters, None, denied)
+            ctx = _attr(p.num_ctx_switches, None, denied)
+            ctime = _attr(p.create_time, 0, denied) or 0
+        row = ProcInfo(pid, name, user, cpu, round(mem,2), threads,
+                       getattr(io,'read_bytes',0) if io else 0, getattr(io,'write_bytes',0) if io else 0,
+                       getattr(ctx,'voluntary',0) if ctx else 0, getattr(ctx,'involuntary',0) if ctx else 0,
+                       ctime)
+        return row, len(denied)
+
+    def scan(self):
+        started = time.time()
+        pids = psutil.pids()
+        futures, fresh = {}, []
+        for pid in pids:
+            fut = self._inflight.get(pid)
+            if fut is None:
+                fut = self._inflight[pid] = self._pool.submit(self._read, pid)
+                fresh.append(fut)
+            futures[fut] = pid
+        # reads still stuck from an earlier tick do not count against this tick's budget
+        wait(fresh, timeout=self.deadline)
+        done = {f for f in futures if f.done()}
+        rows, stale, denied, gone = [], 0, 0, 0
+        for fut, pid in futures.items():
+            if fut in done:
+                del self._inflight[pid]
+                try:
+                    row, d = fut.result()
+                except psutil.NoSuchProcess:
+                    gone += 1
+                    continue
+                except psutil.AccessDenied:
+                    denied += 1
+                    continue
+                denied += d
+                self._last[pid] = row
+                rows.append(row)
+            elif pid in self._last:
+                stale += 1
+                rows.append(self._last[pid]._replace(stale=True))
+        live = set(pids)
+        # reads that missed the deadline may still add to _procs while this prunes it
+        with self._lock:
+            for pid in [pid for pid in self._procs if pid not in live]:
+                del self._procs[pid]
+        for d in (self._last, self._inflight):
+            for pid in [pid for pid in d if pid not in live]:
+                del d[pid]
+        self.stats = {'procs': len(rows), 'stale': stale, 'denied': denied, 'gone': gone,
+                      'duration': round(time.time() - started, 4)}
+        return rows
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+_default_scanner = None
+
+def scan_processes():
+    global _default_scanner
+    if _default_scanner is None:
+        _default_scanner = ProcessScanner()
+    return _default_scanner.scan()
+
+def features_from_info(info):
+    return [[info.get(f,0) for f in FEATURES]]
+
+class Snapshot:
+    __slots__ = ('version','timestamp','procs','_by_pid','_features')
+
+    def __init__(self, version, timestamp, procs):
+        self.version = version
+        self.timestamp = timestamp
+        self.procs = tuple(procs)
+        self._by_pid = None
+        self._features = None
+
+    def __len__(self):
+        return len(self.procs)
+
+    def index(self, pid):
+        if self._by_pid is None:
+            self._by_pid = {p.pid: i for i, p in enumerate(self.procs)}
+        return self._by_pid.get(pid)
+
+    def get(self, pid):
+        i = self.index(pid)
+        return None if i is None else self.procs[i]
+
+    def names(self):
+        return [p.name for p in self.procs]
+
+    def features(self):
+        # (n, len(FEATURES)) float matrix, built once per snapshot and shared by all scorers
+        if self._features is None:
+            import numpy as np
+            X = np.array([p[3:10] for p in self.procs], dtype=float).reshape(-1, 7)
+            ctime = np.array([p.create_time or self.timestamp for p in self.procs], dtype=float)
+            uptime = np.clip(self.timestamp - ctime, 0, None).astype(int)
+            X = np.column_stack([X, uptime])
+            X.setflags(write=False)
+            self._features = X
+        return self._features
+
+    def uptime(self, proc):
+        try:
+            return int(self.timestamp - (proc.create_time or self.timestamp))
+        except Exception:
+            return 0
+
+EMPTY = Snapshot(0, 0.0, ())
+
+class SnapshotEngine(threading.Thread):
+    # scans /proc once per interval and publishes an immutable, versioned Snapshot;
+    # readers just grab self.snapshot, so the scan cost is independent of client count
+    def __init__(self, interval=2, scanner=None):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.scanner = scanner or ProcessScanner(deadline=interval * 0.5)
+        self.running = False
+        self.snapshot = EMPTY
+        self.listeners = []
+        self._cond = threading.Condition()
+
+    def add_listener(self, fn):
+        # fn(snapshot) runs on the engine thread after each publish
+        self.listeners.append(fn)
+
+    def tick(self):
+        procs = self.scanner.scan()
+        stats = self.scanner.stats
+        SCAN_SECONDS.observe(stats['duration'])
+        for kind in ('stale', 'denied', 'gone'):
+            if stats[kind]:
+                SCAN_PROBLEMS.inc(stats[kind], kind=kind)
+        snap = Snapshot(self.snapshot.version + 1, time.time(), procs)
+        with self._cond:
+            self.snapshot = snap
+            self._cond.notify_all()
+        for fn in self.listeners:
+            try:
+                with LISTENER_SECONDS.time(listener=getattr(fn, '__qualname__', 'listener')):
+                    fn(snap)
+            except Exception as e:
+                print('Snapshot listener failed:', e)
+        return snap
+
+    def wait(self, after_version=0, timeout=None):
+        # block until a snapshot newer than after_version is published
+        with self._cond:
+            self._cond.wait_for(lambda: self.snapshot.version > after_version, timeout)
+            return self.snapshot
+
+    def run(self):
+        self.running = True
+        while self.running:
+            started = time.time()
+            try:
+                self.tick()
+            except Exception as e:
+                print('Snapshot scan failed:', e)
+            time.sleep(max(0, self.interval - (time.time() - started)))
+
+    def stop(self):
+        self.running = False
+        self.scanner.close()
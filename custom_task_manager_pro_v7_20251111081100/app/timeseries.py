@@ -0,0 +1,164 @@
+import os, re, math, threading
+import numpy as np
+
+# Fixed-size multi-resolution series. Every tier is a ring of (step-aligned bucket) slots with
+# min/avg/max/count per metric; each raw sample updates the newest slot of every tier in place,
+# so a sample costs O(tiers) and memory never grows. Queries read the coarsest tier that is
+# still fine enough, so a week-long chart is a few hundred points instead of 300k samples.
+
+# (bucket seconds, slots): raw 2s for 1h, 1 min for a day, 10 min for 30 days
+DEFAULT_TIERS = ((2, 1800), (60, 1440), (600, 4320))
+MAX_POINTS = 500
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def parse_duration(value, default=None):
+    # '90', '90s', '15m', '6h', '7d', '2w' -> seconds
+    if value is None or value == '':
+        return default
+    m = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*', str(value))
+    if not m:
+        raise ValueError('bad duration %r (use e.g. 90, 15m, 6h, 7d)' % value)
+    seconds = float(m.group(1)) * _UNITS[m.group(2) or 's']
+    if seconds <= 0:
+        raise ValueError('duration must be positive')
+    return seconds
+
+class _Tier:
+    __slots__ = ('step','length','ts','min','max','sum','count','_head')
+
+    def __init__(self, step, length, n, allocate=np.zeros):
+        self.step = step
+        self.length = length
+        self.ts = allocate(length, dtype=np.float64)   # bucket start, 0 = empty slot
+        self.min = allocate((length, n), dtype=np.float32)
+        self.max = allocate((length, n), dtype=np.float32)
+        self.sum = allocate((length, n), dtype=np.float64)
+        self.count = allocate(length, dtype=np.int32)
+        # kept in an array too, so a series in shared memory is complete without this object
+        self._head = allocate(1, dtype=np.int64)
+        if self._head.flags.writeable:
+            self._head[0] = -1
+
+    @property
+    def head(self):
+        return int(self._head[0])
+
+    @head.setter
+    def head(self, value):
+        self._head[0] = value
+
+    def add(self, t, v):
+        bucket = math.floor(t / self.step) * self.step
+        h = self.head
+        if h >= 0 and self.ts[h] == bucket:
+            np.minimum(self.min[h], v, out=self.min[h])
+            np.maximum(self.max[h], v, out=self.max[h])
+            self.sum[h] += v
+            self.count[h] += 1
+            return
+        if h >= 0 and bucket < self.ts[h]:
+            return  # clock went backwards; keep the ring ordered
+        h = self.head = (h + 1) % self.length
+        self.ts[h] = bucket
+        self.min[h] = v; self.max[h] = v; self.sum[h] = v
+        self.count[h] = 1
+
+    def ordered(self):
+        # slot indexes oldest -> newest, skipping never-written slots
+        h = self.head
+        if h < 0:
+            return np.zeros(0, dtype=int)
+        idx = np.arange(h + 1, h + 1 + self.length) % self.length
+        return idx[self.ts[idx] > 0]
+
+class TieredSeries:
+    # allocate(shape, dtype) places the rings, e.g. in shared.Arena memory for read-only workers
+    def __init__(self, metrics, tiers=DEFAULT_TIERS, allocate=np.zeros):
+        self.metrics = tuple(metrics)
+        self.tiers = [_Tier(step, length, len(self.metrics), allocate) for step, length in tiers]
+        self._lock = threading.Lock()
+
+    @property
+    def retention(self):
+        return max(t.step * t.length for t in self.tiers)
+
+    def add(self, t, values):
+        v = np.asarray(values, dtype=np.float64)
+        with self._lock:
+            for tier in self.tiers:
+                tier.add(t, v)
+
+    def query(self, range_s, step=None, now=None, max_points=MAX_POINTS):
+        # -> {'step', 'tier', 'timestamps', metric: {'min','avg','max'}} covering [now - range_s, now]
+        range_s = min(range_s, self.retention)
+        # coarsest tier no coarser than the wanted step, among the tiers that cover the range
+        want = max(step or 0, range_s / max_points)
+        covering = [t for t in self.tiers if t.step * t.length >= range_s] or self.tiers[-1:]
+        fine_enough = [t for t in covering if t.step <= want]
+        tier = fine_enough[-1] if fine_enough else covering[0]
+        out_step = max(tier.step, math.ceil(want / tier.step) * tier.step)
+        with self._lock:
+            if now is None:
+                h = tier.head
+                now = tier.ts[h] + tier.step if h >= 0 else 0
+            idx = tier.ordered()
+            idx = idx[tier.ts[idx] >= now - range_s]
+            ts = tier.ts[idx]
+            mn, mx = tier.min[idx].astype(np.float64), tier.max[idx].astype(np.float64)
+            sm, cnt = tier.sum[idx], tier.count[idx].astype(np.float64)
+        if out_step > tier.step and len(ts):
+            # merge tier buckets into out_step buckets (count-weighted mean)
+            keys = np.floor(ts / out_step) * out_step
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            ts = keys[starts]
+            mn = np.minimum.reduceat(mn, starts)
+            mx = np.maximum.reduceat(mx, starts)
+            sm = np.add.reduceat(sm, starts)
+            cnt = np.add.reduceat(cnt, starts)
+        avg = sm / np.maximum(cnt, 1)[:, None] if len(ts) else sm
+        out = {'step': out_step, 'tier': tier.step, 'range': range_s, 'timestamps': ts.tolist()}
+        for j, m in enumerate(self.metrics):
+            out[m] = {'min': np.round(mn[:, j], 2).tolist(), 'avg': np.round(avg[:, j], 2).tolist(),
+                      'max': np.round(mx[:, j], 2).tolist()}
+        return out
+
+    def last(self):
+        t = self.tiers[0]
+        with self._lock:
+            h = t.head
+            if h < 0:
+                return None
+            return dict(zip(self.metrics, (t.sum[h] / t.count[h]).tolist()))
+
+    def nbytes(self):
+        return sum(t.ts.nbytes + t.min.nbytes + t.max.nbytes + t.sum.nbytes + t.count.nbytes + 8 for t in self.tiers)
+
+    def save(self, path):
+        # written to a temp file and renamed, so a crash never leaves a torn file behind
+        with self._lock:
+            arrays = {'metrics': np.array(self.metrics),
+                      'layout': np.array([(t.step, t.length) for t in self.tiers], dtype=np.int64)}
+            for i, t in enumerate(self.tiers):
+                for f in ('ts', 'min', 'max', 'sum', 'count'):
+                    arrays['t%d_%s' % (i, f)] = getattr(t, f)
+                arrays['t%d_head' % i] = np.array(t.head)
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as fh:
+                np.savez(fh, **arrays)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        # restores a saved series with the same metrics and tier layout; False otherwise
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as d:
+            layout = [tuple(x) for x in d['layout'].tolist()]
+            if tuple(d['metrics'].tolist()) != self.metrics or layout != [(t.step, t.length) for t in self.tiers]:
+                return False
+            with self._lock:
+                for i, t in enumerate(self.tiers):
+                    for f in ('ts', 'min', 'max', 'sum', 'count'):
+                        getattr(t, f)[...] = d['t%d_%s' % (i, f)]
+                    t.head = int(d['t%d_head' % i])
+        return True
@@ -0,0 +1,109 @@
+import struct, sys, zlib
+from array import array
+
+# Binary batch format shipped from agents to the aggregator (all little-endian):
+#   b'CTMB' | u8 version | u8 flags (1 = zlib body) | body
+#   body:  u16 host length, host utf-8 | u32 string count, strings (u16 length + utf-8)
+#          u32 snapshot count, then per snapshot:
+#          f64 timestamp, f32 cpu %, f32 memory %, u32 rows, one packed array per column
+# name/user are indexes into the batch string table (-1 = unknown), so repeated process
+# names cost four bytes. Encoding only needs the stdlib; decoding uses numpy.
+
+MAGIC = b'CTMB'
+VERSION = 1
+FLAG_ZLIB = 1
+CONTENT_TYPE = 'application/x-ctm-batch'
+
+# (ProcInfo field, array typecode, numpy dtype)
+COLUMNS = [('pid','I','<u4'), ('name','i','<i4'), ('user','i','<i4'), ('cpu','f','<f4'),
+           ('memory','f','<f4'), ('threads','I','<u4'), ('io_read','Q','<u8'), ('io_write','Q','<u8'),
+           ('ctx_vol','Q','<u8'), ('ctx_invol','Q','<u8'), ('create_time','d','<f8'), ('stale','B','u1')]
+
+_SWAP = sys.byteorder == 'big'
+
+def encode_batch(host, snapshots, compress=True):
+    # snapshots: [(timestamp, cpu %, memory %, [ProcInfo, ...]), ...]
+    strings, index = [], {}
+    def code(s):
+        if s is None:
+            return -1
+        i = index.get(s)
+        if i is None:
+            i = index[s] = len(strings)
+            strings.append(s)
+        return i
+    parts = []
+    for ts, cpu, mem, procs in snapshots:
+        parts.append(struct.pack('<dffI', ts, cpu, mem, len(procs)))
+        for j, (field, tc, _) in enumerate(COLUMNS):
+            if field in ('name', 'user'):
+                values = [code(p[j]) for p in procs]
+            else:
+                values = [p[j] or 0 for p in procs]
+            a = array(tc, values)
+            if _SWAP:
+                a.byteswap()
+            parts.append(a.tobytes())
+    host = host.encode('utf-8')[:255]
+    head = [struct.pack('<H', len(host)), host, struct.pack('<I', len(strings))]
+    for s in strings:
+        b = s.encode('utf-8', 'replace')[:65535]
+        head.append(struct.pack('<H', len(b)))
+        head.append(b)
+    head.append(struct.pack('<I', len(snapshots)))
+    body = b''.join(head + parts)
+    flags = 0
+    if compress:
+        body = zlib.compress(body, 1)
+        flags |= FLAG_ZLIB
+    return MAGIC + struct.pack('<BB', VERSION, flags) + body
+
+def decode_batch(data, max_body=256 << 20):
+    # -> (host, [(timestamp, cpu %, memory %, [ProcInfo, ...]), ...]); ValueError on bad input
+    import numpy as np
+    from .snapshot import ProcInfo
+    try:
+        if data[:4] != MAGIC:
+            raise ValueError('not a CTM batch')
+        version, flags = struct.unpack_from('<BB', data, 4)
+        if version != VERSION:
+            raise ValueError('unsupported batch version %d' % version)
+        body = data[6:]
+        if flags & FLAG_ZLIB:
+            d = zlib.decompressobj()
+            body = d.decompress(body, max_body)
+            if d.unconsumed_tail:
+                raise ValueError('batch too large')
+            if not d.eof:
+                raise ValueError('truncated batch')
+        off = 0
+        (n,) = struct.unpack_from('<H', body, off); off += 2
+        host = bytes(body[off:off + n]).decode('utf-8'); off += n
+        (count,) = struct.unpack_from('<I', body, off); off += 4
+        strings = []
+        for _ in range(count):
+            (n,) = struct.unpack_from('<H', body, off); off += 2
+            strings.append(bytes(body[off:off + n]).decode('utf-8', 'replace')); off += n
+        # a trailing None makes code -1 decode to None
+        table = np.array(strings + [None], dtype=object)
+        (count,) = struct.unpack_from('<I', body, off); off += 4
+        snapshots = []
+        for _ in range(count):
+            ts, cpu, mem, rows = struct.unpack_from('<dffI', body, off); off += 20
+            cols = []
+            for field, _, dt in COLUMNS:
+                a = np.frombuffer(body, dtype=dt, count=rows, offset=off)
+                off += a.nbytes
+                if field in ('name', 'user'):
+                    if rows and (a.min() < -1 or a.max() >= len(strings)):
+                        raise ValueError('bad string index')
+                    a = table[a]
+                elif field in ('cpu', 'memory'):
+                    a = np.round(a.astype(np.float64), 2)
+                elif field == 'stale':
+                    a = a.astype(bool)
+                cols.append(a.tolist())
+            snapshots.append((ts, round(cpu, 2), round(mem, 2), [ProcInfo(*r) for r in zip(*cols)]))
+        return host, snapshots
+    except (struct.error, UnicodeDecodeError, zlib.error) as e:
+        raise ValueError('malformed batch: %s' % e)
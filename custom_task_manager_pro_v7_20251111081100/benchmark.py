@@ -0,0 +1,254 @@
+import os, sys, json, time, argparse, platform, shutil, subprocess, atexit
+import numpy as np
+import psutil
+
+# Offline benchmark for the hot paths: collection, model scoring and the Flask endpoints.
+#   python benchmark.py --procs 500                      synthetic population of sleeping children
+#   python benchmark.py --record snap.json               save the current process table
+#   python benchmark.py --replay snap.json --scale 10    replay it (x10 rows) instead of live /proc
+#   python benchmark.py --compare bench_results/old.json  flag p50/p99 regressions against a saved run
+#   python benchmark.py --skip collection,models,endpoints   cold-start time only
+
+RESULTS_DIR = 'bench_results'
+
+def peak_rss_mb():
+    try:
+        import resource
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(r / (1 << 20) if sys.platform == 'darwin' else r / 1024, 1)
+    except ImportError:
+        return round(psutil.Process().memory_info().peak_wset / (1 << 20), 1)
+
+def spawn_population(n):
+    cmd = [shutil.which('sleep'), '3600'] if shutil.which('sleep') else [sys.executable, '-c', 'import time; time.sleep(3600)']
+    children = [subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for _ in range(n)]
+    def reap():
+        for c in children:
+            c.kill()
+        for c in children:
+            c.wait()
+    atexit.register(reap)
+    return children
+
+def record_snapshot(path):
+    from app.snapshot import ProcessScanner
+    scanner = ProcessScanner()
+    scanner.scan(); time.sleep(0.5)
+    rows = [p._asdict() for p in scanner.scan()]
+    with open(path, 'w') as f:
+        json.dump({'timestamp': time.time(), 'procs': rows}, f)
+    print('Recorded %d processes to %s' % (len(rows), path))
+
+def load_snapshot(path, scale=1):
+    from app.snapshot import Snapshot, ProcInfo
+    with open(path) as f:
+        d = json.load(f)
+    rows = [ProcInfo(**r) for r in d['procs']]
+    # scaled copies get distinct pids so caches and history see separate processes
+    out = [r._replace(pid=r.pid + k * 10000000) for k in range(scale) for r in rows]
+    return Snapshot(1, d['timestamp'], out)
+
+class ReplayEngine:
+    # stands in for SnapshotEngine: every wait() yields the same rows under a new version
+    def __init__(self, snap):
+        self.snapshot = snap
+
+    def wait(self, after_version=0, timeout=None):
+        from app.snapshot import Snapshot
+        self.snapshot = Snapshot(after_version + 1, self.snapshot.timestamp, self.snapshot.procs)
+        return self.snapshot
+
+def measure(name, fn, iterations, rows=None, warmup=2):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter(); fn(); samples.append(time.perf_counter() - t)
+    total = time.perf_counter() - started
+    ms = np.array(samples) * 1000
+    res = {'iterations': iterations, 'p50_ms': round(float(np.percentile(ms, 50)), 3),
+           'p99_ms': round(float(np.percentile(ms, 99)), 3), 'mean_ms': round(float(ms.mean()), 3),
+           'ops_per_s': round(iterations / total, 2), 'peak_rss_mb': peak_rss_mb()}
+    if rows:
+        res['rows'] = rows
+        res['rows_per_s'] = round(rows * iterations / total, 1)
+    print('%-32s p50 %9.3f ms  p99 %9.3f ms  %10.1f ops/s' % (name, res['p50_ms'], res['p99_ms'], res['ops_per_s']))
+    return res
+
+def bench_collection(snap, iterations, replay):
+    from app.collector import Collector
+    from app.monitor import SystemMonitor
+    from app.snapshot import ProcessScanner
+    out = {}
+    if replay:
+        collector = Collector(engine=ReplayEngine(snap), backend=_NullBackend())
+    else:
+        collector = Collector(backend=_NullBackend())
+        scanner = ProcessScanner()
+        out['ProcessScanner.scan'] = measure('ProcessScanner.scan', scanner.scan, iterations, rows=len(snap))
+        scanner.close()
+    out['Collector.gather'] = measure('Collector.gather', collector.gather, iterations, rows=len(snap))
+    mon = SystemMonitor()
+    out['SystemMonitor.sample'] = measure('SystemMonitor.sample', mon.sample, iterations)
+    return out
+
+class _NullBackend:
+    def write_rows(self, rows):
+        pass
+
+def bench_models(snap, iterations):
+    from app.categorizer import Categorizer
+    from app.anomaly_detector import AnomalyDetector
+    from app.predictor import LifetimePredictor
+    from app.snapshot import FEATURES
+    cat, anom, life = Categorizer(), AnomalyDetector(), LifetimePredictor()
+    X, names = snap.features(), snap.names()
+    info = dict(zip(FEATURES, X[0]), name=names[0]) if len(X) else {}
+    n = len(X)
+    out = {'models_loaded': {'categorizer': cat.model is not None, 'anomaly': anom.model is not None,
+                             'lifetime': life.model is not None}}
+    out['Categorizer.predict'] = measure('Categorizer.predict', lambda: cat.predict(info), iterations)
+    out['Categorizer.predict_many'] = measure('Categorizer.predict_many', lambda: cat.predict_many(X, names), iterations, rows=n)
+    out['AnomalyDetector.score'] = measure('AnomalyDetector.score', lambda: anom.score(info), iterations)
+    out['AnomalyDetector.score_many'] = measure('AnomalyDetector.score_many', lambda: anom.score_many(X), iterations, rows=n)
+    out['LifetimePredictor.predict'] = measure('LifetimePredictor.predict', lambda: life.predict(info), iterations)
+    out['LifetimePredictor.predict_many'] = measure('LifetimePredictor.predict_many', lambda: life.predict_many(X), iterations, rows=n)
+    return out
+
+def bench_endpoints(snap, iterations):
+    from app import create_app
+    # threads never start, so every request sees the same frozen snapshot
+    app = create_app({'CTM_COLLECT': False, 'CTM_PRELOAD_MODELS': True}, start=False)
+    services = app.extensions['ctm']
+    services.engine.snapshot = snap
+    client = app.test_client()
+    pid = snap.procs[0].pid if len(snap) else 0
+    routes = ['/api/overview', '/api/processes', '/api/processes?limit=50&sort=cpu',
+              '/api/processes?min_anomaly=50&limit=50', '/api/process/%d' % pid,
+              '/api/export?start=%d' % int(time.time() - 60)]
+    out = {}
+    for route in routes:
+        def call(route=route):
+            services._table_cache = (None, [])
+            client.get(route).get_data()
+        out['GET ' + route] = measure('GET ' + route[:28], call, iterations)
+    return out
+
+STARTUP_PROBE = '''
+import time, json, sys
+t0 = time.perf_counter()
+from app import create_app
+t1 = time.perf_counter()
+app = create_app()
+t2 = time.perf_counter()
+status = app.test_client().get('/api/overview').status_code
+t3 = time.perf_counter()
+print(json.dumps({'import_ms': (t1 - t0) * 1000, 'create_app_ms': (t2 - t1) * 1000,
+                  'first_overview_ms': (t3 - t2) * 1000, 'status': status,
+                  'heavy_modules': sorted(m for m in ('pandas', 'sklearn', 'joblib') if m in sys.modules)}))
+'''
+
+def bench_startup(runs):
+    # cold start in a fresh interpreter until the first /api/overview response, with an empty
+    # model directory (heuristics only) and with the trained models in app/models/
+    import tempfile
+    out = {}
+    empty = tempfile.mkdtemp(prefix='ctm-nomodels-')
+    for case, model_dir in (('no_models', empty), ('models', None)):
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+        env.pop('CTM_MODEL_DIR', None)
+        if model_dir:
+            env['CTM_MODEL_DIR'] = model_dir
+        samples, probes = [], []
+        for _ in range(runs):
+            t = time.perf_counter()
+            res = subprocess.run([sys.executable, '-c', STARTUP_PROBE], env=env, capture_output=True, text=True)
+            samples.append((time.perf_counter() - t) * 1000)
+            if res.returncode != 0:
+                raise RuntimeError('startup probe failed: ' + res.stderr[-500:])
+            probes.append(json.loads(res.stdout.strip().splitlines()[-1]))
+        ms = np.array(samples)
+        res = {'iterations': runs, 'p50_ms': round(float(np.percentile(ms, 50)), 3),
+               'p99_ms': round(float(np.percentile(ms, 99)), 3), 'mean_ms': round(float(ms.mean()), 3),
+               'heavy_modules': probes[-1]['heavy_modules']}
+        for k in ('import_ms', 'create_app_ms', 'first_overview_ms'):
+            res[k] = round(float(np.median([p[k] for p in probes])), 3)
+        print('%-32s p50 %9.3f ms  (import %.0f, create_app %.0f, first request %.0f ms) heavy: %s' % (
+            'startup ' + case, res['p50_ms'], res['import_ms'], res['create_app_ms'],
+            res['first_overview_ms'], ','.join(res['heavy_modules']) or '-'))
+        out['startup ' + case] = res
+    shutil.rmtree(empty, ignore_errors=True)
+    return out
+
+def compare(report, baseline_path, threshold):
+    with open(baseline_path) as f:
+        base = json.load(f)
+    regressions = []
+    print('\nvs %s' % baseline_path)
+    for section in ('startup', 'collection', 'models', 'endpoints'):
+        for name, cur in report.get(section, {}).items():
+            old = base.get(section, {}).get(name)
+            if not isinstance(cur, dict) or not isinstance(old, dict) or 'p50_ms' not in cur:
+                continue
+            for k in ('p50_ms', 'p99_ms'):
+                ratio = cur[k] / old[k] if old[k] else 1.0
+                flag = ' REGRESSION' if ratio > threshold else ''
+                if flag:
+                    regressions.append((name, k, ratio))
+                print('%-40s %s %9.3f -> %9.3f (x%.2f)%s' % (name[:40], k, old[k], cur[k], ratio, flag))
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark collection, scoring and API endpoints')
+    ap.add_argument('--procs', type=int, default=0, help='spawn this many synthetic sleeping processes')
+    ap.add_argument('--replay', help='replay a recorded snapshot instead of scanning /proc')
+    ap.add_argument('--scale', type=int, default=1, help='multiply the replayed process table')
+    ap.add_argument('--record', help='record the current process table to this file and exit')
+    ap.add_argument('--iterations', type=int, default=50)
+    ap.add_argument('--skip', default='', help='comma list of sections to skip: startup,collection,models,endpoints')
+    ap.add_argument('--out', help='report path (default bench_results/bench-<time>.json)')
+    ap.add_argument('--compare', help='earlier report to compare against')
+    ap.add_argument('--threshold', type=float, default=1.25, help='ratio counted as a regression')
+    args = ap.parse_args()
+
+    if args.record:
+        record_snapshot(args.record)
+        return 0
+    if args.procs:
+        spawn_population(args.procs)
+        time.sleep(0.5)
+    if args.replay:
+        snap = load_snapshot(args.replay, args.scale)
+    else:
+        from app.snapshot import ProcessScanner, Snapshot
+        scanner = ProcessScanner()
+        scanner.scan(); time.sleep(0.5)
+        snap = Snapshot(1, time.time(), scanner.scan())
+        scanner.close()
+    skip = set(filter(None, args.skip.split(',')))
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'platform': platform.platform(), 'cpus': os.cpu_count(), 'processes': len(snap),
+              'synthetic': args.procs, 'replay': args.replay, 'iterations': args.iterations}
+    print('Benchmarking with %d processes, %d iterations' % (len(snap), args.iterations))
+    if 'startup' not in skip:
+        report['startup'] = bench_startup(min(args.iterations, 5))
+    if 'collection' not in skip:
+        report['collection'] = bench_collection(snap, args.iterations, bool(args.replay))
+    if 'models' not in skip:
+        report['models'] = bench_models(snap, args.iterations)
+    if 'endpoints' not in skip:
+        report['endpoints'] = bench_endpoints(snap, args.iterations)
+    report['peak_rss_mb'] = peak_rss_mb()
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = args.out or os.path.join(RESULTS_DIR, 'bench-%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Peak RSS %.1f MB; report saved to %s' % (report['peak_rss_mb'], out))
+    if args.compare:
+        if compare(report, args.compare, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import os, sys, time, threading, subprocess, multiprocessing
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+# The master starts one sampler process (python -m app.sampler) that scans, scores and collects,
+# and every worker serves read-only from its shared memory, so adding workers adds request
+# capacity without extra /proc scans or model copies. An open /api/stream (server-sent events)
+# holds one worker thread for as long as the dashboard stays open, so each worker accepts at
+# most CTM_STREAM_MAX streams (default: half its threads) and keeps the other threads for plain
+# requests; refused dashboards fall back to polling. Raise CTM_THREADS for more live viewers.
+
+bind = os.environ.get('CTM_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('CTM_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('CTM_THREADS', 8))
+timeout = 60
+raw_env = ['CTM_ROLE=worker', 'CTM_STREAM_MAX=%d' % int(os.environ.get('CTM_STREAM_MAX', max(1, threads // 2)))]
+chdir = os.path.dirname(os.path.abspath(__file__))
+
+_sampler = None
+_stopping = threading.Event()
+
+def _spawn(server):
+    global _sampler
+    env = dict(os.environ, CTM_ROLE='sampler')
+    cmd = [sys.executable, '-m', 'app.sampler']
+    if os.environ.get('CTM_SAMPLER_PORT'):
+        # agents (python -m app.agent --server http://<host>:<port>) report here
+        cmd += ['--host', os.environ.get('CTM_SAMPLER_HOST', '127.0.0.1'), '--port', os.environ['CTM_SAMPLER_PORT']]
+    _sampler = subprocess.Popen(cmd, cwd=chdir, env=env)
+    server.log.info('Started sampler (pid %d)', _sampler.pid)
+
+def _supervise(server):
+    # restart the sampler if it dies; workers keep serving the last published tick (reported as
+    # stale by /api/overview and /api/ready) until the new one publishes. Backs off while it
+    # keeps failing right after start.
+    delay, started = 0.5, time.time()
+    while not _stopping.wait(1):
+        code = _sampler.poll()
+        if code is None:
+            continue
+        delay = 1 if time.time() - started > 60 else min(delay * 2, 60)
+        server.log.error('Sampler exited with status %s; restarting in %.1fs', code, delay)
+        if _stopping.wait(delay):
+            break
+        started = time.time()
+        _spawn(server)
+
+def on_starting(server):
+    _spawn(server)
+
+def when_ready(server):
+    threading.Thread(target=_supervise, args=(server,), name='sampler-supervisor', daemon=True).start()
+
+def on_exit(server):
+    _stopping.set()
+    if _sampler is not None and _sampler.poll() is None:
+        _sampler.terminate()
+        try:
+            _sampler.wait(10)
+        except subprocess.TimeoutExpired:
+            _sampler.kill()
+    # /dev/shm is memory; nothing reads the file once the workers are gone
+    from app.shared import SHM_PATH
+    path = os.environ.get('CTM_SHARED') or SHM_PATH
+    if os.path.exists(path):
+        os.remove(path)
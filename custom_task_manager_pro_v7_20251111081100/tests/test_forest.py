@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor, IsolationForest
+from app.forest import compile_model, save, CompiledForest
+
+# compiled forests must reproduce sklearn exactly: they replace the joblib models at load time
+
+def _data(n=400, d=8, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, d)) * [1, 10, 100, 1e3, 1e4, 1, 5, 50]
+    return X, rng
+
+def _compiled(model, tmp_path):
+    arrays, meta = compile_model(model)
+    save(str(tmp_path / 'm.forest'), arrays, meta)
+    return CompiledForest(str(tmp_path / 'm.forest'))
+
+def test_classifier_matches_sklearn(tmp_path):
+    X, rng = _data()
+    y = np.array(['browser', 'script', 'system'])[(X[:, 0] > 0).astype(int) + (X[:, 1] > 5)]
+    clf = RandomForestClassifier(n_estimators=25, random_state=0).fit(X, y)
+    cf = _compiled(clf, tmp_path)
+    Xt, _ = _data(200, seed=1)
+    np.testing.assert_allclose(cf.predict_proba(Xt), clf.predict_proba(Xt), rtol=0, atol=1e-12)
+    assert list(cf.predict(Xt)) == list(clf.predict(Xt))
+
+def test_regressor_matches_sklearn(tmp_path):
+    X, rng = _data()
+    y = X[:, 0] * 3 + X[:, 2] / 100 + rng.normal(size=len(X))
+    reg = RandomForestRegressor(n_estimators=25, random_state=0).fit(X, y)
+    cf = _compiled(reg, tmp_path)
+    Xt, _ = _data(200, seed=1)
+    np.testing.assert_allclose(cf.predict(Xt), reg.predict(Xt), rtol=1e-12)
+
+@pytest.mark.parametrize('max_features', [1.0, 0.5])
+def test_isolation_forest_matches_sklearn(tmp_path, max_features):
+    X, _ = _data()
+    iso = IsolationForest(n_estimators=50, max_features=max_features, random_state=0).fit(X)
+    cf = _compiled(iso, tmp_path)
+    Xt, _ = _data(200, seed=1)
+    np.testing.assert_allclose(cf.score_samples(Xt), iso.score_samples(Xt), rtol=1e-12)
+    np.testing.assert_allclose(cf.decision_function(Xt), iso.decision_function(Xt), rtol=1e-9, atol=1e-12)
@@ -0,0 +1,82 @@
+import sys
+import pytest
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='shared-memory mode is POSIX only')
+
+from app.snapshot import Snapshot, ProcInfo
+from app.shared import Arena, SnapshotPublisher, SharedReader, _ACTIVE
+
+def _snap(version, names):
+    procs = [ProcInfo(100 + i, n, 'root', 1.5, 0.5, 2, 0, 0, 0, 0, 1700000000.0 + i) for i, n in enumerate(names)]
+    return Snapshot(version, 1700000000.0 + version, procs)
+
+def _publish(pub, snap):
+    n = len(snap.procs)
+    pub.publish(snap, {'category': ['other'] * n, 'anomaly': [42] * n, 'lifetime': [-1] * n},
+                {'overview': {'cpu': snap.version}})
+
+@pytest.fixture
+def shm(tmp_path):
+    path = str(tmp_path / 'ctm.shm')
+    arena = Arena(path, size=16 << 20)
+    pub = SnapshotPublisher(arena, max_rows=64, string_bytes=4096, blob_bytes=4096)
+    arena.finish()
+    reader = SharedReader(path)
+    yield pub, reader
+    arena.close()
+
+def test_reads_published_snapshot(shm):
+    pub, reader = shm
+    _publish(pub, _snap(1, ['init', 'bash']))
+    view = reader.view()
+    assert view.snapshot.version == 1
+    assert [p.name for p in view.snapshot.procs] == ['init', 'bash']
+    assert view.rows()[1] == {'pid': 101, 'name': 'bash', 'user': 'root', 'cpu': 1.5, 'memory': 0.5,
+                              'threads': 2, 'category': 'other', 'anomaly': 42, 'stale': False}
+    assert view.blob['overview'] == {'cpu': 1}
+
+def test_retries_a_torn_copy(shm, monkeypatch):
+    # the writer rewrites the slot while the reader copies it: the copy holds garbage, so it must be
+    # discarded on the seq re-check and never decoded (decoding it would raise or return junk)
+    pub, reader = shm
+    _publish(pub, _snap(1, ['init']))
+    assert reader.view().snapshot.version == 1
+    _publish(pub, _snap(2, ['init', 'sshd']))
+    real_copy, calls = reader._copy, []
+    def torn_copy(slot, meta):
+        calls.append(1)
+        if len(calls) > 1:
+            return real_copy(slot, meta)
+        w = pub.slots[int(pub.arena.header[_ACTIVE])]  # the same slot, writable
+        saved = w['strings'][:8].copy(), w['blob'][:8].copy(), w['rows']['name'][:2].copy()
+        w['strings'][:8] = 0xff                         # invalid utf-8
+        w['blob'][:8] = ord('{')                        # invalid JSON
+        w['rows']['name'][:2] = 1 << 20                 # string index out of range
+        torn = real_copy(slot, meta)
+        w['strings'][:8], w['blob'][:8], w['rows']['name'][:2] = saved
+        w['meta'][0]['seq'] += 2                        # a complete write happened meanwhile
+        return torn
+    monkeypatch.setattr(reader, '_copy', torn_copy)
+    view = reader.view()
+    assert len(calls) == 2
+    assert view.snapshot.version == 2
+    assert [p.name for p in view.snapshot.procs] == ['init', 'sshd']
+
+def test_keeps_last_view_while_slot_is_written(shm):
+    pub, reader = shm
+    _publish(pub, _snap(1, ['init']))
+    assert reader.view().snapshot.version == 1
+    _publish(pub, _snap(2, ['init', 'cron']))
+    active = pub.slots[int(pub.arena.header[_ACTIVE])]['meta'][0]
+    active['seq'] += 1                                  # odd: the writer never finishes
+    assert reader.view().snapshot.version == 1
+    active['seq'] += 1
+    assert reader.view().snapshot.version == 2
+
+def test_undecodable_slot_does_not_raise(shm):
+    pub, reader = shm
+    _publish(pub, _snap(1, ['init']))
+    assert reader.view().snapshot.version == 1
+    _publish(pub, _snap(2, ['init']))
+    pub.slots[int(pub.arena.header[_ACTIVE])]['strings'][:4] = 0xff
+    assert reader.view().snapshot.version == 1
@@ -0,0 +1,53 @@
+import struct, zlib
+import pytest
+from app.snapshot import ProcInfo
+from app.wire import encode_batch, decode_batch, MAGIC, VERSION
+
+PROCS = [ProcInfo(1, 'systemd', 'root', 0.5, 0.12, 1, 1 << 40, 7, 100, 3, 1700000000.25),
+         ProcInfo(4242, 'python3', None, 12.34, 2.5, 8, 0, 0, 0, 0, 1700000100.5, True),
+         ProcInfo(4243, None, 'alice', 0.0, 0.0, 0, 0, 0, 0, 0, 0.0),
+         ProcInfo(4244, 'naïve ✓', 'alice', 99.99, 50.0, 300, 12, 34, 56, 78, 1700000200.0)]
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_round_trip(compress):
+    snaps = [(1700000300.5, 12.5, 40.25, PROCS), (1700000302.5, 0.0, 0.0, [])]
+    host, out = decode_batch(encode_batch('host-1', snaps, compress=compress))
+    assert host == 'host-1'
+    assert len(out) == 2
+    ts, cpu, mem, procs = out[0]
+    assert (ts, cpu, mem) == (1700000300.5, 12.5, 40.25)
+    assert procs == PROCS
+    assert out[1] == (1700000302.5, 0.0, 0.0, [])
+
+def _frame(body, flags=0, version=VERSION):
+    return MAGIC + struct.pack('<BB', version, flags) + body
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'XXXX' + b'\0' * 10,
+    _frame(b'', version=VERSION + 1),
+    _frame(b'\x05\x00ab'),                                   # host shorter than its length
+    _frame(b'not zlib at all', flags=1),
+    _frame(zlib.compress(b'\x01\x00h\x00\x00\x00\x00')[:-3], flags=1),  # truncated stream
+])
+def test_rejects_malformed_frames(data):
+    with pytest.raises(ValueError):
+        decode_batch(data)
+
+def test_rejects_truncated_columns():
+    data = encode_batch('h', [(1.0, 0.0, 0.0, PROCS)], compress=False)
+    with pytest.raises(ValueError):
+        decode_batch(data[:-5])
+
+def test_rejects_bad_string_index():
+    raw = encode_batch('h', [(1.0, 0.0, 0.0, PROCS[:1])], compress=False)
+    # body: host, 2 strings ('systemd', 'root'), 1 snapshot header, then pid and name columns
+    off = 6 + 2 + 1 + 4 + (2 + 7) + (2 + 4) + 4 + 20 + 4
+    bad = raw[:off] + struct.pack('<i', 5) + raw[off + 4:]
+    with pytest.raises(ValueError):
+        decode_batch(bad)
+
+def test_rejects_oversized_body():
+    data = encode_batch('h', [(1.0, 0.0, 0.0, PROCS * 50)])
+    with pytest.raises(ValueError):
+        decode_batch(data, max_body=1000)
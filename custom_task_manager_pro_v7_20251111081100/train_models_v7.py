@@ -1,9 +1,15 @@
-import os, joblib, pandas as pd, numpy as np
+import os, sys, time, json, argparse, joblib, pandas as pd, numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor, IsolationForest
 from sklearn.preprocessing import StandardScaler
 
+from app import logstore
+from app.logstore import HEADER, get_backend, migration_state, ColumnarBackend
+
 LOG_PATH = os.path.join('logs','system_data_behavioral.csv')
 APP_MODEL_DIR = os.path.join('app','models')
+STATE_PATH = os.path.join(APP_MODEL_DIR, 'train_state.json')
+REPORT_PATH = os.path.join(APP_MODEL_DIR, 'train_report.json')
 os.makedirs(APP_MODEL_DIR, exist_ok=True)
 
 SAMPLE = [
@@ -12,72 +18,267 @@ SAMPLE = [
     {'name':'svchost.exe','category':'system','uptime':10000,'cpu':1,'memory':0.8,'threads':50,'io_read':10,'io_write':5,'ctx_vol':200,'ctx_invol':10},
 ]
 
+def map_cat(n):
+    n=n.lower()
+    if 'chrome' in n or 'firefox' in n: return 'browser'
+    if 'python' in n or 'node' in n: return 'script'
+    if 'svchost' in n or 'system' in n: return 'system'
+    if 'vlc' in n or 'spotify' in n: return 'media'
+    if 'mysql' in n or 'mongod' in n or 'sql' in n: return 'database'
+    if 'code' in n or 'pycharm' in n: return 'ide'
+    if 'onedrive' in n or 'backup' in n: return 'utility'
+    if 'steam' in n or 'valorant' in n: return 'game'
+    if 'defender' in n or 'kaspersky' in n: return 'security'
+    return 'other'
+
+def iter_log(start=None, chunksize=100000):
+    # configured backend, plus the rows of a legacy CSV that have not been migrated into it yet
+    backend = get_backend()
+    if isinstance(backend, ColumnarBackend) and os.path.exists(LOG_PATH) and not migration_state(LOG_PATH, backend)[1]:
+        print('Reading legacy CSV log; run `python -m app.logstore migrate` to convert it')
+    return logstore.iter_log(backend, start=start, chunksize=chunksize, csv_path=LOG_PATH)
+
+def read_log():
+    chunks = list(iter_log())
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=HEADER)
+
+def prepare(df):
+    df = df.dropna()
+    df['name_clean'] = df['name'].fillna('unknown').astype(str)
+    try:
+        df['timestamp'] = pd.to_datetime(df['timestamp'], format='mixed', errors='coerce')
+    except Exception:
+        df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+    df = df.dropna(subset=['timestamp'])
+    df['uptime'] = (pd.Timestamp.now() - df['timestamp']).dt.total_seconds().abs()
+    df = df.rename(columns={'io_read_bytes':'io_read','io_write_bytes':'io_write'})
+    return df
+
 def load_data():
-    if os.path.exists(LOG_PATH):
-        df = pd.read_csv(LOG_PATH)
+    df = read_log()
+    if df.shape[0] > 0:
         if df.shape[0] < 50:
             print('Not enough behavioral log rows, using sample data. Collected rows:', df.shape[0])
             return pd.DataFrame(SAMPLE)
-        df = df.dropna()
-        df['name_clean'] = df['name'].fillna('unknown').astype(str)
-        try:
-            df['timestamp'] = pd.to_datetime(df['timestamp'], format='mixed', errors='coerce')
-        except Exception:
-            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-        df = df.dropna(subset=['timestamp'])
-        df['uptime'] = (pd.Timestamp.now() - df['timestamp']).dt.total_seconds().abs()
-        df = df.rename(columns={'io_read_bytes':'io_read','io_write_bytes':'io_write'})
-        return df
+        return prepare(df)
     else:
         print('No behavioral logs found; using sample data')
         return pd.DataFrame(SAMPLE)
 
-def train_categorizer(df):
+class Reservoir:
+    # uniform sample of fixed size over a stream of DataFrame chunks (algorithm R, vectorized per chunk)
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.seen = 0
+        self.frame = None
+
+    def add(self, df):
+        if not len(df):
+            return
+        have = 0 if self.frame is None else len(self.frame)
+        room = max(0, self.size - have)
+        if room:
+            head = df.iloc[:room]
+            self.frame = head if self.frame is None else pd.concat([self.frame, head], ignore_index=True)
+            self.seen += len(head)
+            df = df.iloc[room:]
+        if not len(df):
+            return
+        t = self.seen + np.arange(1, len(df) + 1)
+        rows = np.flatnonzero(self.rng.random(len(df)) < self.size / t)
+        self.seen += len(df)
+        if not len(rows):
+            return
+        # replay replacements in stream order; a slot hit twice keeps the later row
+        src = np.full(self.size, -1)
+        src[self.rng.integers(0, self.size, len(rows))] = rows
+        slots = np.flatnonzero(src >= 0)
+        kept = self.frame.drop(self.frame.index[slots])
+        self.frame = pd.concat([kept, df.iloc[src[slots]]], ignore_index=True)
+
+class StratifiedReservoir:
+    # one reservoir per category so rare categories survive sampling
+    def __init__(self, size, rng, strata=10):
+        self.quota = max(1, size // strata)
+        self.rng = rng
+        self.parts = {}
+
+    @property
+    def seen(self):
+        return sum(r.seen for r in self.parts.values())
+
+    def add(self, df):
+        for cat, part in df.groupby(df['name_clean'].map(map_cat)):
+            self.parts.setdefault(cat, Reservoir(self.quota, self.rng)).add(part)
+
+    @property
+    def frame(self):
+        frames = [r.frame for r in self.parts.values() if r.frame is not None]
+        return pd.concat(frames, ignore_index=True) if frames else None
+
+def stream_sample(size, start=None, stratify=False, chunksize=100000, seed=42):
+    # one pass over the log in chunks; memory is bounded by the sample size, not the log size
+    rng = np.random.default_rng(seed)
+    res = StratifiedReservoir(size, rng) if stratify else Reservoir(size, rng)
+    until = start
+    for chunk in iter_log(start=start, chunksize=chunksize):
+        chunk = prepare(chunk)
+        if len(chunk):
+            ts = (chunk['timestamp'].max() - pd.Timestamp(0)).total_seconds()
+            until = ts if until is None else max(until, ts)
+        res.add(chunk)
+    return res.frame, res.seen, until
+
+def _refit(path, model, add_trees, compatible=lambda m: True):
+    # warm start: grow the saved forest with trees fitted on the new data only
+    if add_trees and os.path.exists(path):
+        old = joblib.load(path)
+        old = old[0] if isinstance(old, tuple) else old
+        if compatible(old):
+            old.set_params(warm_start=True, n_estimators=old.n_estimators + add_trees)
+            return old, True
+        print('Saved model in %s is not compatible with the new data; retraining it from scratch' % path)
+    return model, False
+
+def train_categorizer(df, n_jobs=None, add_trees=0):
     X = df[['cpu','memory','threads','io_read','io_write','ctx_vol','ctx_invol','uptime']]
     if 'category' not in df.columns:
-        def map_cat(n):
-            n=n.lower()
-            if 'chrome' in n or 'firefox' in n: return 'browser'
-            if 'python' in n or 'node' in n: return 'script'
-            if 'svchost' in n or 'system' in n: return 'system'
-            if 'vlc' in n or 'spotify' in n: return 'media'
-            if 'mysql' in n or 'mongod' in n or 'sql' in n: return 'database'
-            if 'code' in n or 'pycharm' in n: return 'ide'
-            if 'onedrive' in n or 'backup' in n: return 'utility'
-            if 'steam' in n or 'valorant' in n: return 'game'
-            if 'defender' in n or 'kaspersky' in n: return 'security'
-            return 'other'
         y = df['name_clean'].apply(map_cat)
     else:
         y = df['category']
-    clf = RandomForestClassifier(n_estimators=200, random_state=42)
+    path = os.path.join(APP_MODEL_DIR,'categorizer.joblib')
+    clf, warm = _refit(path, RandomForestClassifier(n_estimators=200, random_state=42), add_trees,
+                       compatible=lambda m: set(m.classes_) == set(y))
+    clf.set_params(n_jobs=n_jobs)
     clf.fit(X, y)
-    joblib.dump(clf, os.path.join(APP_MODEL_DIR,'categorizer.joblib'))
-    print('Saved categorizer model to app/models/')
+    clf.set_params(n_jobs=None)
+    joblib.dump(clf, path)
+    print('Saved categorizer model to app/models/' + (' (warm start, %d trees)' % clf.n_estimators if warm else ''))
 
-def train_lifetime(df):
+def train_lifetime(df, n_jobs=None, add_trees=0):
     X = df[['uptime','cpu','memory','threads','io_read','io_write']]
     y = (df['uptime'] * 0.05 + (100 - df['cpu']) * 8 - df['memory']*2).clip(1,86400)
-    reg = RandomForestRegressor(n_estimators=200, random_state=42)
+    path = os.path.join(APP_MODEL_DIR,'lifetime.joblib')
+    reg, warm = _refit(path, RandomForestRegressor(n_estimators=200, random_state=42), add_trees)
+    reg.set_params(n_jobs=n_jobs)
     reg.fit(X, y)
-    joblib.dump(reg, os.path.join(APP_MODEL_DIR,'lifetime.joblib'))
-    print('Saved lifetime model to app/models/')
+    reg.set_params(n_jobs=None)
+    joblib.dump(reg, path)
+    print('Saved lifetime model to app/models/' + (' (warm start, %d trees)' % reg.n_estimators if warm else ''))
 
-def train_anomaly(df):
+def train_anomaly(df, n_jobs=None, add_trees=0):
     X = df[['cpu','memory','threads','io_read','io_write','ctx_vol','ctx_invol']].fillna(0)
-    scaler = StandardScaler()
-    Xs = scaler.fit_transform(X)
-    iso = IsolationForest(n_estimators=300, contamination=0.03, random_state=42)
+    path = os.path.join(APP_MODEL_DIR,'anomaly.joblib')
+    iso, warm = _refit(path, IsolationForest(n_estimators=300, contamination=0.03, random_state=42), add_trees)
+    if warm:
+        # new trees must see data in the space the old ones were fitted in
+        scaler = joblib.load(path)[1]
+        Xs = scaler.transform(X)
+    else:
+        scaler = StandardScaler()
+        Xs = scaler.fit_transform(X)
+    iso.set_params(n_jobs=n_jobs)
     iso.fit(Xs)
+    iso.set_params(n_jobs=None)
     decisions = iso.decision_function(Xs)
     mean_dec = float(np.mean(decisions))
     std_dec = float(np.std(decisions, ddof=1))
-    joblib.dump((iso, scaler, mean_dec, std_dec), os.path.join(APP_MODEL_DIR,'anomaly.joblib'))
-    print('Saved anomaly model and scaler (with mean/std) to app/models/')
+    joblib.dump((iso, scaler, mean_dec, std_dec), path)
+    print('Saved anomaly model and scaler (with mean/std) to app/models/' + (' (warm start, %d trees)' % iso.n_estimators if warm else ''))
 
-if __name__ == '__main__':
-    df = load_data()
-    train_categorizer(df)
-    train_lifetime(df)
-    train_anomaly(df)
+TRAINERS = {'categorizer': train_categorizer, 'lifetime': train_lifetime, 'anomaly': train_anomaly}
+
+def _timed(name, df, n_jobs, add_trees):
+    started = time.time()
+    TRAINERS[name](df, n_jobs, add_trees)
+    return name, time.time() - started
+
+def train_all(df, jobs=None, add_trees=0, parallel=True):
+    # the three fits are independent: run them in separate processes and split the cores between them
+    jobs = jobs or os.cpu_count() or 1
+    per_model = max(1, jobs // len(TRAINERS))
+    timings = {}
+    if parallel and jobs > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(TRAINERS))) as pool:
+            futures = [pool.submit(_timed, name, df, per_model, add_trees) for name in TRAINERS]
+            for fut in futures:
+                name, secs = fut.result()
+                timings[name] = secs
+    else:
+        for name in TRAINERS:
+            timings[name] = _timed(name, df, jobs, add_trees)[1]
+    return timings
+
+def _state():
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    return {}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Train the v7 categorizer, lifetime and anomaly models')
+    ap.add_argument('--stream', action='store_true', help='read the log in chunks and train on a bounded sample')
+    ap.add_argument('--sample', type=int, default=200000, help='sample size for --stream/--refresh')
+    ap.add_argument('--stratify', action='store_true', help='sample per category instead of uniformly')
+    ap.add_argument('--chunksize', type=int, default=100000)
+    ap.add_argument('--refresh', action='store_true', help='add trees fitted on rows logged since the last run')
+    ap.add_argument('--add-trees', type=int, default=20, help='trees added per model by --refresh')
+    ap.add_argument('--jobs', type=int, default=None, help='cores to use (default: all)')
+    ap.add_argument('--serial', action='store_true', help='train the models one after another')
+    ap.add_argument('--compile', action='store_true', help='also export memory-mappable compiled forests')
+    args = ap.parse_args(argv)
+
+    report = {'mode': 'refresh' if args.refresh else 'stream' if args.stream else 'full', 'stages': {}}
+    started = time.time()
+    state = _state()
+    start = state.get('trained_until') if args.refresh else None
+    if start is not None:
+        start += 1e-6  # rows at the watermark were already trained on
+    if args.refresh and start is None:
+        print('No previous training run recorded; doing a full streamed training instead')
+        args.refresh = False
+    if args.stream or args.refresh:
+        df, seen, until = stream_sample(args.sample, start, args.stratify, args.chunksize)
+        report['rows_seen'] = seen
+        if df is None or len(df) < 50:
+            if args.refresh:
+                print('Only %d new rows since the last run; nothing to refresh' % (0 if df is None else len(df)))
+                return 0
+            print('Not enough behavioral log rows, using sample data. Collected rows:', 0 if df is None else len(df))
+            df, until = pd.DataFrame(SAMPLE), None
+    else:
+        df = load_data()
+        until = (df['timestamp'].max() - pd.Timestamp(0)).total_seconds() if 'timestamp' in df.columns and len(df) else None
+        report['rows_seen'] = len(df)
+    report['rows_trained'] = len(df)
+    report['stages']['load'] = time.time() - started
+    print('[load] %d rows sampled from %d in %.2fs' % (len(df), report['rows_seen'], report['stages']['load']))
+
+    fit_started = time.time()
+    timings = train_all(df, args.jobs, args.add_trees if args.refresh else 0, parallel=not args.serial)
+    for name, secs in timings.items():
+        print('[%s] %.2fs' % (name, secs))
+    report['stages'].update(timings)
+    report['stages']['fit_wall'] = time.time() - fit_started
+    if args.compile:
+        from app.forest import compile_file
+        compile_started = time.time()
+        for name in TRAINERS:
+            out, meta = compile_file(os.path.join(APP_MODEL_DIR, name + '.joblib'))
+            print('[compile] %s: %d trees -> %s' % (name, meta['trees'], out))
+        report['stages']['compile'] = time.time() - compile_started
+    report['stages']['total'] = time.time() - started
+    report['stages'] = {k: round(v, 3) for k, v in report['stages'].items()}
+    if until is not None:
+        state['trained_until'] = max(until, state.get('trained_until') or 0)
+        with open(STATE_PATH, 'w') as f:
+            json.dump(state, f)
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('[total] %.2fs (fit wall %.2fs)' % (report['stages']['total'], report['stages']['fit_wall']))
     print('All v7 models trained and saved to app/models/')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
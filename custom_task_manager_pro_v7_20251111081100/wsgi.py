@@ -0,0 +1,5 @@
+from app import create_app
+
+# WSGI entry point. Under gunicorn.conf.py every worker runs with CTM_ROLE=worker and reads
+# the sampler's shared memory; on its own it is a regular standalone app.
+app = create_app()